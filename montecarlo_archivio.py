@@ -0,0 +1,133 @@
+import json
+import os
+
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT, inizializza_stato, avanza_stato, risultati_da_stato
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati
+
+# File dell'archivio, tutti nella stessa cartella
+FILE_CURVE = 'curve.f32'
+FILE_BANCAROTTA = 'bancarotta.npy'
+FILE_METADATI = 'metadati.json'
+
+# Memoria massima (in byte) letta in un colpo solo dalle funzioni di analisi
+MEMORIA_BLOCCO = 256 * 2 ** 20
+
+
+def _scrivi_shard(argomenti):
+    cartella, forma, inizio, n, parametri, seme = argomenti
+    # Ogni shard scrive solo le sue righe: i processi non si sovrappongono mai.
+    # Il motore scrive il capitale direttamente nelle righe del file, senza passare
+    # da uno storico float64 in memoria (stessi numeri casuali di simula_batch)
+    curve = np.memmap(os.path.join(cartella, FILE_CURVE), dtype=np.float32, mode='r+', shape=forma)
+    righe = curve[inizio:inizio + n]
+    righe[:] = np.nan
+    righe[:, 0] = parametri['capitale_iniziale']
+    stato = inizializza_stato(n, parametri)
+    avanza_stato(stato, parametri, parametri['n_scambi'], np.random.default_rng(seme), storico=righe)
+    curve.flush()
+    del righe, curve
+    return risultati_da_stato(stato)
+
+
+def simula_su_disco(cartella, n_simulazioni, parametri=None, seed=None, n_workers=None,
+                    dimensione_shard=DIMENSIONE_SHARD):
+    """
+    Come esegui_parallelo (stessi shard e semi), ma le curve del capitale di tutte le
+    simulazioni vanno in un file float32 mappato in memoria di forma
+    (n_simulazioni, n_scambi + 1), con NaN dopo la bancarotta. Accanto ci sono
+    l'indice del trade di bancarotta di ogni simulazione (-1 se non fallisce) e i metadati.
+    Restituisce i risultati per simulazione, senza 'storico_saldo': le curve si
+    leggono con apri_archivio.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    os.makedirs(cartella, exist_ok=True)
+    forma = (n_simulazioni, parametri['n_scambi'] + 1)
+    curve = np.memmap(os.path.join(cartella, FILE_CURVE), dtype=np.float32, mode='w+', shape=forma)
+    del curve
+
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    inizi = np.concatenate([[0], np.cumsum(shard)[:-1]]).astype(int)
+    argomenti = [(cartella, forma, int(inizio), n, parametri, seme) for inizio, n, seme in zip(inizi, shard, semi)]
+    risultati = unisci_risultati(list(itera_shard(_scrivi_shard, argomenti, n_workers)))
+
+    # La bancarotta chiude il percorso: il trade di bancarotta è l'ultimo giocato
+    bancarotta = np.where(risultati['capitale_finale'] <= 0, risultati['trade_totali'], -1).astype(np.int32)
+    np.save(os.path.join(cartella, FILE_BANCAROTTA), bancarotta)
+    with open(os.path.join(cartella, FILE_METADATI), 'w') as f:
+        json.dump({'forma': forma, 'parametri': parametri, 'seed': seed,
+                   'dimensione_shard': dimensione_shard}, f, indent=4)
+    return risultati
+
+
+def apri_archivio(cartella):
+    """
+    Apre in sola lettura un archivio scritto da simula_su_disco. Restituisce un
+    dizionario con 'curve' (memmap float32: le righe si leggono dal disco solo quando
+    servono), 'bancarotta' (indice del trade di bancarotta, -1 se nessuna) e i metadati.
+    """
+    with open(os.path.join(cartella, FILE_METADATI), 'r') as f:
+        metadati = json.load(f)
+    curve = np.memmap(os.path.join(cartella, FILE_CURVE), dtype=np.float32, mode='r',
+                      shape=tuple(metadati['forma']))
+    bancarotta = np.load(os.path.join(cartella, FILE_BANCAROTTA), mmap_mode='r')
+    return {'curve': curve, 'bancarotta': bancarotta, **metadati}
+
+
+def _blocco_righe(curve):
+    return max(1, MEMORIA_BLOCCO // (curve.shape[1] * curve.itemsize))
+
+
+def evoluzione_media(curve):
+    """Capitale medio dopo ogni trade dei percorsi ancora attivi, leggendo le curve a blocchi di righe."""
+    somma = np.zeros(curve.shape[1])
+    attivi = np.zeros(curve.shape[1], dtype=np.int64)
+    passo = _blocco_righe(curve)
+    for inizio in range(0, len(curve), passo):
+        blocco = np.asarray(curve[inizio:inizio + passo], dtype=np.float64)
+        vivi = ~np.isnan(blocco)
+        somma += np.sum(blocco, axis=0, where=vivi)
+        attivi += vivi.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        return somma / attivi
+
+
+def quantili_passi(curve, quantili, passi=None):
+    """
+    Quantili del capitale tra i percorsi attivi dopo i trade indicati (default: tutti),
+    come matrice (len(quantili), len(passi)). Le colonne vengono lette a gruppi per
+    restare entro MEMORIA_BLOCCO.
+    """
+    if passi is None:
+        passi = np.arange(curve.shape[1])
+    passi = np.asarray(passi)
+    colonne = max(1, MEMORIA_BLOCCO // (len(curve) * curve.itemsize))
+    risultato = np.full((len(quantili), len(passi)), np.nan)
+    for inizio in range(0, len(passi), colonne):
+        gruppo = passi[inizio:inizio + colonne]
+        blocco = curve[:, gruppo]
+        with np.errstate(invalid='ignore'):
+            risultato[:, inizio:inizio + len(gruppo)] = np.nanquantile(blocco, quantili, axis=0)
+    return risultato
+
+
+def tempi_bancarotta(archivio):
+    """Trade di bancarotta dei soli percorsi falliti."""
+    bancarotta = np.asarray(archivio['bancarotta'])
+    return bancarotta[bancarotta >= 0]
+
+
+if __name__ == "__main__":
+    import tempfile
+    with tempfile.TemporaryDirectory() as cartella:
+        simula_su_disco(cartella, 20000, {'n_scambi': 2000}, seed=0)
+        archivio = apri_archivio(cartella)
+        curve = archivio['curve']
+        print(f"Curve su disco: {curve.shape}, {curve.nbytes / 2 ** 20:,.0f} MB")
+        tempi = tempi_bancarotta(archivio)
+        print(f"Bancarotte: {len(tempi)} (trade mediano {np.median(tempi) if len(tempi) else float('nan'):.0f})")
+        passi = np.arange(0, curve.shape[1], 500)
+        for q, riga in zip((0.05, 0.5, 0.95), quantili_passi(curve, [0.05, 0.5, 0.95], passi)):
+            print(f"Quantile {q:.0%} ai trade {passi.tolist()}: {np.round(riga, 2)}")
@@ -0,0 +1,202 @@
+import json
+
+import numpy as np
+
+from montecarlo_motore import stato_sott_acqua, aggiorna_sott_acqua, risultati_sott_acqua
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati
+from montecarlo_streak import rle_streak, streak_piu_lunga
+from montecarlo_streaming import statistiche_sott_acqua
+
+# Diario scritto da trading_suggestive.py
+FILE_DIARIO = 'dati_trading.json'
+
+
+def carica_diario(percorso=FILE_DIARIO):
+    """Legge il diario di trading_suggestive.py (capitale, storia_capitale, win_count, ...)."""
+    with open(percorso, 'r') as f:
+        return json.load(f)
+
+
+def serie_trade(diario, rendimenti='assoluti'):
+    """
+    Serie dei risultati dei trade registrati, dalle differenze di storia_capitale:
+      - 'assoluti': profitto o perdita in € di ogni trade;
+      - 'percentuali': rendimento di ogni trade rispetto al capitale precedente
+        (adatto a puntate proporzionali al capitale, come in trading_suggestive.py).
+    Le modifiche manuali del capitale finiscono anche loro in storia_capitale e non
+    si distinguono dai trade.
+    """
+    storia = np.asarray(diario['storia_capitale'], dtype=np.float64)
+    if len(storia) < 2:
+        raise ValueError("Il diario non contiene trade")
+    differenze = np.diff(storia)
+    if rendimenti == 'assoluti':
+        return differenze
+    if rendimenti == 'percentuali':
+        validi = storia[:-1] > 0
+        return differenze[validi] / storia[:-1][validi]
+    raise ValueError(f"Tipo di rendimenti sconosciuto: {rendimenti} (validi: assoluti, percentuali)")
+
+
+def indici_bootstrap(n_simulazioni, n_scambi, n_osservati, rng, blocco=1):
+    """
+    Matrice (n_simulazioni, n_scambi) di indici dei trade osservati da ricampionare.
+    Con blocco=1 ogni trade è estratto indipendentemente (bootstrap iid); con blocco > 1
+    si estraggono blocchi di trade consecutivi (block bootstrap circolare), che
+    conservano le sequenze di vincite e perdite del diario.
+    """
+    if blocco <= 1:
+        return rng.integers(0, n_osservati, (n_simulazioni, n_scambi))
+    n_blocchi = -(-n_scambi // blocco)
+    inizi = rng.integers(0, n_osservati, (n_simulazioni, n_blocchi))
+    indici = (inizi[:, :, None] + np.arange(blocco)) % n_osservati
+    return indici.reshape(n_simulazioni, n_blocchi * blocco)[:, :n_scambi]
+
+
+def simula_bootstrap_batch(n_simulazioni, serie, capitale_iniziale, n_scambi, rng=None, blocco=1,
+                           rendimenti='assoluti', salva_storico=False):
+    """
+    Percorsi di n_scambi trade ricampionati dalla serie osservata, tutti insieme.
+    Ci si ferma alla bancarotta (capitale <= 0) come nel motore. Restituisce un
+    dizionario con gli stessi campi di simula_batch (losing streak con 1 contratto e
+    tick persi a 0: il diario non registra i contratti), tempi sott'acqua compresi.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    estratti = serie[indici_bootstrap(n_simulazioni, n_scambi, len(serie), rng, blocco)]
+    if rendimenti == 'percentuali':
+        capitali = capitale_iniziale * np.cumprod(1 + estratti, axis=1)
+    else:
+        capitali = capitale_iniziale + np.cumsum(estratti, axis=1)
+    capitali = np.concatenate([np.full((n_simulazioni, 1), float(capitale_iniziale)), capitali], axis=1)
+
+    falliti = capitali[:, 1:] <= 0
+    trade_totali = np.where(falliti.any(axis=1), falliti.argmax(axis=1) + 1, n_scambi)
+    giocati = np.arange(n_scambi) < trade_totali[:, None]
+    # Dopo la bancarotta lo storico è NaN, come nel motore
+    capitali[:, 1:][~giocati] = np.nan
+    capitale_finale = capitali[np.arange(n_simulazioni), trade_totali]
+
+    risultati_trade = np.diff(capitali, axis=1)
+    vincite = (risultati_trade > 0) & giocati
+    perdite = ~vincite & giocati
+    picchi = np.fmax.accumulate(capitali, axis=1)
+    profondita = picchi - capitali
+    drawdown_massimo = np.nanmax(profondita, axis=1)
+    somma_wins = np.sum(risultati_trade, axis=1, where=vincite)
+    somma_losses = np.sum(risultati_trade, axis=1, where=perdite)
+
+    # Il diario non ha stop loss in tick: tick persi a 0
+    streaks = rle_streak(vincite, 0, giocati=giocati)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expectancy = (somma_wins + somma_losses) / trade_totali
+        profit_factor = np.where(somma_losses != 0, np.abs(somma_wins / somma_losses), np.nan)
+    risultati = {
+        'capitale_finale': capitale_finale,
+        'losing_streaks': {k: streaks[k].astype(np.int32)
+                           for k in ('simulazione', 'length', 'max_contratti', 'tick_loss_totali')},
+        'drawdown_massimo': drawdown_massimo,
+        'trade_totali': trade_totali,
+        'win_count': vincite.sum(axis=1),
+        'loss_count': perdite.sum(axis=1),
+        'somma_wins': somma_wins,
+        'somma_losses': somma_losses,
+        'expectancy': expectancy,
+        'profit_factor': profit_factor,
+        **tempi_sott_acqua(profondita, giocati, capitale_finale, trade_totali),
+    }
+    if salva_storico is not False:
+        righe = n_simulazioni if salva_storico is True else min(int(salva_storico), n_simulazioni)
+        risultati['storico_saldo'] = capitali[:righe]
+    return risultati
+
+
+def tempi_sott_acqua(profondita, giocati, capitale_finale, trade_totali):
+    """
+    Tempi sott'acqua dei percorsi ricampionati, trade per trade come nel motore
+    (aggiorna_sott_acqua), da profondita = picco - capitale (n_simulazioni, n_scambi + 1)
+    e giocati, la maschera dei trade eseguiti.
+    """
+    n_simulazioni = len(profondita)
+    stato = {
+        'passo': 0,
+        'drawdown_massimo': np.zeros(n_simulazioni),
+        'capitale': capitale_finale,
+        **stato_sott_acqua(n_simulazioni),
+    }
+    for passo in range(giocati.shape[1]):
+        # Dopo la bancarotta la profondità è NaN: nessun periodo e nessun nuovo minimo
+        aggiorna_sott_acqua(stato, profondita[:, passo + 1], giocati[:, passo])
+        np.fmax(stato['drawdown_massimo'], profondita[:, passo + 1], out=stato['drawdown_massimo'])
+        stato['passo'] += 1
+    return risultati_sott_acqua(stato, trade_totali)
+
+
+def _esegui_shard_bootstrap(argomenti):
+    n, serie, capitale_iniziale, n_scambi, seme, blocco, rendimenti, salva_storico = argomenti
+    return simula_bootstrap_batch(n, serie, capitale_iniziale, n_scambi, np.random.default_rng(seme),
+                                  blocco, rendimenti, salva_storico)
+
+
+def esegui_bootstrap(n_simulazioni, serie, capitale_iniziale, n_scambi=None, blocco=1, rendimenti='assoluti',
+                     seed=None, n_workers=None, dimensione_shard=DIMENSIONE_SHARD, salva_storico=False):
+    """
+    Come esegui_parallelo, ma con i trade ricampionati dalla serie osservata
+    (vedi simula_bootstrap_batch). n_scambi di default è la lunghezza della serie.
+    """
+    serie = np.asarray(serie, dtype=np.float64)
+    if n_scambi is None:
+        n_scambi = len(serie)
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    if isinstance(salva_storico, bool):
+        storici = [salva_storico] * len(shard)
+    else:
+        inizi = np.concatenate([[0], np.cumsum(shard)[:-1]])
+        storici = [int(np.clip(salva_storico - inizio, 0, n)) for n, inizio in zip(shard, inizi)]
+    argomenti = [(n, serie, capitale_iniziale, n_scambi, seme, blocco, rendimenti, storico)
+                 for n, seme, storico in zip(shard, semi, storici)]
+    return unisci_risultati(list(itera_shard(_esegui_shard_bootstrap, argomenti, n_workers)))
+
+
+def statistiche_bootstrap(risultati, capitale_iniziale):
+    """Statistiche globali con le stesse chiavi di stat_globali negli script."""
+    capitali_finali = risultati['capitale_finale']
+    n_simulazioni = len(capitali_finali)
+    streak_massime = streak_piu_lunga(risultati['losing_streaks'], n_simulazioni)
+    return {
+        'capitale_medio': np.mean(capitali_finali),
+        'capitale_mediano': np.median(capitali_finali),
+        'varianza': np.var(capitali_finali),
+        'dev_std': np.std(capitali_finali),
+        'q1': np.percentile(capitali_finali, 25),
+        'q3': np.percentile(capitali_finali, 75),
+        'max': np.max(capitali_finali),
+        'min': np.min(capitali_finali),
+        'drawdown_medio': np.mean(risultati['drawdown_massimo']),
+        'drawdown_max': np.max(risultati['drawdown_massimo']),
+        'prob_bancarotta': np.sum(capitali_finali <= 0) / n_simulazioni,
+        'sotto_capitale_iniziale': np.sum(capitali_finali < capitale_iniziale),
+        'streak_perdente_media': np.mean(streak_massime),
+        'streak_perdente_max': int(streak_massime.max(initial=0)),
+        **statistiche_sott_acqua(risultati),
+    }
+
+
+if __name__ == "__main__":
+    import os
+
+    if not os.path.exists(FILE_DIARIO):
+        raise SystemExit(f"{FILE_DIARIO} non trovato: registra qualche trade con trading_suggestive.py")
+    diario = carica_diario()
+    n_simulazioni = 10000
+    for rendimenti in ('assoluti', 'percentuali'):
+        serie = serie_trade(diario, rendimenti)
+        # Blocchi di circa n^(1/3) trade: abbastanza lunghi per le streak, abbastanza per variare
+        for blocco in (1, max(2, round(len(serie) ** (1 / 3)))):
+            risultati = esegui_bootstrap(n_simulazioni, serie, diario['storia_capitale'][0], blocco=blocco,
+                                         rendimenti=rendimenti, seed=0)
+            print(f"\nBOOTSTRAP ({len(serie)} trade osservati, rendimenti {rendimenti}, blocco {blocco})")
+            print("=" * 90)
+            for k, v in statistiche_bootstrap(risultati, diario['storia_capitale'][0]).items():
+                print(f"{k}: {v}")
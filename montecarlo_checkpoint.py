@@ -0,0 +1,235 @@
+import json
+import os
+
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT, inizializza_stato, avanza_stato, risultati_da_stato
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati
+
+# Campi dello stato del motore che non sono array per simulazione
+CAMPI_SPECIALI = ('passo', 'streak_chiuse')
+CAMPI_STREAK = ('simulazione', 'length', 'max_contratti', 'tick_loss_totali')
+
+
+def _compatta_streak(stato):
+    # Le streak chiuse arrivano a pezzi, uno per trade: nel checkpoint basta un pezzo solo
+    if len(stato['streak_chiuse']) > 1:
+        stato['streak_chiuse'] = [tuple(np.concatenate(c) for c in zip(*stato['streak_chiuse']))]
+    return stato
+
+
+def _nuovo_shard(n, parametri, seme, righe_storico):
+    shard = {'stato': inizializza_stato(n, parametri),
+             'rng': np.random.default_rng(seme).bit_generator.state}
+    if righe_storico is not None:
+        shard['storico'] = np.full((righe_storico, parametri['n_scambi'] + 1), np.nan)
+        shard['storico'][:, 0] = parametri['capitale_iniziale']
+    return shard
+
+
+def nuova_esecuzione(n_simulazioni, parametri=None, seed=None, dimensione_shard=DIMENSIONE_SHARD,
+                     salva_storico=False):
+    """
+    Prepara un'esecuzione riprendibile: gli shard e i semi di esegui_parallelo, con lo
+    stato del motore e lo stato del generatore di ogni shard, ancora a zero trade.
+    salva_storico come in esegui_parallelo (True, False o le prime k simulazioni).
+    L'esecuzione è un dizionario: si fa avanzare con avanza_esecuzione, si salva con
+    salva_checkpoint e si estende con estendi_trade e aggiungi_simulazioni.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    sequenza = np.random.SeedSequence(seed)
+    esecuzione = {'parametri': parametri, 'entropia': sequenza.entropy, 'semi_usati': 0,
+                  'dimensione_shard': dimensione_shard, 'salva_storico': salva_storico, 'shard': []}
+    aggiungi_simulazioni(esecuzione, n_simulazioni)
+    return esecuzione
+
+
+def n_simulazioni_esecuzione(esecuzione):
+    return sum(len(s['stato']['capitale']) for s in esecuzione['shard'])
+
+
+def aggiungi_simulazioni(esecuzione, n_simulazioni):
+    """
+    Aggiunge n_simulazioni percorsi nuovi, in shard con semi nuovi della stessa
+    SeedSequence (indipendenti da quelli già usati), ancora a zero trade: il prossimo
+    avanza_esecuzione li porta al numero di trade degli altri.
+    """
+    parametri = esecuzione['parametri']
+    salva_storico = esecuzione['salva_storico']
+    gia_presenti = n_simulazioni_esecuzione(esecuzione)
+    shard = pianifica_shard(n_simulazioni, esecuzione['dimensione_shard'])
+    semi = np.random.SeedSequence(esecuzione['entropia'], n_children_spawned=esecuzione['semi_usati']).spawn(len(shard))
+    inizi = gia_presenti + np.concatenate([[0], np.cumsum(shard)[:-1]])
+    for n, seme, inizio in zip(shard, semi, inizi):
+        # Come in esegui_parallelo: con salva_storico intero gli shard oltre le prime
+        # salva_storico simulazioni hanno uno storico vuoto
+        if salva_storico is False:
+            righe = None
+        elif salva_storico is True:
+            righe = n
+        else:
+            righe = int(np.clip(salva_storico - inizio, 0, n))
+        esecuzione['shard'].append(_nuovo_shard(n, parametri, seme, righe))
+    esecuzione['semi_usati'] += len(shard)
+    return esecuzione
+
+
+def estendi_trade(esecuzione, n_scambi):
+    """Porta il numero di trade dell'esecuzione a n_scambi: gli storici si allungano con NaN."""
+    parametri = esecuzione['parametri']
+    if n_scambi < parametri['n_scambi']:
+        raise ValueError(f"L'esecuzione ha già {parametri['n_scambi']} trade: non si può accorciare")
+    for shard in esecuzione['shard']:
+        if 'storico' in shard:
+            aggiunta = np.full((len(shard['storico']), n_scambi - parametri['n_scambi']), np.nan)
+            shard['storico'] = np.concatenate([shard['storico'], aggiunta], axis=1)
+    parametri['n_scambi'] = n_scambi
+    return esecuzione
+
+
+def _avanza_shard(argomenti):
+    shard, parametri, n_passi = argomenti
+    rng = np.random.default_rng()
+    rng.bit_generator.state = shard['rng']
+    obiettivo = shard['stato']['passo'] + n_passi
+    avanza_stato(shard['stato'], parametri, n_passi, rng, shard.get('storico'))
+    # Se tutti i percorsi sono falliti il motore si ferma prima: lo shard è comunque arrivato
+    shard['stato']['passo'] = obiettivo
+    shard['rng'] = rng.bit_generator.state
+    _compatta_streak(shard['stato'])
+    return shard
+
+
+def avanza_esecuzione(esecuzione, n_workers=None, percorso=None, passi_checkpoint=None):
+    """
+    Porta tutti gli shard a parametri['n_scambi'] trade; si calcolano solo i trade
+    mancanti di ogni shard. Con percorso e passi_checkpoint salva un checkpoint ogni
+    passi_checkpoint trade (e alla fine): un'esecuzione interrotta riparte dall'ultimo.
+    Per esiti nominali e senza regimi (un solo flusso di numeri casuali, consumato un
+    trade alla volta) il risultato è identico bit per bit a esegui_parallelo con lo
+    stesso seed e n_scambi finale, comunque sia stato diviso il lavoro; con percorsi
+    aggiunti serve che i precedenti fossero un multiplo di dimensione_shard (gli shard
+    sono allora gli stessi).
+    """
+    parametri = esecuzione['parametri']
+    while True:
+        mancanti = [parametri['n_scambi'] - s['stato']['passo'] for s in esecuzione['shard']]
+        if max(mancanti, default=0) <= 0:
+            break
+        # Ogni giro porta avanti gli shard più indietro, fino al passo comune successivo
+        obiettivo = min(s['stato']['passo'] for s in esecuzione['shard']) + (passi_checkpoint or max(mancanti))
+        obiettivo = min(obiettivo, parametri['n_scambi'])
+        indici = [i for i, s in enumerate(esecuzione['shard']) if s['stato']['passo'] < obiettivo]
+        argomenti = [(esecuzione['shard'][i], parametri, obiettivo - esecuzione['shard'][i]['stato']['passo'])
+                     for i in indici]
+        for i, shard in zip(indici, itera_shard(_avanza_shard, argomenti, n_workers)):
+            esecuzione['shard'][i] = shard
+        if percorso is not None:
+            salva_checkpoint(percorso, esecuzione)
+    return esecuzione
+
+
+def risultati_esecuzione(esecuzione):
+    """Risultati di tutte le simulazioni, con gli stessi campi di esegui_parallelo."""
+    parziali = []
+    for shard in esecuzione['shard']:
+        risultati = risultati_da_stato(shard['stato'])
+        if 'storico' in shard:
+            risultati['storico_saldo'] = shard['storico']
+        parziali.append(risultati)
+    return unisci_risultati(parziali)
+
+
+def salva_checkpoint(percorso, esecuzione):
+    """
+    Salva l'esecuzione in un file .npz: gli array dello stato di ogni shard come
+    'shard<i>_<campo>', le streak chiuse come 'shard<i>_streak_<campo>', gli storici e,
+    in 'metadati' (JSON), parametri, passi raggiunti e stati dei generatori.
+    Il file viene prima scritto a parte e poi rinominato: un'interruzione durante il
+    salvataggio lascia intatto il checkpoint precedente.
+    """
+    array = {}
+    shard_metadati = []
+    for i, shard in enumerate(esecuzione['shard']):
+        stato = _compatta_streak(shard['stato'])
+        for campo, valore in stato.items():
+            if campo not in CAMPI_SPECIALI:
+                array[f'shard{i}_{campo}'] = valore
+        streak = stato['streak_chiuse'][0] if stato['streak_chiuse'] else [np.zeros(0, dtype=np.int32)] * 4
+        for campo, valore in zip(CAMPI_STREAK, streak):
+            array[f'shard{i}_streak_{campo}'] = valore
+        if 'storico' in shard:
+            array[f'shard{i}_storico'] = shard['storico']
+        shard_metadati.append({'passo': stato['passo'], 'rng': shard['rng'], 'storico': 'storico' in shard})
+    metadati = {k: esecuzione[k] for k in ('parametri', 'entropia', 'semi_usati', 'dimensione_shard', 'salva_storico')}
+    metadati['shard'] = shard_metadati
+    array['metadati'] = np.array(json.dumps(metadati))
+    temporaneo = percorso + '.tmp.npz'
+    np.savez(temporaneo, **array)
+    os.replace(temporaneo, percorso)
+
+
+def carica_checkpoint(percorso):
+    """Legge un file scritto da salva_checkpoint e restituisce l'esecuzione."""
+    with np.load(percorso) as dati:
+        metadati = json.loads(str(dati['metadati']))
+        esecuzione = {k: v for k, v in metadati.items() if k != 'shard'}
+        esecuzione['shard'] = []
+        for i, shard_metadati in enumerate(metadati['shard']):
+            prefisso = f'shard{i}_'
+            stato = {k[len(prefisso):]: dati[k] for k in dati.files
+                     if k.startswith(prefisso) and not k.startswith(prefisso + 'streak_') and k != prefisso + 'storico'}
+            stato['passo'] = shard_metadati['passo']
+            stato['streak_chiuse'] = [tuple(dati[prefisso + 'streak_' + c] for c in CAMPI_STREAK)]
+            shard = {'stato': stato, 'rng': shard_metadati['rng']}
+            if shard_metadati['storico']:
+                shard['storico'] = dati[prefisso + 'storico']
+            esecuzione['shard'].append(shard)
+    return esecuzione
+
+
+def esegui_con_checkpoint(percorso, n_simulazioni, parametri=None, seed=None, n_workers=None,
+                          passi_checkpoint=None, dimensione_shard=DIMENSIONE_SHARD, salva_storico=False):
+    """
+    Esegue le simulazioni salvando lo stato in percorso. Se il file esiste l'esecuzione
+    riparte da lì: se n_simulazioni o parametri['n_scambi'] sono più grandi di quelli
+    salvati si aggiungono percorsi o trade, e si calcola solo il lavoro nuovo.
+    Gli altri parametri devono coincidere con quelli del checkpoint; seed, shard e
+    storici restano quelli dell'esecuzione salvata.
+    Restituisce i risultati come esegui_parallelo.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if os.path.exists(percorso):
+        esecuzione = carica_checkpoint(percorso)
+        salvati = esecuzione['parametri']
+        diversi = [k for k in parametri if k != 'n_scambi' and salvati.get(k) != json.loads(json.dumps(parametri[k]))]
+        if diversi:
+            raise ValueError(f"Parametri diversi da quelli del checkpoint {percorso}: {', '.join(diversi)}")
+        if parametri['n_scambi'] > salvati['n_scambi']:
+            estendi_trade(esecuzione, parametri['n_scambi'])
+        if n_simulazioni > n_simulazioni_esecuzione(esecuzione):
+            aggiungi_simulazioni(esecuzione, n_simulazioni - n_simulazioni_esecuzione(esecuzione))
+    else:
+        esecuzione = nuova_esecuzione(n_simulazioni, parametri, seed, dimensione_shard, salva_storico)
+    avanza_esecuzione(esecuzione, n_workers, percorso, passi_checkpoint)
+    return risultati_esecuzione(esecuzione)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+
+    parametri = {'n_scambi': 1000}
+    with tempfile.TemporaryDirectory() as cartella:
+        percorso = os.path.join(cartella, 'checkpoint.npz')
+        for n_simulazioni, n_scambi in ((5000, 1000), (5000, 4000), (8000, 4000)):
+            inizio = time.perf_counter()
+            risultati = esegui_con_checkpoint(percorso, n_simulazioni, {**parametri, 'n_scambi': n_scambi}, seed=0,
+                                              passi_checkpoint=500)
+            durata = time.perf_counter() - inizio
+            completa = esegui_parallelo(n_simulazioni, {**parametri, 'n_scambi': n_scambi}, seed=0)
+            uguali = all(np.array_equal(risultati[k], completa[k]) for k in ('capitale_finale', 'drawdown_massimo'))
+            print(f"{n_simulazioni} simulazioni x {n_scambi} trade: {durata:.2f} s dal checkpoint, "
+                  f"identici all'esecuzione completa: {uguali}")
@@ -0,0 +1,218 @@
+"""
+Esecuzione senza interfaccia grafica dei simulatori Monte Carlo.
+
+    python montecarlo_cli.py simula configurazione.toml risultati.npz
+    python montecarlo_cli.py grafici risultati.npz grafici.png
+
+Per lavori troppo grandi per una macchina, la stessa simulazione si divide tra più
+nodi con una cartella condivisa (vedi montecarlo_coda.py).
+
+La configurazione (TOML o JSON) ha due sezioni:
+
+    [simulazione]
+    script = "recovery"        # oppure "1lose" (montecarlo_recovery_1lose_per_1win.py)
+    n_simulazioni = 100000
+    seed = 0
+    n_workers = 8
+    curve_campione = 20        # curve del capitale salvate nel file
+
+    [parametri]                # sovrascrivono i parametri dello script
+    win_rate = 0.55
+"""
+import argparse
+import itertools
+import json
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+import montecarlo_recovery
+import montecarlo_recovery_1lose_per_1win
+from montecarlo_colonne import comprimi_risultati, espandi_risultati
+from montecarlo_motore import simula_batch
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati
+from montecarlo_streaming import Istogramma, limiti_da_batch, avvisa_fuori_intervallo, QUANTILI_VENTAGLIO
+
+SCRIPT = {
+    'recovery': montecarlo_recovery,
+    '1lose': montecarlo_recovery_1lose_per_1win,
+}
+
+SIMULAZIONE_DEFAULT = {
+    'script': 'recovery',
+    'n_simulazioni': 10000,
+    'seed': None,
+    'n_workers': None,
+    'dimensione_shard': DIMENSIONE_SHARD,
+    'curve_campione': 20,
+}
+
+def carica_configurazione(percorso):
+    """Legge la configurazione da un file TOML o JSON e completa i valori mancanti."""
+    if percorso.endswith('.toml'):
+        import tomllib
+        with open(percorso, 'rb') as f:
+            configurazione = tomllib.load(f)
+    else:
+        with open(percorso, 'r') as f:
+            configurazione = json.load(f)
+    simulazione = {**SIMULAZIONE_DEFAULT, **configurazione.get('simulazione', {})}
+    if simulazione['script'] not in SCRIPT:
+        raise ValueError(f"Script sconosciuto: {simulazione['script']} (validi: {', '.join(SCRIPT)})")
+    parametri = {**SCRIPT[simulazione['script']].parametri, **configurazione.get('parametri', {})}
+    return simulazione, parametri
+
+
+def simula_shard(argomenti):
+    """
+    Esegue uno shard (n, parametri, seme, n_curve, limiti_passi) di simula e dei worker
+    di montecarlo_coda; con limiti_passi None gli intervalli vengono dallo shard stesso.
+    """
+    n, parametri, seme, n_curve, limiti_passi = argomenti
+    risultati = simula_batch(n, parametri, rng=np.random.default_rng(seme), salva_storico=True)
+    # Dello storico restano le prime n_curve curve e, per ogni passo, somma e numero
+    # dei percorsi ancora attivi (per l'evoluzione media su tutte le simulazioni) e
+    # l'istogramma del capitale (per il ventaglio dei percentili)
+    storico = risultati['storico_saldo']
+    attivi = ~np.isnan(storico)
+    risultati['somma_passi'] = np.sum(storico, axis=0, where=attivi)
+    risultati['attivi_passi'] = attivi.sum(axis=0)
+    if limiti_passi is None:
+        limiti_passi = limiti_da_batch(risultati)['passi']
+    risultati['istogramma_passi'] = Istogramma(*limiti_passi)
+    risultati['istogramma_passi'].aggiungi(storico)
+    risultati['storico_saldo'] = storico[:n_curve]
+    return risultati
+
+
+def piano_shard(simulazione):
+    """Dimensioni, curve salvate e semi degli shard: gli stessi di esegui_parallelo."""
+    shard = pianifica_shard(simulazione['n_simulazioni'], simulazione['dimensione_shard'])
+    semi = np.random.SeedSequence(simulazione['seed']).spawn(len(shard))
+    inizi = np.concatenate([[0], np.cumsum(shard)[:-1]])
+    n_curve = [int(np.clip(simulazione['curve_campione'] - inizio, 0, n)) for n, inizio in zip(shard, inizi)]
+    return shard, n_curve, semi
+
+
+def limiti_istogramma(istogramma):
+    """Intervalli (minimi, massimi) di un Istogramma, da passare agli shard successivi."""
+    return istogramma.minimi, istogramma.minimi + istogramma.larghezza * istogramma.n_bin
+
+
+def unisci_parziali(parziali):
+    """
+    Unisce i risultati degli shard, nell'ordine degli shard e uno alla volta (gli
+    istogrammi per passo non restano in memoria): risultati come esegui_parallelo, più
+    'evoluzione_media' e 'ventaglio'.
+    """
+    parziali = iter(parziali)
+    primo = next(parziali)
+    istogramma = primo.pop('istogramma_passi')
+    somma_passi = primo.pop('somma_passi')
+    attivi_passi = primo.pop('attivi_passi')
+    uniti = [primo]
+    for parziale in parziali:
+        somma_passi = somma_passi + parziale.pop('somma_passi')
+        attivi_passi = attivi_passi + parziale.pop('attivi_passi')
+        istogramma.unisci(parziale.pop('istogramma_passi'))
+        uniti.append(parziale)
+    avvisa_fuori_intervallo({'capitale per passo': istogramma})
+    risultati = unisci_risultati(uniti)
+    with np.errstate(invalid='ignore'):
+        risultati['evoluzione_media'] = somma_passi / attivi_passi
+    risultati['ventaglio'] = np.array([istogramma.quantili(q) for q in QUANTILI_VENTAGLIO])
+    return risultati
+
+
+def simula(simulazione, parametri):
+    """
+    Esegue le simulazioni descritte dalla configurazione, con gli stessi shard e semi
+    di esegui_parallelo. Restituisce i risultati come esegui_parallelo, con le prime
+    curve_campione curve in 'storico_saldo' e l'evoluzione media del capitale su tutte
+    le simulazioni in 'evoluzione_media'. In 'ventaglio' ci sono i percentili
+    QUANTILI_VENTAGLIO del capitale a ogni passo, da istogrammi per passo: il primo
+    shard, eseguito nel processo corrente, fissa gli intervalli come in simula_streaming.
+    """
+    shard, n_curve, semi = piano_shard(simulazione)
+    primo = simula_shard((shard[0], parametri, semi[0], n_curve[0], None))
+    limiti_passi = limiti_istogramma(primo['istogramma_passi'])
+    argomenti = [(n, parametri, seme, curve, limiti_passi)
+                 for n, seme, curve in zip(shard[1:], semi[1:], n_curve[1:])]
+    return unisci_parziali(itertools.chain([primo], itera_shard(simula_shard, argomenti, simulazione['n_workers'])))
+
+
+def salva_risultati(percorso, risultati, simulazione, parametri):
+    """
+    Salva i risultati in un file .npz compresso: i campi per simulazione e le losing
+    streak nel contenitore compatto di montecarlo_colonne ('simulazioni', 'streak',
+    'offset'), le curve in 'storico_saldo' e configurazione usata in 'metadati' (JSON).
+    """
+    array = comprimi_risultati(risultati)
+    array['storico_saldo'] = risultati['storico_saldo']
+    array['evoluzione_media'] = risultati['evoluzione_media']
+    array['ventaglio'] = risultati['ventaglio']
+    metadati = {'simulazione': simulazione, 'parametri': parametri}
+    array['metadati'] = np.array(json.dumps(metadati))
+    np.savez_compressed(percorso, **array)
+
+
+def carica_risultati(percorso):
+    """Legge un file scritto da salva_risultati. Restituisce (risultati, metadati)."""
+    with np.load(percorso) as dati:
+        risultati = espandi_risultati({k: dati[k] for k in ('simulazioni', 'streak', 'offset')})
+        altri = [k for k in dati.files if k not in ('simulazioni', 'streak', 'offset', 'metadati')]
+        risultati.update({k: dati[k] for k in altri})
+        metadati = json.loads(str(dati['metadati']))
+    return risultati, metadati
+
+
+def riepilogo_da_file(percorso):
+    """Carica un file di risultati e lo riassume con le funzioni dello script che lo ha prodotto."""
+    risultati, metadati = carica_risultati(percorso)
+    script = SCRIPT[metadati['simulazione']['script']]
+    return script, script.riepilogo_da_risultati(risultati, metadati['parametri'])
+
+
+def comando_simula(argomenti):
+    simulazione, parametri = carica_configurazione(argomenti.configurazione)
+    risultati = simula(simulazione, parametri)
+    salva_risultati(argomenti.uscita, risultati, simulazione, parametri)
+    if not argomenti.silenzioso:
+        script = SCRIPT[simulazione['script']]
+        script.stampa_statistiche(script.riepilogo_da_risultati(risultati, parametri))
+    print(f"\nRisultati salvati in {argomenti.uscita}")
+
+
+def comando_grafici(argomenti):
+    script, riepilogo = riepilogo_da_file(argomenti.risultati)
+    uscita = argomenti.uscita or os.path.splitext(argomenti.risultati)[0] + '.png'
+    figura = script.disegna_grafici(riepilogo)
+    figura.savefig(uscita, dpi=argomenti.dpi)
+    print(f"Grafici salvati in {uscita}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulatori Monte Carlo senza interfaccia grafica")
+    comandi = parser.add_subparsers(dest='comando', required=True)
+
+    simula_parser = comandi.add_parser('simula', help="esegue le simulazioni e salva i risultati in .npz")
+    simula_parser.add_argument('configurazione', help="file di configurazione .toml o .json")
+    simula_parser.add_argument('uscita', help="file .npz dei risultati")
+    simula_parser.add_argument('--silenzioso', action='store_true', help="non stampa le statistiche")
+    simula_parser.set_defaults(funzione=comando_simula)
+
+    grafici_parser = comandi.add_parser('grafici', help="disegna i grafici da un file di risultati")
+    grafici_parser.add_argument('risultati', help="file .npz scritto da 'simula'")
+    grafici_parser.add_argument('uscita', nargs='?', help="immagine di uscita (default: stesso nome, .png)")
+    grafici_parser.add_argument('--dpi', type=int, default=100)
+    grafici_parser.set_defaults(funzione=comando_grafici)
+
+    argomenti = parser.parse_args(argv)
+    argomenti.funzione(argomenti)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Simulazioni della CLI divise tra più macchine con una cartella condivisa come coda.
+
+    python montecarlo_coda.py prepara configurazione.toml /condivisa/lavoro
+    python montecarlo_coda.py lavora /condivisa/lavoro --processi 8     # su ogni nodo
+    python montecarlo_coda.py stato /condivisa/lavoro
+    python montecarlo_coda.py unisci /condivisa/lavoro risultati.npz
+
+Le unità di lavoro sono gli shard di montecarlo_cli.simula, ognuna con il suo seme
+da SeedSequence: il file unito è identico bit per bit a quello di
+'montecarlo_cli.py simula' con la stessa configurazione, qualunque sia il numero di
+nodi e di processi. Nella cartella:
+  - lavoro.json: configurazione, parametri, shard ed entropia del seme;
+  - limiti.npz: intervalli degli istogrammi per passo, fissati dal primo shard;
+  - prese/<i>: unità i presa da un worker (creata in modo esclusivo, contiene nodo e pid);
+  - parziali/<i>.pkl: risultato dell'unità i, scritto a parte e poi rinominato.
+
+Con --scadenza un worker morto non blocca il lavoro: mentre un'unità è in esecuzione
+il suo worker ne rinnova la presa (l'ora di modifica) ogni scadenza / 4 secondi, e
+una presa non rinnovata da più di scadenza secondi viene ripresa da un altro worker:
+la rinomina in prese/<i>.scaduta.<nodo>.<pid>, poi ne crea una nuova.
+L'età della presa si misura con l'orologio del file system condiviso, non con quello
+del nodo, quindi orologi dei nodi non sincronizzati non contano. Un worker fermo ma
+non morto (processo sospeso, nodo senza rete) per più di scadenza perde l'unità, che
+viene rifatta: scegliere una scadenza più lunga della durata di uno shard evita di
+rifare lavoro. Un'unità rifatta dà comunque lo stesso parziale (stesso seme).
+"""
+import argparse
+import json
+import os
+import pickle
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from montecarlo_cli import (carica_configurazione, piano_shard, limiti_istogramma, unisci_parziali,
+                            salva_risultati, simula_shard)
+
+FILE_LAVORO = 'lavoro.json'
+FILE_LIMITI = 'limiti.npz'
+CARTELLA_PRESE = 'prese'
+CARTELLA_PARZIALI = 'parziali'
+
+# Rinnovi della presa per ogni intervallo di scadenza
+BATTITI_PER_SCADENZA = 4
+
+
+def _identita():
+    # Contenuto delle prese di questo worker
+    return f'{socket.gethostname()} {os.getpid()}'
+
+
+def _percorso_parziale(cartella, i):
+    return os.path.join(cartella, CARTELLA_PARZIALI, f'{i:06d}.pkl')
+
+
+def _percorso_presa(cartella, i):
+    return os.path.join(cartella, CARTELLA_PRESE, f'{i:06d}')
+
+
+def _scrivi_parziale(cartella, i, risultati):
+    # Scrittura atomica: un worker interrotto non lascia mai un parziale incompleto
+    percorso = _percorso_parziale(cartella, i)
+    temporaneo = f'{percorso}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(temporaneo, 'wb') as f:
+        pickle.dump(risultati, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporaneo, percorso)
+
+
+def _leggi_parziale(cartella, i):
+    with open(_percorso_parziale(cartella, i), 'rb') as f:
+        return pickle.load(f)
+
+
+def carica_lavoro(cartella):
+    with open(os.path.join(cartella, FILE_LAVORO), 'r') as f:
+        return json.load(f)
+
+
+def prepara_lavoro(cartella, simulazione, parametri):
+    """
+    Crea la coda in cartella per la simulazione descritta (come carica_configurazione).
+    Il primo shard viene eseguito subito: fissa gli intervalli degli istogrammi per
+    passo che tutti gli altri devono usare. Se il seme è None si registra l'entropia
+    estratta, così tutti i nodi usano gli stessi semi.
+    """
+    simulazione = {**simulazione, 'seed': np.random.SeedSequence(simulazione['seed']).entropy}
+    shard, n_curve, semi = piano_shard(simulazione)
+    os.makedirs(os.path.join(cartella, CARTELLA_PRESE), exist_ok=True)
+    os.makedirs(os.path.join(cartella, CARTELLA_PARZIALI), exist_ok=True)
+
+    primo = simula_shard((shard[0], parametri, semi[0], n_curve[0], None))
+    minimi, massimi = limiti_istogramma(primo['istogramma_passi'])
+    np.savez(os.path.join(cartella, FILE_LIMITI), minimi=minimi, massimi=massimi)
+    _scrivi_parziale(cartella, 0, primo)
+    # lavoro.json per ultimo: i worker non partono finché la cartella non è completa
+    with open(os.path.join(cartella, FILE_LAVORO), 'w') as f:
+        json.dump({'simulazione': simulazione, 'parametri': parametri, 'shard': shard, 'n_curve': n_curve}, f, indent=4)
+
+
+def ora_condivisa(cartella):
+    """
+    L'ora secondo il file system della cartella: l'ora di modifica di un file appena
+    scritto in prese/. Su un file system di rete la assegna il server, come quella
+    delle prese, e si può confrontare con esse qualunque sia l'orologio del nodo.
+    """
+    sonda = os.path.join(cartella, CARTELLA_PRESE, f'.ora.{socket.gethostname()}.{os.getpid()}')
+    with open(sonda, 'w'):
+        pass
+    try:
+        return os.path.getmtime(sonda)
+    finally:
+        os.remove(sonda)
+
+
+@contextmanager
+def battito(presa, intervallo):
+    """
+    Rinnova l'ora di modifica della presa ogni intervallo secondi, da un thread, finché
+    il blocco with è in esecuzione (con intervallo None non fa nulla). os.utime senza
+    tempi usa l'ora del file system, come ora_condivisa. Se la presa non è più di
+    questo worker (un altro l'ha ripresa dopo la scadenza) smette di rinnovarla.
+    """
+    if intervallo is None:
+        yield
+        return
+    fine = threading.Event()
+    identita = _identita()
+
+    def rinnova():
+        while not fine.wait(intervallo):
+            try:
+                with open(presa, 'r') as f:
+                    if f.read() != identita:
+                        return
+                os.utime(presa)
+            except FileNotFoundError:
+                return
+
+    filo = threading.Thread(target=rinnova, daemon=True)
+    filo.start()
+    try:
+        yield
+    finally:
+        fine.set()
+        filo.join()
+
+
+def prendi_unita(cartella, n_unita, scadenza=None):
+    """
+    Prende la prima unità libera creando prese/<i> in modo esclusivo (O_EXCL: un solo
+    worker ci riesce, anche tra nodi diversi sulla stessa cartella). Con scadenza (in
+    secondi) le prese senza parziale non rinnovate da più di scadenza secondi (vedi
+    battito) si considerano di worker morti e si riprendono; l'ora del file system si
+    legge una sola volta per chiamata. Restituisce l'indice dell'unità o None se non
+    ce ne sono.
+    """
+    identita = _identita()
+    ora = None
+    for i in range(n_unita):
+        if os.path.exists(_percorso_parziale(cartella, i)):
+            continue
+        presa = _percorso_presa(cartella, i)
+        for tentativo in range(2):
+            try:
+                descrittore = os.open(presa, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if tentativo > 0 or scadenza is None:
+                    break
+                if ora is None:
+                    ora = ora_condivisa(cartella)
+                scaduta = f'{presa}.scaduta.{identita.replace(" ", ".")}'
+                try:
+                    giudicata = os.stat(presa)
+                    if ora - giudicata.st_mtime < scadenza:
+                        break
+                    # La rinomina riesce a un solo worker: è lui a riprendere l'unità
+                    os.rename(presa, scaduta)
+                except FileNotFoundError:
+                    break
+                rinominata = os.stat(scaduta)
+                if (rinominata.st_ino, rinominata.st_mtime_ns) != (giudicata.st_ino, giudicata.st_mtime_ns):
+                    # Tra il controllo e la rinomina la presa è stata rinnovata o ripresa da
+                    # un altro worker: non era quella scaduta, si rimette al suo posto
+                    try:
+                        os.link(scaduta, presa)
+                    except FileExistsError:
+                        pass
+                    os.remove(scaduta)
+                    break
+                continue
+            with os.fdopen(descrittore, 'w') as f:
+                f.write(identita)
+            return i
+    return None
+
+
+def lavora(cartella, scadenza=None):
+    """
+    Ciclo di un worker: prende un'unità alla volta, la esegue e ne scrive il parziale,
+    finché non ce ne sono più. Con scadenza la presa dell'unità in esecuzione viene
+    rinnovata ogni scadenza / BATTITI_PER_SCADENZA secondi. Restituisce il numero di
+    unità eseguite.
+    """
+    lavoro = carica_lavoro(cartella)
+    simulazione, parametri = lavoro['simulazione'], lavoro['parametri']
+    shard, n_curve, semi = piano_shard(simulazione)
+    with np.load(os.path.join(cartella, FILE_LIMITI)) as limiti:
+        limiti_passi = (limiti['minimi'], limiti['massimi'])
+    intervallo = scadenza / BATTITI_PER_SCADENZA if scadenza is not None else None
+    eseguite = 0
+    while (i := prendi_unita(cartella, len(shard), scadenza)) is not None:
+        with battito(_percorso_presa(cartella, i), intervallo):
+            risultati = simula_shard((shard[i], parametri, semi[i], n_curve[i], limiti_passi))
+        _scrivi_parziale(cartella, i, risultati)
+        eseguite += 1
+    return eseguite
+
+
+def lavora_in_parallelo(cartella, n_processi, scadenza=None):
+    """n_processi worker indipendenti sulla stessa cartella, come se fossero nodi diversi."""
+    with ProcessPoolExecutor(max_workers=n_processi) as pool:
+        futuri = [pool.submit(lavora, cartella, scadenza) for _ in range(n_processi)]
+        return [futuro.result() for futuro in futuri]
+
+
+def stato_lavoro(cartella):
+    """Unità totali, completate e prese ma non ancora completate."""
+    n_unita = len(carica_lavoro(cartella)['shard'])
+    completate = sum(os.path.exists(_percorso_parziale(cartella, i)) for i in range(n_unita))
+    prese = sum(os.path.exists(_percorso_presa(cartella, i)) and not os.path.exists(_percorso_parziale(cartella, i))
+                for i in range(n_unita))
+    return {'unita': n_unita, 'completate': completate, 'in_corso': prese}
+
+
+def unisci_lavoro(cartella):
+    """
+    Unisce i parziali nell'ordine degli shard, come montecarlo_cli.simula.
+    Restituisce (risultati, simulazione, parametri); se mancano unità solleva RuntimeError.
+    """
+    lavoro = carica_lavoro(cartella)
+    n_unita = len(lavoro['shard'])
+    mancanti = [i for i in range(n_unita) if not os.path.exists(_percorso_parziale(cartella, i))]
+    if mancanti:
+        raise RuntimeError(f"Mancano {len(mancanti)} unità su {n_unita} (la prima è la {mancanti[0]})")
+    risultati = unisci_parziali(_leggi_parziale(cartella, i) for i in range(n_unita))
+    return risultati, lavoro['simulazione'], lavoro['parametri']
+
+
+def comando_prepara(argomenti):
+    simulazione, parametri = carica_configurazione(argomenti.configurazione)
+    prepara_lavoro(argomenti.cartella, simulazione, parametri)
+    print(f"Lavoro preparato in {argomenti.cartella}: {len(carica_lavoro(argomenti.cartella)['shard'])} unità")
+
+
+def comando_lavora(argomenti):
+    if argomenti.processi > 1:
+        eseguite = sum(lavora_in_parallelo(argomenti.cartella, argomenti.processi, argomenti.scadenza))
+    else:
+        eseguite = lavora(argomenti.cartella, argomenti.scadenza)
+    print(f"Unità eseguite: {eseguite}")
+
+
+def comando_stato(argomenti):
+    stato = stato_lavoro(argomenti.cartella)
+    print(f"Unità completate: {stato['completate']} su {stato['unita']} ({stato['in_corso']} in corso)")
+
+
+def comando_unisci(argomenti):
+    risultati, simulazione, parametri = unisci_lavoro(argomenti.cartella)
+    # L'entropia registrata sostituisce il seme: il file dice con quali semi è stato prodotto
+    salva_risultati(argomenti.uscita, risultati, simulazione, parametri)
+    print(f"Risultati salvati in {argomenti.uscita}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulazioni divise tra più nodi con una cartella condivisa")
+    comandi = parser.add_subparsers(dest='comando', required=True)
+
+    prepara_parser = comandi.add_parser('prepara', help="crea la coda di unità da una configurazione")
+    prepara_parser.add_argument('configurazione', help="file di configurazione .toml o .json (come montecarlo_cli.py)")
+    prepara_parser.add_argument('cartella', help="cartella condivisa del lavoro")
+    prepara_parser.set_defaults(funzione=comando_prepara)
+
+    lavora_parser = comandi.add_parser('lavora', help="esegue unità finché ce ne sono")
+    lavora_parser.add_argument('cartella')
+    lavora_parser.add_argument('--processi', type=int, default=1, help="worker indipendenti su questo nodo")
+    lavora_parser.add_argument('--scadenza', type=float, default=None,
+                               help="secondi senza rinnovo dopo i quali un'unità presa e non completata si "
+                                    "riprende; più lunga della durata di uno shard per non rifare lavoro")
+    lavora_parser.set_defaults(funzione=comando_lavora)
+
+    stato_parser = comandi.add_parser('stato', help="mostra quante unità sono completate")
+    stato_parser.add_argument('cartella')
+    stato_parser.set_defaults(funzione=comando_stato)
+
+    unisci_parser = comandi.add_parser('unisci', help="unisce i parziali in un file di risultati .npz")
+    unisci_parser.add_argument('cartella')
+    unisci_parser.add_argument('uscita', help="file .npz dei risultati, come 'montecarlo_cli.py simula'")
+    unisci_parser.set_defaults(funzione=comando_unisci)
+
+    argomenti = parser.parse_args(argv)
+    argomenti.funzione(argomenti)
+
+
+if __name__ == "__main__":
+    main()
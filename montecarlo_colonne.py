@@ -0,0 +1,132 @@
+import numpy as np
+
+# Contenitore compatto dei risultati: un array strutturato con una riga per simulazione e
+# le losing streak ordinate per simulazione in un secondo array strutturato, con
+# offset[i]:offset[i + 1] le streak della simulazione i (come una matrice sparsa CSR).
+# loss_count, expectancy e profit_factor non si salvano: si ricavano dagli altri campi.
+
+DTYPE_SIMULAZIONE = np.dtype([
+    ('capitale_finale', np.float64),
+    ('drawdown_massimo', np.float64),
+    ('somma_wins', np.float64),
+    ('somma_losses', np.float64),
+    ('trade_totali', np.int32),
+    ('win_count', np.int32),
+    ('tempo_sott_acqua_max', np.int32),
+    ('tempo_sott_acqua_medio', np.float64),
+    ('tempo_recupero', np.int32),
+    ('tempo_bancarotta', np.int32),
+])
+
+DTYPE_STREAK = np.dtype([
+    ('length', np.int32),
+    ('tick_loss_totali', np.int32),
+    ('max_contratti', np.int16),
+])
+
+
+def comprimi_risultati(risultati):
+    """
+    Converte i risultati del motore (un array per campo, losing streak piatte con
+    l'indice 'simulazione') nel contenitore compatto: un dizionario con 'simulazioni',
+    'streak' e 'offset'. Le streak di ogni simulazione restano nell'ordine originale.
+    """
+    n_simulazioni = len(risultati['capitale_finale'])
+    simulazioni = np.empty(n_simulazioni, dtype=DTYPE_SIMULAZIONE)
+    for campo in DTYPE_SIMULAZIONE.names:
+        simulazioni[campo] = risultati[campo]
+
+    losing_streaks = risultati['losing_streaks']
+    ordine = np.argsort(losing_streaks['simulazione'], kind='stable')
+    streak = np.empty(len(ordine), dtype=DTYPE_STREAK)
+    for campo in DTYPE_STREAK.names:
+        streak[campo] = losing_streaks[campo][ordine]
+    offset = np.zeros(n_simulazioni + 1, dtype=np.int64)
+    np.cumsum(np.bincount(losing_streaks['simulazione'], minlength=n_simulazioni), out=offset[1:])
+    return {'simulazioni': simulazioni, 'streak': streak, 'offset': offset}
+
+
+def espandi_risultati(colonne):
+    """Il contrario di comprimi_risultati: i risultati con gli stessi campi di simula_batch."""
+    simulazioni = colonne['simulazioni']
+    risultati = {campo: simulazioni[campo].copy() for campo in DTYPE_SIMULAZIONE.names}
+    trade_totali = risultati['trade_totali']
+    somma_wins = risultati['somma_wins']
+    somma_losses = risultati['somma_losses']
+    risultati['loss_count'] = trade_totali - risultati['win_count']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        risultati['expectancy'] = np.where(trade_totali > 0, (somma_wins + somma_losses) / np.maximum(trade_totali, 1), 0.0)
+        risultati['profit_factor'] = np.where(somma_losses != 0, np.abs(somma_wins / somma_losses), np.nan)
+    streak = colonne['streak']
+    risultati['losing_streaks'] = {
+        'simulazione': np.repeat(np.arange(len(simulazioni), dtype=np.int32), np.diff(colonne['offset'])),
+        **{campo: streak[campo].astype(np.int32) for campo in ('length', 'max_contratti', 'tick_loss_totali')},
+    }
+    return risultati
+
+
+def streak_simulazione(colonne, i):
+    """Losing streak della simulazione i (una vista, senza copie)."""
+    return colonne['streak'][colonne['offset'][i]:colonne['offset'][i + 1]]
+
+
+def riduci_per_simulazione(colonne, campo, ufunc=np.maximum, vuoto=0):
+    """
+    Riduce un campo delle streak simulazione per simulazione con una sola chiamata
+    a ufunc.reduceat sugli offset; le simulazioni senza streak valgono vuoto.
+    Esempio: riduci_per_simulazione(colonne, 'length') è la streak più lunga di ognuna.
+    """
+    offset = colonne['offset']
+    valori = colonne['streak'][campo]
+    risultato = np.full(len(offset) - 1, vuoto, dtype=np.result_type(valori, type(vuoto)))
+    piene = offset[1:] > offset[:-1]
+    if piene.any():
+        risultato[piene] = ufunc.reduceat(valori, offset[:-1][piene])
+    return risultato
+
+
+def totali(colonne, capitale_iniziale):
+    """
+    Le somme stampate da montecarlo_recovery.py, ognuna con una riduzione sulla sua
+    colonna: numero di simulazioni, perdenti, trade, vincite, perdite e somme.
+    """
+    simulazioni = colonne['simulazioni']
+    totale_trade = int(simulazioni['trade_totali'].sum(dtype=np.int64))
+    totale_win = int(simulazioni['win_count'].sum(dtype=np.int64))
+    return {
+        'n_simulazioni': len(simulazioni),
+        'n_simulazioni_perdenti': int(np.count_nonzero(simulazioni['capitale_finale'] < capitale_iniziale)),
+        'totale_trade': totale_trade,
+        'totale_win': totale_win,
+        'totale_loss': totale_trade - totale_win,
+        'somma_win_totale': simulazioni['somma_wins'].sum(),
+        'somma_loss_totale': simulazioni['somma_losses'].sum(),
+        'drawdown_massimo_medio': simulazioni['drawdown_massimo'].mean(),
+        'drawdown_massimo_totale': simulazioni['drawdown_massimo'].max(),
+    }
+
+
+def byte_risultati(risultati):
+    """Memoria occupata dagli array di un dizionario di risultati (anche annidato)."""
+    return sum(byte_risultati(v) if isinstance(v, dict) else np.asarray(v).nbytes for v in risultati.values())
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+    from montecarlo_streak import streak_piu_lunga
+
+    n_simulazioni = 20000
+    risultati = esegui_parallelo(n_simulazioni, {'n_scambi': 2000}, seed=0)
+    colonne = comprimi_risultati(risultati)
+    print(f"Risultati del motore: {byte_risultati(risultati) / 2 ** 20:.1f} MB, "
+          f"contenitore compatto: {byte_risultati(colonne) / 2 ** 20:.1f} MB")
+
+    inizio = time.perf_counter()
+    piu_lunga = riduci_per_simulazione(colonne, 'length')
+    durata = time.perf_counter() - inizio
+    uguali = np.array_equal(piu_lunga, streak_piu_lunga(risultati['losing_streaks'], n_simulazioni))
+    print(f"Streak più lunga per simulazione con reduceat: {durata * 1000:.1f} ms (uguale a streak_piu_lunga: {uguali})")
+    for k, v in totali(colonne, 500).items():
+        print(f"{k}: {v}")
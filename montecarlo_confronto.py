@@ -0,0 +1,93 @@
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT, genera_uniformi, simula_batch
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard
+
+# Strategie degli script: martingala (montecarlo_recovery.py) e 1 contratto
+# (montecarlo_recovery_1lose_per_1win.py), sugli stessi parametri di mercato
+STRATEGIA_MARTINGALA = {'max_contratti': 4}
+STRATEGIA_UN_CONTRATTO = {'max_contratti': 1}
+
+GRANDEZZE = ('capitale_finale', 'drawdown_massimo')
+
+
+def _confronta_shard(argomenti):
+    n, parametri_a, parametri_b, seme, antitetiche = argomenti
+    rng = np.random.default_rng(seme)
+    n_scambi = max(parametri_a['n_scambi'], parametri_b['n_scambi'])
+    uniformi = genera_uniformi(n, n_scambi, rng, antitetiche)
+    a = simula_batch(n, parametri_a, uniformi=uniformi)
+    b = simula_batch(n, parametri_b, uniformi=uniformi)
+    if antitetiche:
+        # Ogni coppia antitetica diventa un'unica osservazione (media della coppia): come in
+        # genera_uniformi la riga i è accoppiata con la riga i + (n + 1) // 2 (n è sempre pari)
+        meta = (n + 1) // 2
+        return {k: ((a[k][:meta] + a[k][meta:2 * meta]) / 2, (b[k][:meta] + b[k][meta:2 * meta]) / 2)
+                for k in GRANDEZZE}
+    return {k: (a[k], b[k]) for k in GRANDEZZE}
+
+
+def confronta_strategie(strategia_a, strategia_b, n_simulazioni, parametri=None, seed=None,
+                        antitetiche=False, n_workers=None, dimensione_shard=DIMENSIONE_SHARD):
+    """
+    Confronta due strategie (dizionari di parametri che sovrascrivono parametri) facendo
+    vedere a entrambe le stesse sequenze di trade (common random numbers): la differenza
+    tra le due stime ha molta meno varianza che con flussi casuali indipendenti.
+    Con antitetiche=True ogni shard usa coppie di percorsi antitetici (u, 1 - u); un
+    n_simulazioni dispari si arrotonda al pari successivo, così anche l'ultimo shard
+    è fatto solo di coppie complete.
+    Per capitale_finale e drawdown_massimo restituisce media di A, media di B, differenza
+    media, errore standard della differenza con CRN e quello che si avrebbe con
+    simulazioni indipendenti dello stesso numero di percorsi.
+    """
+    base = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    parametri_a = {**base, **strategia_a}
+    parametri_b = {**base, **strategia_b}
+    if antitetiche and dimensione_shard % 2:
+        raise ValueError("Con le variabili antitetiche dimensione_shard deve essere pari")
+    if antitetiche:
+        n_simulazioni += n_simulazioni % 2
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    argomenti = [(n, parametri_a, parametri_b, seme, antitetiche) for n, seme in zip(shard, semi)]
+
+    valori = {k: ([], []) for k in GRANDEZZE}
+    for parziale in itera_shard(_confronta_shard, argomenti, n_workers):
+        for k in GRANDEZZE:
+            valori[k][0].append(parziale[k][0])
+            valori[k][1].append(parziale[k][1])
+
+    confronto = {}
+    for k in GRANDEZZE:
+        a = np.concatenate(valori[k][0])
+        b = np.concatenate(valori[k][1])
+        n = len(a)
+        differenza = a - b
+        confronto[k] = {
+            'media_a': a.mean(),
+            'media_b': b.mean(),
+            'differenza': differenza.mean(),
+            'errore_std': differenza.std(ddof=1) / np.sqrt(n),
+            # Errore della differenza con due campioni indipendenti dello stesso numero di percorsi
+            'errore_std_indipendenti': np.sqrt((a.var(ddof=1) + b.var(ddof=1)) / n),
+            'osservazioni': n,
+        }
+    return confronto
+
+
+def stampa_confronto(confronto, nome_a='A', nome_b='B'):
+    print(f"\nCONFRONTO STRATEGIE: {nome_a} - {nome_b}")
+    print("=" * 90)
+    print(f"{'Grandezza':<18} | {nome_a:>12} | {nome_b:>12} | {'Differenza':>12} | {'Err. CRN':>10} | {'Err. indip.':>11}")
+    print("-" * 90)
+    for k, c in confronto.items():
+        print(f"{k:<18} | {c['media_a']:>12.2f} | {c['media_b']:>12.2f} | {c['differenza']:>12.2f} | "
+              f"{c['errore_std']:>10.2f} | {c['errore_std_indipendenti']:>11.2f}")
+
+
+if __name__ == "__main__":
+    for antitetiche in (False, True):
+        confronto = confronta_strategie(STRATEGIA_MARTINGALA, STRATEGIA_UN_CONTRATTO, 2000,
+                                        parametri={'n_scambi': 1000}, seed=0, antitetiche=antitetiche)
+        stampa_confronto(confronto, 'Martingala', '1 contratto')
+        print(f"Variabili antitetiche: {'sì' if antitetiche else 'no'}")
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati, esegui_shard
+from montecarlo_streaming import Momenti, Istogramma, limiti_da_batch, avvisa_fuori_intervallo, QUANTILI_VENTAGLIO
+
+# Semiampiezza massima dell'intervallo di confidenza per ogni stima (in $ o in probabilità)
+OBIETTIVI_DEFAULT = {
+    'prob_bancarotta': 0.005,
+    'capitale_medio': 50.0,
+    'drawdown_medio': 20.0,
+}
+
+# Quantile della normale per i livelli di confidenza usati
+QUANTILI_NORMALE = {0.90: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+
+
+def semiampiezza_proporzione(successi, n, z):
+    """Semiampiezza dell'intervallo di Agresti-Coull: non si azzera quando la proporzione è 0."""
+    n_corretto = n + z ** 2
+    p_corretta = (successi + z ** 2 / 2) / n_corretto
+    return z * np.sqrt(p_corretta * (1 - p_corretta) / n_corretto)
+
+
+def stato_convergenza(capitale, drawdown, bancarotte, z):
+    """Stime, errori standard e semiampiezze attuali delle tre grandezze controllate."""
+    n = int(capitale.n[0])
+    p = bancarotte / n
+    errori = {
+        'prob_bancarotta': np.sqrt(p * (1 - p) / n),
+        'capitale_medio': np.sqrt(capitale.varianza()[0] / n),
+        'drawdown_medio': np.sqrt(drawdown.varianza()[0] / n),
+    }
+    semiampiezze = {
+        'prob_bancarotta': semiampiezza_proporzione(bancarotte, n, z),
+        'capitale_medio': z * errori['capitale_medio'],
+        'drawdown_medio': z * errori['drawdown_medio'],
+    }
+    stime = {
+        'prob_bancarotta': p,
+        'capitale_medio': capitale.media[0],
+        'drawdown_medio': drawdown.media[0],
+    }
+    return stime, errori, semiampiezze
+
+
+def simula_adattiva(parametri=None, obiettivi=None, livello=0.95, seed=None, n_workers=None,
+                    dimensione_shard=DIMENSIONE_SHARD, max_simulazioni=1_000_000, salva_storico=False):
+    """
+    Esegue shard di simulazioni finché le semiampiezze degli intervalli di confidenza
+    di prob_bancarotta, capitale_medio e drawdown_medio scendono sotto gli obiettivi
+    (o si arriva a max_simulazioni). A ogni giro si eseguono n_workers shard in parallelo.
+    Gli shard usano gli stessi semi e le stesse dimensioni di esegui_parallelo (l'ultimo
+    si accorcia per non superare max_simulazioni): con n simulazioni usate i percorsi
+    sono identici a esegui_parallelo(n, ..., seed=seed).
+    salva_storico è come in esegui_parallelo; con un intero k si tengono solo le prime
+    k curve e in più si restituiscono, calcolati su tutti i percorsi un giro alla
+    volta, 'evoluzione_media', 'ventaglio' e 'istogramma_passi' (Istogramma del
+    capitale per passo, con gli intervalli fissati dal primo shard come in
+    simula_streaming).
+    Restituisce (risultati, rapporto): risultati come esegui_parallelo, rapporto con
+    stime, errori standard, semiampiezze, n_simulazioni usate e 'convergenza' (bool).
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    obiettivi = {**OBIETTIVI_DEFAULT, **(obiettivi or {})}
+    z = QUANTILI_NORMALE[livello]
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    semi = np.random.SeedSequence(seed)
+
+    # Con un numero di curve lo storico completo di ogni shard si riassume e si scarta
+    campione = salva_storico is not True and salva_storico is not False
+    passi = istogramma = None
+    curve_tenute = 0
+
+    capitale = Momenti(1)
+    drawdown = Momenti(1)
+    bancarotte = 0
+    parziali = []
+    eseguite = 0
+    convergenza = False
+    while not convergenza and eseguite < max_simulazioni:
+        shard = pianifica_shard(min(max_simulazioni - eseguite, n_workers * dimensione_shard), dimensione_shard)
+        argomenti = [(n, parametri, seme, True if campione else salva_storico)
+                     for n, seme in zip(shard, semi.spawn(len(shard)))]
+        eseguite += sum(shard)
+        for parziale in itera_shard(esegui_shard, argomenti, n_workers):
+            if campione:
+                storico = parziale['storico_saldo']
+                if istogramma is None:
+                    passi = Momenti(storico.shape[1])
+                    istogramma = Istogramma(*limiti_da_batch(parziale)['passi'])
+                passi.aggiungi(storico)
+                istogramma.aggiungi(storico)
+                parziale['storico_saldo'] = storico[:max(0, int(salva_storico) - curve_tenute)]
+                curve_tenute += len(parziale['storico_saldo'])
+            parziali.append(parziale)
+            capitale.aggiungi(parziale['capitale_finale'][:, None])
+            drawdown.aggiungi(parziale['drawdown_massimo'][:, None])
+            bancarotte += int(np.sum(parziale['capitale_finale'] <= 0))
+        stime, errori, semiampiezze = stato_convergenza(capitale, drawdown, bancarotte, z)
+        convergenza = all(semiampiezze[k] <= obiettivi[k] for k in obiettivi)
+
+    rapporto = {
+        'n_simulazioni': int(capitale.n[0]),
+        'convergenza': convergenza,
+        'livello': livello,
+        'stime': stime,
+        'errori_standard': errori,
+        'semiampiezze': semiampiezze,
+        'obiettivi': obiettivi,
+    }
+    risultati = unisci_risultati(parziali)
+    if campione:
+        risultati['evoluzione_media'] = np.where(passi.n > 0, passi.media, np.nan)
+        risultati['ventaglio'] = np.array([istogramma.quantili(q) for q in QUANTILI_VENTAGLIO])
+        risultati['istogramma_passi'] = istogramma
+        avvisa_fuori_intervallo({'capitale per passo': istogramma})
+    return risultati, rapporto
+
+
+def stampa_convergenza(rapporto):
+    """Stampa simulazioni usate, stime ed errori ottenuti rispetto agli obiettivi."""
+    print("\nCONVERGENZA ADATTIVA")
+    print("=" * 90)
+    esito = "raggiunta" if rapporto['convergenza'] else "NON raggiunta (limite di simulazioni)"
+    print(f"Simulazioni usate: {rapporto['n_simulazioni']} - convergenza {esito}")
+    print(f"{'Stima':<18} | {'Valore':>12} | {'Errore std':>12} | {'± IC ' + format(rapporto['livello'], '.0%'):>12} | {'Obiettivo':>10}")
+    print("-" * 90)
+    for k, obiettivo in rapporto['obiettivi'].items():
+        print(f"{k:<18} | {rapporto['stime'][k]:>12.4f} | {rapporto['errori_standard'][k]:>12.4f} | "
+              f"{rapporto['semiampiezze'][k]:>12.4f} | {obiettivo:>10.4f}")
+
+
+if __name__ == "__main__":
+    _, rapporto = simula_adattiva(seed=0)
+    stampa_convergenza(rapporto)
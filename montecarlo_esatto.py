@@ -0,0 +1,197 @@
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT
+
+# Probabilità sotto cui uno stato del reticolo viene trascurato (la massa totale
+# scartata è riportata nel risultato)
+TOLLERANZA_RETICOLO = 1e-18
+
+
+def passi_reticolo(parametri):
+    """
+    Con un numero fisso di contratti ogni trade sposta il capitale di +vincita o
+    -perdita (commissioni comprese): il capitale dopo t trade con w vincite è
+    capitale_iniziale + w * vincita - (t - w) * perdita.
+    Restituisce (vincita, perdita). Vale per dimensionamento 'fisso' o per la
+    martingala con max_contratti = 1, con trade indipendenti ed esiti nominali.
+    """
+    if parametri.get('regimi') is not None or parametri.get('modello_esiti') is not None:
+        raise ValueError("La soluzione esatta richiede trade indipendenti con esiti nominali "
+                         "(regimi=None, modello_esiti=None)")
+    if parametri['dimensionamento'] == 'fisso':
+        contratti = parametri['contratti_iniziali']
+    elif parametri['dimensionamento'] == 'martingala' and parametri['max_contratti'] == 1:
+        contratti = 1
+    else:
+        raise ValueError("La soluzione esatta richiede un numero fisso di contratti")
+    commissione = 2 * parametri['commissione_per_contratto'] * contratti
+    vincita = parametri['take_profit_ticks'] * parametri['valore_tick'] * contratti - commissione
+    perdita = parametri['stop_loss_ticks'] * parametri['valore_tick'] * contratti + commissione
+    return vincita, perdita
+
+
+def risolvi_reticolo(parametri=None, quantili=()):
+    """
+    Distribuzione esatta del capitale per la strategia a contratti fissi, con la
+    bancarotta come barriera assorbente (capitale <= 0), per programmazione dinamica
+    sul reticolo del numero di vincite, senza campionamento. Si tengono solo gli stati
+    con probabilità sopra TOLLERANZA_RETICOLO: O(n_scambi^1.5) operazioni.
+    Restituisce un dizionario con:
+      - 'capitali', 'probabilita': capitali finali dei percorsi non falliti e loro probabilità;
+      - 'capitali_bancarotta', 'probabilita_bancarotta': capitale al momento della
+        bancarotta (tra -perdita e 0) e probabilità;
+      - 'prob_bancarotta' e 'tempi_bancarotta' (P(bancarotta al trade t), t = 0..n_scambi);
+      - 'evoluzione_media': capitale medio dei percorsi ancora attivi dopo ogni trade,
+        come np.nanmean sullo storico delle simulazioni;
+      - 'prob_attivi': probabilità di essere ancora attivi dopo ogni trade;
+      - 'quantili_passi': i quantili richiesti del capitale dei percorsi attivi dopo
+        ogni trade, matrice (len(quantili), n_scambi + 1);
+      - 'massa_scartata': probabilità totale degli stati trascurati.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    n_scambi = parametri['n_scambi']
+    p = parametri['win_rate']
+    q = 1 - p
+    capitale_iniziale = parametri['capitale_iniziale']
+    vincita, perdita = passi_reticolo(parametri)
+
+    # distribuzione[w - inizio] = P(attivo dopo t trade con w vincite); fuori dalla finestra
+    # [inizio, inizio + len(distribuzione)) le probabilità sono sotto TOLLERANZA_RETICOLO
+    distribuzione = np.ones(1)
+    inizio = 0
+    tempi_bancarotta = np.zeros(n_scambi + 1)
+    evoluzione_media = np.full(n_scambi + 1, float(capitale_iniziale))
+    prob_attivi = np.ones(n_scambi + 1)
+    quantili = np.asarray(quantili, dtype=np.float64)
+    quantili_passi = np.full((len(quantili), n_scambi + 1), float(capitale_iniziale))
+    valori_bancarotta = []
+    masse_bancarotta = []
+    massa_scartata = 0.0
+    for t in range(1, n_scambi + 1):
+        successiva = np.zeros(len(distribuzione) + 1)
+        successiva[:-1] = q * distribuzione
+        successiva[1:] += p * distribuzione
+        distribuzione = successiva
+
+        vincite = np.arange(inizio, inizio + len(distribuzione))
+        capitali = capitale_iniziale + vincite * vincita - (t - vincite) * perdita
+        falliti = capitali <= 0
+        if falliti.any():
+            valori_bancarotta.append(capitali[falliti])
+            masse_bancarotta.append(distribuzione[falliti])
+            tempi_bancarotta[t] = masse_bancarotta[-1].sum()
+            distribuzione[falliti] = 0.0
+
+        # Le code trascurabili escono dalla finestra: il costo resta proporzionale alla sua larghezza
+        rilevanti = np.flatnonzero(distribuzione > TOLLERANZA_RETICOLO)
+        if len(rilevanti) == 0:
+            massa_scartata += distribuzione.sum()
+            prob_attivi[t:] = 0.0
+            evoluzione_media[t:] = np.nan
+            quantili_passi[:, t:] = np.nan
+            break
+        primo, ultimo = rilevanti[0], rilevanti[-1] + 1
+        massa_scartata += distribuzione[:primo].sum() + distribuzione[ultimo:].sum()
+        distribuzione = distribuzione[primo:ultimo]
+        capitali = capitali[primo:ultimo]
+        inizio += primo
+
+        prob_attivi[t] = distribuzione.sum()
+        evoluzione_media[t] = distribuzione @ capitali / prob_attivi[t]
+        if len(quantili) > 0:
+            # Il capitale cresce con il numero di vincite: la finestra è già ordinata
+            cumulati = np.cumsum(distribuzione) / prob_attivi[t]
+            quantili_passi[:, t] = capitali[np.minimum(np.searchsorted(cumulati, quantili), len(capitali) - 1)]
+
+    probabilita = np.zeros(n_scambi + 1)
+    if prob_attivi[-1] > 0:
+        probabilita[inizio:inizio + len(distribuzione)] = distribuzione
+    vincite = np.arange(n_scambi + 1)
+    capitali_finali = capitale_iniziale + vincite * vincita - (n_scambi - vincite) * perdita
+    if valori_bancarotta:
+        valori, inversi = np.unique(np.concatenate(valori_bancarotta), return_inverse=True)
+        masse = np.bincount(inversi, np.concatenate(masse_bancarotta))
+    else:
+        valori = masse = np.zeros(0)
+    return {
+        'capitali': capitali_finali,
+        'probabilita': probabilita,
+        'capitali_bancarotta': valori,
+        'probabilita_bancarotta': masse,
+        'prob_bancarotta': tempi_bancarotta.sum(),
+        'tempi_bancarotta': tempi_bancarotta,
+        'evoluzione_media': evoluzione_media,
+        'prob_attivi': prob_attivi,
+        'quantili_passi': quantili_passi,
+        'passo_reticolo': vincita + perdita,
+        'massa_scartata': massa_scartata,
+    }
+
+
+def distribuzione_finale(soluzione):
+    """Capitale finale di tutti i percorsi (falliti compresi): valori ordinati e probabilità."""
+    valori = np.concatenate([soluzione['capitali_bancarotta'], soluzione['capitali']])
+    probabilita = np.concatenate([soluzione['probabilita_bancarotta'], soluzione['probabilita']])
+    ordine = np.argsort(valori, kind='stable')
+    return valori[ordine], probabilita[ordine]
+
+
+def quantile_esatto(valori, probabilita, q):
+    """Quantile q di una distribuzione discreta con valori ordinati."""
+    return valori[min(np.searchsorted(np.cumsum(probabilita), q), len(valori) - 1)]
+
+
+def statistiche_esatte(soluzione, capitale_iniziale, n_simulazioni):
+    """
+    Statistiche del capitale finale con le chiavi di stat_globali degli script, più il
+    tempo medio di bancarotta. Come negli script sotto_capitale_iniziale è un numero di
+    simulazioni: quello atteso su n_simulazioni percorsi.
+    """
+    valori, probabilita = distribuzione_finale(soluzione)
+    media = probabilita @ valori
+    varianza = probabilita @ (valori - media) ** 2
+    possibili = valori[probabilita > 0]
+    tempi = soluzione['tempi_bancarotta']
+    return {
+        'capitale_medio': media,
+        'capitale_mediano': quantile_esatto(valori, probabilita, 0.5),
+        'varianza': varianza,
+        'dev_std': np.sqrt(varianza),
+        'q1': quantile_esatto(valori, probabilita, 0.25),
+        'q3': quantile_esatto(valori, probabilita, 0.75),
+        'max': possibili.max(),
+        'min': possibili.min(),
+        'prob_bancarotta': soluzione['prob_bancarotta'],
+        'sotto_capitale_iniziale': n_simulazioni * probabilita[valori < capitale_iniziale].sum(),
+        'tempo_medio_bancarotta': np.arange(len(tempi)) @ tempi / tempi.sum() if tempi.sum() > 0 else np.nan,
+    }
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+
+    parametri = {'dimensionamento': 'fisso', 'n_scambi': 500, 'win_rate': 0.45, 'capitale_iniziale': 200,
+                 'stop_loss_ticks': 15, 'take_profit_ticks': 20}
+    n_simulazioni = 20000
+    inizio = time.perf_counter()
+    soluzione = risolvi_reticolo(parametri)
+    durata = time.perf_counter() - inizio
+    esatte = statistiche_esatte(soluzione, parametri['capitale_iniziale'], n_simulazioni)
+    print(f"\nSOLUZIONE ESATTA ({durata * 1000:.1f} ms)")
+    print("=" * 90)
+    for k, v in esatte.items():
+        print(f"{k}: {v:.6f}")
+
+    risultati = esegui_parallelo(n_simulazioni, parametri, seed=0)
+    capitali = risultati['capitale_finale']
+    falliti = capitali <= 0
+    print(f"\nVERIFICA CON {n_simulazioni} SIMULAZIONI")
+    print("=" * 90)
+    print(f"Probabilità di bancarotta: esatta {esatte['prob_bancarotta']:.4f} | simulata {falliti.mean():.4f}")
+    print(f"Capitale medio: esatto {esatte['capitale_medio']:.2f} | simulato {capitali.mean():.2f}")
+    print(f"Sotto il capitale iniziale: attese {esatte['sotto_capitale_iniziale']:.0f} | "
+          f"simulate {np.sum(capitali < parametri['capitale_iniziale'])}")
+    print(f"Tempo medio di bancarotta: esatto {esatte['tempo_medio_bancarotta']:.1f} | "
+          f"simulato {risultati['trade_totali'][falliti].mean():.1f}")
@@ -0,0 +1,110 @@
+import numpy as np
+
+# Modello degli esiti dei trade più realistico di "sempre take_profit_ticks o
+# stop_loss_ticks, sempre 2 * commissione_per_contratto", attivato da
+# parametri['modello_esiti'] nel motore. Tutti i campi sono facoltativi:
+#
+#     'modello_esiti': {
+#         'slippage_stop': {'tipo': 'esponenziale', 'media': 0.5},   # tick persi in più sugli stop
+#         'slippage_take': {'tipo': 'uniforme', 'minimo': 0, 'massimo': 1},  # tick in meno sui take
+#         'commissione': {'tipo': 'normale', 'media': 1.5, 'dev_std': 0.1},  # per contratto e per lato
+#         'prob_uscita_tempo': 0.1,   # probabilità che il trade venga chiuso a tempo
+#         'uscita_tempo': {'tipo': 'normale', 'media': 0, 'dev_std': 6},    # tick del trade chiuso a tempo
+#     }
+#
+# I tick possono essere frazionari. Un trade chiuso a tempo ha un risultato tra
+# -stop_loss_ticks e +take_profit_ticks ed è vincente se positivo.
+
+
+def _costante(rng, forma, valore=0.0):
+    return np.full(forma, float(valore))
+
+
+def _uniforme(rng, forma, minimo=0.0, massimo=1.0):
+    return rng.uniform(minimo, massimo, forma)
+
+
+def _normale(rng, forma, media=0.0, dev_std=1.0):
+    return rng.normal(media, dev_std, forma)
+
+
+def _esponenziale(rng, forma, media=1.0):
+    return rng.exponential(media, forma)
+
+
+def _empirica(rng, forma, valori=(0.0,), probabilita=None):
+    return rng.choice(np.asarray(valori, dtype=np.float64), forma, p=probabilita)
+
+
+# Distribuzioni disponibili nel modello, indicate con {'tipo': nome, **parametri}:
+# i nomi tengono il modello serializzabile (cache dello sweep, CLI, metadati)
+DISTRIBUZIONI = {
+    'costante': _costante,
+    'uniforme': _uniforme,
+    'normale': _normale,
+    'esponenziale': _esponenziale,
+    'empirica': _empirica,
+}
+
+
+def estrai(distribuzione, forma, rng):
+    """Matrice di valori estratti in blocco da una distribuzione {'tipo': ..., **parametri}."""
+    parametri = dict(distribuzione)
+    tipo = parametri.pop('tipo')
+    if tipo not in DISTRIBUZIONI:
+        raise ValueError(f"Distribuzione sconosciuta: {tipo} (valide: {', '.join(DISTRIBUZIONI)})")
+    return DISTRIBUZIONI[tipo](rng, forma, **parametri)
+
+
+def esiti_blocco(casuali, parametri, rng):
+    """
+    Tick per contratto (con segno) e commissione per contratto (andata e ritorno) di un
+    blocco di trade, come due matrici della forma di casuali. Il trade raggiunge il take
+    profit se il suo numero casuale è sotto win_rate, come nel motore; slippage,
+    commissioni e uscite a tempo sono estratti in blocco con rng.
+    """
+    modello = parametri['modello_esiti']
+    tp = parametri['take_profit_ticks']
+    sl = parametri['stop_loss_ticks']
+    forma = casuali.shape
+
+    vincenti = casuali < parametri['win_rate']
+    tick = np.where(vincenti, float(tp), -float(sl))
+    if 'slippage_take' in modello:
+        tick -= vincenti * estrai(modello['slippage_take'], forma, rng)
+    if 'slippage_stop' in modello:
+        tick -= ~vincenti * estrai(modello['slippage_stop'], forma, rng)
+    if modello.get('prob_uscita_tempo', 0) > 0:
+        a_tempo = rng.random(forma) < modello['prob_uscita_tempo']
+        uscita = np.clip(estrai(modello.get('uscita_tempo', {'tipo': 'costante'}), forma, rng), -sl, tp)
+        np.copyto(tick, uscita, where=a_tempo)
+
+    if 'commissione' in modello:
+        commissioni = 2 * np.maximum(estrai(modello['commissione'], forma, rng), 0.0)
+    else:
+        commissioni = np.full(forma, 2.0 * parametri['commissione_per_contratto'])
+    return tick, commissioni
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+
+    modelli = {
+        'nominale': None,
+        'slippage': {'slippage_stop': {'tipo': 'esponenziale', 'media': 1.0},
+                     'slippage_take': {'tipo': 'uniforme', 'minimo': 0, 'massimo': 1}},
+        'completo': {'slippage_stop': {'tipo': 'esponenziale', 'media': 1.0},
+                     'slippage_take': {'tipo': 'uniforme', 'minimo': 0, 'massimo': 1},
+                     'commissione': {'tipo': 'uniforme', 'minimo': 1.2, 'massimo': 2.2},
+                     'prob_uscita_tempo': 0.15, 'uscita_tempo': {'tipo': 'normale', 'media': 0, 'dev_std': 8}},
+    }
+    for nome, modello in modelli.items():
+        inizio = time.perf_counter()
+        risultati = esegui_parallelo(20000, {'modello_esiti': modello}, seed=0)
+        durata = time.perf_counter() - inizio
+        expectancy = (risultati['somma_wins'].sum() + risultati['somma_losses'].sum()) / risultati['trade_totali'].sum()
+        print(f"{nome:<9} | bancarotta {np.mean(risultati['capitale_finale'] <= 0):.2%} | "
+              f"expectancy {expectancy:6.2f} $/trade | "
+              f"win rate {risultati['win_count'].sum() / risultati['trade_totali'].sum():.3f} | {durata:.2f} s")
@@ -0,0 +1,144 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
+
+from montecarlo_parallelo import DIMENSIONE_SHARD
+
+# Righe (bin di capitale) dell'immagine di densità delle curve
+N_BIN_DENSITA = 200
+
+
+def densita_curve(storico, n_bin=N_BIN_DENSITA, limiti=None, dimensione_blocco=DIMENSIONE_SHARD):
+    """
+    Istogramma 2D delle curve del capitale: conteggi[i, t] = numero di percorsi attivi
+    con capitale nel bin i dopo il trade t. La matrice (anche un np.memmap) viene letta
+    a blocchi di righe; senza limiti si fa prima un passaggio per minimo e massimo.
+    Restituisce un dizionario con 'conteggi' (n_bin, n_passi) e 'limiti' (minimo, massimo).
+    """
+    n_passi = storico.shape[1]
+    if limiti is None:
+        minimo, massimo = np.inf, -np.inf
+        for inizio in range(0, len(storico), dimensione_blocco):
+            blocco = np.asarray(storico[inizio:inizio + dimensione_blocco], dtype=np.float64)
+            minimo = np.fmin(minimo, np.fmin.reduce(blocco, axis=None))
+            massimo = np.fmax(massimo, np.fmax.reduce(blocco, axis=None))
+        if not np.isfinite(minimo):
+            minimo, massimo = 0.0, 1.0
+        limiti = (float(minimo), float(max(massimo, minimo + 1.0)))
+    minimo, massimo = limiti
+    larghezza = (massimo - minimo) / n_bin
+
+    conteggi = np.zeros(n_bin * n_passi, dtype=np.int64)
+    colonne = np.arange(n_passi)
+    for inizio in range(0, len(storico), dimensione_blocco):
+        blocco = np.asarray(storico[inizio:inizio + dimensione_blocco], dtype=np.float64)
+        validi = ~np.isnan(blocco)
+        righe = np.clip(np.floor((np.where(validi, blocco, minimo) - minimo) / larghezza), 0, n_bin - 1)
+        indici = righe.astype(np.int64) * n_passi + colonne
+        conteggi += np.bincount(indici[validi], minlength=conteggi.size)
+    return {'conteggi': conteggi.reshape(n_bin, n_passi), 'limiti': limiti}
+
+
+def densita_da_istogramma(istogramma, n_bin=N_BIN_DENSITA):
+    """
+    La stessa immagine di densita_curve a partire dagli istogrammi per passo di un
+    AccumulatoreStreaming (quantili_passi), che hanno bin diversi per ogni colonna:
+    i conteggi vengono riportati su una griglia comune dal centro dei loro bin.
+    """
+    conteggi = istogramma.conteggi
+    n_passi = len(conteggi)
+    centri = istogramma.minimi[:, None] + istogramma.larghezza[:, None] * (np.arange(istogramma.n_bin) + 0.5)
+    pieni = conteggi > 0
+    if not pieni.any():
+        return {'conteggi': np.zeros((n_bin, n_passi), dtype=np.int64), 'limiti': (0.0, 1.0)}
+    minimo = centri[pieni].min() - istogramma.larghezza.max() / 2
+    massimo = centri[pieni].max() + istogramma.larghezza.max() / 2
+    larghezza = (massimo - minimo) / n_bin
+    righe = np.clip(np.floor((centri[pieni] - minimo) / larghezza), 0, n_bin - 1).astype(np.int64)
+    indici = righe * n_passi + np.nonzero(pieni)[0]
+    densita = np.bincount(indici, weights=conteggi[pieni], minlength=n_bin * n_passi)
+    return {'conteggi': densita.astype(np.int64).reshape(n_bin, n_passi), 'limiti': (minimo, massimo)}
+
+
+def densita_risultati(risultati):
+    """
+    Densità delle curve di un dizionario di risultati: dagli istogrammi per passo se ci
+    sono (simula_adattiva con un campione di curve), altrimenti da tutto lo storico.
+    """
+    if 'istogramma_passi' in risultati:
+        return densita_da_istogramma(risultati['istogramma_passi'])
+    return densita_curve(risultati['storico_saldo'])
+
+
+def lttb(curva, n_punti):
+    """
+    Sottocampionamento Largest-Triangle-Three-Buckets di una curva (indici come ascisse):
+    tiene n_punti punti scegliendo in ogni gruppo quello che forma il triangolo più
+    grande con il punto scelto prima e la media del gruppo dopo, così picchi e crolli
+    restano visibili. I NaN finali (dopo la bancarotta) vengono scartati.
+    Restituisce (indici, valori).
+    """
+    curva = np.asarray(curva, dtype=np.float64)
+    x = np.flatnonzero(~np.isnan(curva))
+    y = curva[x]
+    n = len(y)
+    if n_punti is None or n_punti >= n or n_punti < 3:
+        return x, y
+    # Primo e ultimo punto restano; i punti intermedi sono divisi in n_punti - 2 gruppi
+    bordi = np.linspace(1, n - 1, n_punti - 1).astype(np.int64)
+    scelti = np.empty(n_punti, dtype=np.int64)
+    scelti[0], scelti[-1] = 0, n - 1
+    a = 0
+    for i in range(n_punti - 2):
+        inizio, fine = bordi[i], bordi[i + 1]
+        dopo = slice(bordi[i + 1], bordi[i + 2]) if i + 2 < len(bordi) else slice(n - 1, n)
+        media_x, media_y = x[dopo].mean(), y[dopo].mean()
+        aree = np.abs((x[a] - media_x) * (y[inizio:fine] - y[a]) - (x[a] - x[inizio:fine]) * (media_y - y[a]))
+        a = inizio + int(np.argmax(aree))
+        scelti[i + 1] = a
+    return x[scelti], y[scelti]
+
+
+def disegna_densita(densita, ax=None, cmap='Blues'):
+    """
+    Disegna l'immagine di densità delle curve con imshow: il tempo di disegno dipende
+    solo dalla dimensione dell'immagine, non dal numero di simulazioni.
+    """
+    ax = ax or plt.gca()
+    conteggi = densita['conteggi']
+    minimo, massimo = densita['limiti']
+    # Scala logaritmica: i percorsi rari nelle code restano visibili accanto al centro
+    return ax.imshow(np.ma.masked_equal(conteggi, 0), origin='lower', aspect='auto', cmap=cmap, norm=LogNorm(),
+                     interpolation='nearest', extent=(-0.5, conteggi.shape[1] - 0.5, minimo, massimo))
+
+
+def disegna_curve(curve, ax=None, n_punti=None, **stile):
+    """
+    Disegna le curve sottocampionate con lttb a n_punti punti ciascuna (tutti i punti
+    con n_punti=None). Pensata per poche curve evidenziate: per tutte le simulazioni
+    c'è disegna_densita.
+    """
+    ax = ax or plt.gca()
+    for curva in curve:
+        ax.plot(*lttb(curva, n_punti), **stile)
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+
+    parametri = {'n_scambi': 2000, 'max_contratti': 1, 'win_rate': 0.55}
+    for n_simulazioni in (1000, 10000, 50000):
+        storico = esegui_parallelo(n_simulazioni, parametri, seed=0, salva_storico=True)['storico_saldo']
+        inizio = time.perf_counter()
+        densita = densita_curve(storico)
+        calcolo = time.perf_counter() - inizio
+        inizio = time.perf_counter()
+        figura = plt.figure()
+        disegna_densita(densita)
+        disegna_curve(storico[:20], n_punti=300, color='orange', linewidth=0.8)
+        figura.canvas.draw()
+        plt.close(figura)
+        print(f"{n_simulazioni} curve: densità calcolata in {calcolo:.2f} s, "
+              f"disegnata con 20 curve LTTB in {time.perf_counter() - inizio:.2f} s")
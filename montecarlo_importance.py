@@ -0,0 +1,110 @@
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT
+from montecarlo_parallelo import DIMENSIONE_SHARD, esegui_parallelo
+
+
+def log_pesi(risultati, win_rate, win_rate_simulato):
+    """
+    Logaritmo del rapporto di verosimiglianza di ogni percorso tra il win_rate reale e
+    quello usato per simulare. Dipende solo dal numero di trade vinti e persi (la
+    bancarotta è un tempo d'arresto, quindi il peso resta corretto anche per i percorsi
+    interrotti).
+    """
+    return (risultati['win_count'] * np.log(win_rate / win_rate_simulato)
+            + risultati['loss_count'] * np.log((1 - win_rate) / (1 - win_rate_simulato)))
+
+
+def quantile_pesato(valori, pesi, q):
+    """Quantile q della distribuzione pesata (pesi autonormalizzati)."""
+    ordine = np.argsort(valori)
+    cumulati = np.cumsum(pesi[ordine])
+    cumulati /= cumulati[-1]
+    return valori[ordine][np.searchsorted(cumulati, q)]
+
+
+def ess(pesi):
+    """Dimensione campionaria efficace di Kish: (somma dei pesi)^2 / somma dei pesi^2."""
+    return pesi.sum() ** 2 / np.sum(pesi ** 2) if len(pesi) and np.any(pesi) else 0.0
+
+
+def stima_pesata(indicatori, pesi):
+    """Stima non distorta di P(evento) = E[peso * indicatore] e il suo errore standard."""
+    campioni = pesi * indicatori
+    return campioni.mean(), campioni.std(ddof=1) / np.sqrt(len(campioni))
+
+
+def simula_importance(n_simulazioni, win_rate_simulato, parametri=None, soglia_drawdown=None,
+                      quantile_drawdown=0.999, seed=None, n_workers=None, dimensione_shard=DIMENSIONE_SHARD):
+    """
+    Importance sampling per gli eventi rari della martingala: si simula con un
+    win_rate più basso (più losing streak lunghe, più bancarotte) e si ripesa ogni
+    percorso con il rapporto di verosimiglianza rispetto al win_rate reale.
+    Restituisce le stime non distorte di prob_bancarotta e, se indicata, di
+    P(drawdown_massimo > soglia_drawdown), con errori standard, il quantile
+    quantile_drawdown del drawdown massimo e la dimensione campionaria efficace
+    (ESS di Kish) dei pesi, su tutti i percorsi e sui soli percorsi falliti.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if parametri['regimi'] is not None or parametri['modello_esiti'] is not None:
+        raise ValueError("Il rapporto di verosimiglianza vale solo per trade indipendenti con esiti nominali "
+                         "(regimi=None, modello_esiti=None)")
+    win_rate = parametri['win_rate']
+    risultati = esegui_parallelo(n_simulazioni, {**parametri, 'win_rate': win_rate_simulato}, seed=seed,
+                                 n_workers=n_workers, dimensione_shard=dimensione_shard)
+    pesi = np.exp(log_pesi(risultati, win_rate, win_rate_simulato))
+    drawdowns = risultati['drawdown_massimo']
+
+    prob_bancarotta, errore_bancarotta = stima_pesata(risultati['capitale_finale'] <= 0, pesi)
+    stime = {
+        'prob_bancarotta': prob_bancarotta,
+        'errore_std_bancarotta': errore_bancarotta,
+        'drawdown_quantile': quantile_pesato(drawdowns, pesi, quantile_drawdown),
+        'ess': ess(pesi),
+        'ess_bancarotta': ess(pesi[risultati['capitale_finale'] <= 0]),
+        'n_simulazioni': n_simulazioni,
+        'win_rate_simulato': win_rate_simulato,
+    }
+    if soglia_drawdown is not None:
+        stime['prob_drawdown_oltre_soglia'], stime['errore_std_drawdown'] = stima_pesata(drawdowns > soglia_drawdown, pesi)
+    return stime
+
+
+def scegli_win_rate_simulato(candidati, n_pilota, parametri=None, seed=None, n_workers=None):
+    """
+    Prova ogni win_rate candidato con n_pilota simulazioni e restituisce quello con
+    l'errore relativo più basso sulla probabilità di bancarotta.
+    """
+    migliore, errore_migliore = None, np.inf
+    for candidato in candidati:
+        stime = simula_importance(n_pilota, candidato, parametri, seed=seed, n_workers=n_workers)
+        if stime['prob_bancarotta'] > 0:
+            errore_relativo = stime['errore_std_bancarotta'] / stime['prob_bancarotta']
+            if errore_relativo < errore_migliore:
+                migliore, errore_migliore = candidato, errore_relativo
+    return migliore
+
+
+if __name__ == "__main__":
+    # Capitale più alto e orizzonte più breve: la bancarotta diventa un evento raro
+    parametri = {'capitale_iniziale': 2000, 'n_scambi': 1000}
+    n_simulazioni = 20000
+
+    semplice = esegui_parallelo(n_simulazioni, parametri, seed=1)
+    bancarotte = semplice['capitale_finale'] <= 0
+    p = bancarotte.mean()
+    print("\nMONTE CARLO SEMPLICE")
+    print("=" * 90)
+    print(f"Probabilità di bancarotta: {p:.6f} ± {np.sqrt(p * (1 - p) / n_simulazioni):.6f}")
+    print(f"Drawdown massimo al 99.9%: ${np.quantile(semplice['drawdown_massimo'], 0.999):,.2f}")
+
+    win_rate_simulato = scegli_win_rate_simulato([0.50, 0.48, 0.46, 0.44], 2000, parametri, seed=2)
+    stime = simula_importance(n_simulazioni, win_rate_simulato, parametri, soglia_drawdown=3000, seed=3)
+    print("\nIMPORTANCE SAMPLING")
+    print("=" * 90)
+    print(f"Win rate simulato: {win_rate_simulato}")
+    print(f"Probabilità di bancarotta: {stime['prob_bancarotta']:.6f} ± {stime['errore_std_bancarotta']:.6f}")
+    print(f"P(drawdown > $3,000): {stime['prob_drawdown_oltre_soglia']:.6f} ± {stime['errore_std_drawdown']:.6f}")
+    print(f"Drawdown massimo al 99.9%: ${stime['drawdown_quantile']:,.2f}")
+    print(f"Dimensione campionaria efficace: {stime['ess']:,.0f} su {n_simulazioni} "
+          f"({stime['ess_bancarotta']:,.0f} tra i percorsi falliti)")
@@ -0,0 +1,385 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT, BLOCCO_PASSI, simula_batch
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard, unisci_risultati
+
+# Numba è opzionale: senza, tutte le funzioni usano il motore NumPy
+try:
+    from numba import njit, prange, set_num_threads
+    NUMBA_DISPONIBILE = True
+except ImportError:
+    prange = range
+    NUMBA_DISPONIBILE = False
+
+# Codici delle regole di dimensionamento di montecarlo_motore implementate nel kernel
+CODICI_DIMENSIONAMENTO = {'martingala': 0, 'fisso': 1, 'frazione_fissa': 2, 'evo': 3}
+
+
+def uniformi_motore(n_simulazioni, n_scambi, rng):
+    """
+    Matrice (n_simulazioni, n_scambi) con gli stessi numeri casuali che il motore NumPy
+    estrarrebbe da rng (a blocchi di BLOCCO_PASSI trade): a parità di generatore il
+    kernel compilato simula esattamente gli stessi percorsi di simula_batch.
+    """
+    blocchi = [rng.random((min(BLOCCO_PASSI, n_scambi - inizio), n_simulazioni))
+               for inizio in range(0, n_scambi, BLOCCO_PASSI)]
+    return np.ascontiguousarray(np.concatenate(blocchi).T)
+
+
+def _contratti(codice, capitale, tick_loss, streak, tp, sl, valore_tick, commissione, max_contratti,
+               iniziali, frazione, modalita_safe, safe_dopo, riduzione):
+    # Stesse operazioni, nello stesso ordine, delle funzioni dimensiona_* del motore
+    if codice == 0:
+        n = np.ceil(tick_loss / tp)
+        return min(max(n, 1.0), max_contratti)
+    if codice == 1:
+        return float(iniziali)
+    if codice == 2:
+        n = np.floor(capitale * (frazione / (sl * valore_tick + commissione)))
+        return min(max(n, 1.0), max_contratti)
+    n = tick_loss * (valore_tick + commissione / sl)
+    n = n + iniziali * commissione
+    n /= valore_tick * tp
+    n = np.ceil(n)
+    if tick_loss <= 0:
+        n = 0.0
+    n = min(max(n, float(iniziali)), max_contratti)
+    if modalita_safe:
+        ridotti = max(np.floor(n * (1 - riduzione)), 1.0)
+        if streak >= safe_dopo:
+            n -= n - ridotti
+    return n
+
+
+def _conta_streak(uniformi, win_rate, conteggi):
+    # Numero di losing streak di ogni percorso senza bancarotta: un limite superiore
+    # per riservare lo spazio delle streak prima della simulazione
+    n_simulazioni, n_scambi = uniformi.shape
+    for i in prange(n_simulazioni):
+        c = 0
+        perso_prima = False
+        for t in range(n_scambi):
+            perso = uniformi[i, t] >= win_rate
+            if perso and not perso_prima:
+                c += 1
+            perso_prima = perso
+        conteggi[i] = c
+
+
+def _simula_percorsi(uniformi, win_rate, tp, sl, valore_tick, commissione, capitale_iniziale, codice,
+                     max_contratti, iniziali, frazione, modalita_safe, safe_dopo, riduzione,
+                     offset_streak, capitale_finale, drawdown_massimo, trade_totali, win_count,
+                     somma_wins, somma_losses, streak_length, streak_contratti, streak_tick_loss,
+                     n_streak, sott_acqua_max, sott_acqua_medio, tempo_recupero, storico):
+    # Un percorso per iterazione, dall'inizio alla bancarotta o alla fine dei trade
+    n_simulazioni, n_scambi = uniformi.shape
+    vincita = tp * valore_tick
+    perdita = -sl * valore_tick
+    for i in prange(n_simulazioni):
+        capitale = float(capitale_iniziale)
+        picco = capitale
+        drawdown = 0.0
+        tick_loss = 0.0
+        streak = 0
+        streak_max = 1.0
+        n_contratti = _contratti(codice, capitale, tick_loss, streak, tp, sl, valore_tick, commissione,
+                                 max_contratti, iniziali, frazione, modalita_safe, safe_dopo, riduzione)
+        trade = 0
+        vinti = 0
+        wins = 0.0
+        losses = 0.0
+        sotto = 0
+        sotto_max = 0
+        trade_sotto = 0
+        periodi = 0
+        passo_minimo = 0
+        recupero = -1
+        k = offset_streak[i]
+        for t in range(n_scambi):
+            is_win = uniformi[i, t] < win_rate
+            risultato = (vincita if is_win else perdita) * n_contratti
+            risultato -= commissione * n_contratti
+            capitale += risultato
+            picco = max(picco, capitale)
+            profondita = picco - capitale
+            # Tempi sott'acqua come montecarlo_motore.aggiorna_sott_acqua
+            if profondita > drawdown:
+                passo_minimo = t + 1
+                recupero = -1
+            if profondita > 0:
+                sotto += 1
+                trade_sotto += 1
+                if sotto == 1:
+                    periodi += 1
+                sotto_max = max(sotto_max, sotto)
+            else:
+                if sotto > 0 and recupero < 0:
+                    recupero = t + 1 - passo_minimo
+                sotto = 0
+            drawdown = max(drawdown, profondita)
+            trade += 1
+            if is_win:
+                vinti += 1
+                wins += risultato
+                if streak > 0:
+                    streak_length[k] = streak
+                    streak_contratti[k] = int(streak_max)
+                    streak_tick_loss[k] = int(tick_loss)
+                    k += 1
+                streak = 0
+                streak_max = 1.0
+                tick_loss = 0.0
+            else:
+                losses += risultato
+                streak_max = max(streak_max, n_contratti)
+                tick_loss += sl * n_contratti
+                streak += 1
+            n_contratti = _contratti(codice, capitale, tick_loss, streak, tp, sl, valore_tick, commissione,
+                                     max_contratti, iniziali, frazione, modalita_safe, safe_dopo, riduzione)
+            if i < storico.shape[0]:
+                storico[i, t + 1] = capitale
+            if capitale <= 0:
+                break
+        if streak > 0:
+            streak_length[k] = streak
+            streak_contratti[k] = int(streak_max)
+            streak_tick_loss[k] = int(tick_loss)
+            k += 1
+        n_streak[i] = k - offset_streak[i]
+        capitale_finale[i] = capitale
+        drawdown_massimo[i] = drawdown
+        trade_totali[i] = trade
+        win_count[i] = vinti
+        somma_wins[i] = wins
+        somma_losses[i] = losses
+        sott_acqua_max[i] = sotto_max
+        sott_acqua_medio[i] = trade_sotto / periodi if periodi > 0 else np.nan
+        tempo_recupero[i] = recupero
+
+
+if NUMBA_DISPONIBILE:
+    _contratti = njit(cache=True)(_contratti)
+    _conta_streak = njit(parallel=True, cache=True)(_conta_streak)
+    _simula_percorsi = njit(parallel=True, cache=True)(_simula_percorsi)
+
+
+def kernel_disponibile(parametri):
+    """True se questi parametri possono usare il kernel compilato (esiti nominali senza regimi)."""
+    return (NUMBA_DISPONIBILE and not callable(parametri['dimensionamento'])
+            and parametri.get('regimi') is None and parametri.get('modello_esiti') is None)
+
+
+def simula_batch_jit(n_simulazioni, parametri=None, rng=None, salva_storico=False, uniformi=None):
+    """
+    Come simula_batch, ma ogni percorso gira per intero in un ciclo compilato con Numba,
+    con i percorsi in parallelo su tutti i core; ci si ferma alla bancarotta.
+    Con lo stesso rng i percorsi sono identici a quelli di simula_batch; cambia solo
+    l'ordine delle losing streak (per simulazione invece che per trade di chiusura).
+    Senza Numba, con una regola di dimensionamento passata come funzione, con esiti
+    a regimi o con un modello_esiti, usa simula_batch.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if not kernel_disponibile(parametri):
+        return simula_batch(n_simulazioni, parametri, rng, salva_storico, uniformi)
+    if rng is None:
+        rng = np.random.default_rng()
+    n_scambi = parametri['n_scambi']
+    if uniformi is None:
+        uniformi = uniformi_motore(n_simulazioni, n_scambi, rng)
+    else:
+        uniformi = np.ascontiguousarray(uniformi[:, :n_scambi], dtype=np.float64)
+    win_rate = parametri['win_rate']
+
+    conteggi = np.zeros(n_simulazioni, dtype=np.int64)
+    _conta_streak(uniformi, win_rate, conteggi)
+    offset_streak = np.concatenate([[0], np.cumsum(conteggi)])
+    righe = 0 if salva_storico is False else n_simulazioni if salva_storico is True else min(int(salva_storico), n_simulazioni)
+    storico = np.full((righe, n_scambi + 1), np.nan)
+    storico[:, 0] = parametri['capitale_iniziale']
+
+    capitale_finale = np.empty(n_simulazioni)
+    drawdown_massimo = np.empty(n_simulazioni)
+    trade_totali = np.empty(n_simulazioni, dtype=np.int64)
+    win_count = np.empty(n_simulazioni, dtype=np.int64)
+    somma_wins = np.empty(n_simulazioni)
+    somma_losses = np.empty(n_simulazioni)
+    streak_length = np.empty(offset_streak[-1], dtype=np.int32)
+    streak_contratti = np.empty(offset_streak[-1], dtype=np.int32)
+    streak_tick_loss = np.empty(offset_streak[-1], dtype=np.int32)
+    n_streak = np.empty(n_simulazioni, dtype=np.int64)
+    sott_acqua_max = np.empty(n_simulazioni, dtype=np.int64)
+    sott_acqua_medio = np.empty(n_simulazioni)
+    tempo_recupero = np.empty(n_simulazioni, dtype=np.int64)
+
+    _simula_percorsi(uniformi, win_rate, float(parametri['take_profit_ticks']), float(parametri['stop_loss_ticks']),
+                     float(parametri['valore_tick']), 2.0 * parametri['commissione_per_contratto'],
+                     float(parametri['capitale_iniziale']), CODICI_DIMENSIONAMENTO[parametri['dimensionamento']],
+                     float(parametri['max_contratti']), int(parametri['contratti_iniziali']),
+                     float(parametri['frazione_rischio']), bool(parametri['modalita_safe']),
+                     int(parametri['safe_dopo_perdite']), float(parametri['riduzione_safe']),
+                     offset_streak, capitale_finale, drawdown_massimo, trade_totali, win_count,
+                     somma_wins, somma_losses, streak_length, streak_contratti, streak_tick_loss,
+                     n_streak, sott_acqua_max, sott_acqua_medio, tempo_recupero, storico)
+
+    # Le bancarotte lasciano spazi vuoti nelle streak riservate: si tengono solo quelle scritte
+    usate = np.arange(offset_streak[-1]) - np.repeat(offset_streak[:-1], conteggi) < np.repeat(n_streak, conteggi)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expectancy = np.where(trade_totali > 0, (somma_wins + somma_losses) / np.maximum(trade_totali, 1), 0.0)
+        profit_factor = np.where(somma_losses != 0, np.abs(somma_wins / somma_losses), np.nan)
+    risultati = {
+        'capitale_finale': capitale_finale,
+        'losing_streaks': {
+            'simulazione': np.repeat(np.arange(n_simulazioni, dtype=np.int32), n_streak),
+            'length': streak_length[usate],
+            'max_contratti': streak_contratti[usate],
+            'tick_loss_totali': streak_tick_loss[usate],
+        },
+        'drawdown_massimo': drawdown_massimo,
+        'trade_totali': trade_totali,
+        'win_count': win_count,
+        'loss_count': trade_totali - win_count,
+        'somma_wins': somma_wins,
+        'somma_losses': somma_losses,
+        'expectancy': expectancy,
+        'profit_factor': profit_factor,
+        'tempo_sott_acqua_max': sott_acqua_max,
+        'tempo_sott_acqua_medio': sott_acqua_medio,
+        'tempo_recupero': tempo_recupero,
+        'tempo_bancarotta': np.where(capitale_finale <= 0, trade_totali, -1),
+    }
+    if salva_storico is not False:
+        risultati['storico_saldo'] = storico
+    return risultati
+
+
+def esegui_shard_jit(argomenti):
+    n, parametri, seme, salva_storico, n_thread = argomenti
+    if NUMBA_DISPONIBILE:
+        set_num_threads(n_thread)
+    return simula_batch_jit(n, parametri, rng=np.random.default_rng(seme), salva_storico=salva_storico)
+
+
+def esegui_parallelo_jit(n_simulazioni, parametri=None, seed=None, n_workers=None,
+                         dimensione_shard=DIMENSIONE_SHARD, salva_storico=False):
+    """
+    Come esegui_parallelo (stessi shard, stessi semi, stessi percorsi), con il kernel
+    compilato. I core sono divisi tra i processi: con n_workers=1 un solo processo
+    estrae i numeri casuali e il kernel usa tutti i core; con più processi anche
+    l'estrazione va in parallelo. I processi partono con spawn: il pool di thread di
+    Numba, se il processo principale l'ha già avviato, non sopravvive a una fork.
+    """
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    n_core = os.cpu_count() or 1
+    n_processi = min(n_workers or n_core, len(shard))
+    n_thread = max(1, n_core // n_processi)
+    argomenti = [(n, parametri, seme, salva_storico, n_thread) for n, seme in zip(shard, semi)]
+    contesto = multiprocessing.get_context('spawn')
+    return unisci_risultati(list(itera_shard(esegui_shard_jit, argomenti, n_processi, contesto)))
+
+
+def misura_velocita(n_simulazioni=100_000, parametri=None, n_workers=None, motore_jit=True):
+    """
+    Trade simulati al secondo da esegui_parallelo_jit (motore_jit=True) o da
+    esegui_parallelo, dopo un primo shard di riscaldamento (compilazione e avvio).
+    Di default il capitale iniziale è così alto che nessun percorso fallisce e tutti
+    arrivano a n_scambi trade.
+    """
+    from montecarlo_parallelo import esegui_parallelo
+
+    parametri = {'capitale_iniziale': 1e9, **(parametri or {})}
+    esegui = esegui_parallelo_jit if motore_jit else esegui_parallelo
+    esegui(DIMENSIONE_SHARD, parametri, seed=0, n_workers=1)
+    inizio = time.perf_counter()
+    risultati = esegui(n_simulazioni, parametri, seed=0, n_workers=n_workers)
+    return risultati['trade_totali'].sum() / (time.perf_counter() - inizio)
+
+
+def percorso_riferimento(uniformi, parametri):
+    """
+    Il ciclo Python di run_simulazione in montecarlo_recovery.py (martingala), un trade
+    alla volta su un solo percorso: il riferimento per i controlli di parità.
+    """
+    p = {**PARAMETRI_DEFAULT, **parametri}
+    capitale = p['capitale_iniziale']
+    picco = capitale
+    drawdown = 0.0
+    tick_loss_accumulati = 0
+    n_contratti = 1
+    current_streak = 0
+    current_max_contratti = 1
+    losing_streaks = []
+    trade_totali = win_count = 0
+    for u in uniformi[:p['n_scambi']]:
+        trade_totali += 1
+        is_win = u < p['win_rate']
+        ticks = p['take_profit_ticks'] if is_win else -p['stop_loss_ticks']
+        risultato = ticks * p['valore_tick'] * n_contratti - 2 * p['commissione_per_contratto'] * n_contratti
+        capitale += risultato
+        picco = max(picco, capitale)
+        drawdown = max(drawdown, picco - capitale)
+        if is_win:
+            win_count += 1
+            if current_streak > 0:
+                losing_streaks.append((current_streak, current_max_contratti, tick_loss_accumulati))
+            current_streak = 0
+            current_max_contratti = 1
+            tick_loss_accumulati = 0
+            n_contratti = 1
+        else:
+            current_streak += 1
+            current_max_contratti = max(current_max_contratti, n_contratti)
+            tick_loss_accumulati += p['stop_loss_ticks'] * n_contratti
+            n_contratti = min(max(1, int(np.ceil(tick_loss_accumulati / p['take_profit_ticks']))), p['max_contratti'])
+        if capitale <= 0:
+            break
+    if current_streak > 0:
+        losing_streaks.append((current_streak, current_max_contratti, tick_loss_accumulati))
+    return {
+        'capitale_finale': capitale,
+        'drawdown_massimo': drawdown,
+        'trade_totali': trade_totali,
+        'win_count': win_count,
+        'losing_streaks': losing_streaks,
+    }
+
+
+def verifica_parita(n_simulazioni, parametri=None, seed=None):
+    """
+    Confronta su percorsi con gli stessi numeri casuali il ciclo di riferimento, il motore
+    NumPy e (se Numba è installato) il kernel compilato. Restituisce un dizionario
+    nome -> True se i risultati coincidono esattamente con il riferimento.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {}), 'dimensionamento': 'martingala'}
+    uniformi = uniformi_motore(n_simulazioni, parametri['n_scambi'], np.random.default_rng(seed))
+    riferimento = [percorso_riferimento(u, parametri) for u in uniformi]
+    motori = {'numpy': simula_batch(n_simulazioni, parametri, uniformi=uniformi)}
+    if NUMBA_DISPONIBILE:
+        motori['numba'] = simula_batch_jit(n_simulazioni, parametri, uniformi=uniformi)
+
+    esiti = {}
+    for nome, risultati in motori.items():
+        uguali = all(np.array_equal(risultati[k], [r[k] for r in riferimento])
+                     for k in ('capitale_finale', 'drawdown_massimo', 'trade_totali', 'win_count'))
+        streaks = risultati['losing_streaks']
+        calcolate = sorted(zip(streaks['simulazione'].tolist(), streaks['length'].tolist(),
+                               streaks['max_contratti'].tolist(), streaks['tick_loss_totali'].tolist()))
+        attese = sorted((i, *s) for i, r in enumerate(riferimento) for s in r['losing_streaks'])
+        esiti[nome] = uguali and calcolate == attese
+    return esiti
+
+
+if __name__ == "__main__":
+    print("Parità con il ciclo di riferimento:", verifica_parita(500, {'n_scambi': 1000}, seed=0))
+    if not NUMBA_DISPONIBILE:
+        print("Numba non installato: simula_batch_jit usa il motore NumPy")
+
+    # Obiettivo: 100 milioni di trade al secondo con il kernel compilato
+    print(f"Core disponibili: {os.cpu_count()}")
+    for motore_jit, nome in ((False, 'NumPy'), (True, 'Numba' if NUMBA_DISPONIBILE else 'NumPy (senza Numba)')):
+        velocita = misura_velocita(motore_jit=motore_jit)
+        print(f"{nome}: {velocita / 1e6:,.1f} milioni di trade simulati al secondo (obiettivo 100)")
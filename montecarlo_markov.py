@@ -0,0 +1,213 @@
+import numpy as np
+from scipy import sparse
+
+from montecarlo_motore import PARAMETRI_DEFAULT, scegli_dimensionamento, simula_batch
+
+# Le streak più lunghe di così hanno probabilità trascurabile e vengono raggruppate nell'ultimo stato
+TOLLERANZA_STREAK = 1e-16
+
+# Campi dello stato che la catena sulle streak sa descrivere, e campi letti dalle
+# regole di DIMENSIONAMENTI. Una regola passata come funzione dichiara i suoi
+# nell'attributo campi_stato (es. regola.campi_stato = ('tick_loss_accumulati',))
+CAMPI_STREAK = frozenset({'tick_loss_accumulati', 'current_streak'})
+CAMPI_DIMENSIONAMENTI = {
+    'martingala': ('tick_loss_accumulati',),
+    'fisso': (),
+    'frazione_fissa': ('capitale',),
+    'evo': ('tick_loss_accumulati', 'current_streak'),
+}
+
+
+def campi_dimensionamento(parametri):
+    """Campi dello stato letti dalla regola di dimensionamento di parametri (None se non dichiarati)."""
+    dimensionamento = parametri['dimensionamento']
+    if callable(dimensionamento):
+        return getattr(dimensionamento, 'campi_stato', None)
+    scegli_dimensionamento(parametri)
+    return CAMPI_DIMENSIONAMENTI[dimensionamento]
+
+
+def stati_streak(parametri, lunghezza_max):
+    """
+    Durante una losing streak la regola di recupero è deterministica: dopo k perdite
+    consecutive tick_loss_accumulati e n_contratti dipendono solo da k.
+    Restituisce per k = 0..lunghezza_max gli array (tick_loss_accumulati, n_contratti)
+    dello stato (tick_loss_accumulati, n_contratti) raggiunto dopo k perdite.
+    Vale per le regole di dimensionamento che leggono solo la streak (CAMPI_STREAK),
+    non il capitale: per le altre solleva ValueError.
+    """
+    campi = campi_dimensionamento(parametri)
+    if campi is None:
+        raise ValueError("Una regola di dimensionamento passata come funzione deve dichiarare i campi "
+                         "dello stato che legge nell'attributo campi_stato")
+    if not CAMPI_STREAK.issuperset(campi):
+        raise ValueError(f"La regola di dimensionamento legge {', '.join(sorted(set(campi) - CAMPI_STREAK))}: "
+                         "la catena sulle streak non la descrive")
+    sl = parametri['stop_loss_ticks']
+    dimensiona = scegli_dimensionamento(parametri)
+    # Stato del motore ridotto a un solo percorso, con i soli campi della streak
+    stato = {'tick_loss_accumulati': np.zeros(1), 'current_streak': np.zeros(1, dtype=np.int64)}
+    n_contratti = np.ones(1)
+    tick_loss = np.zeros(lunghezza_max + 1, dtype=np.int64)
+    contratti = np.ones(lunghezza_max + 1, dtype=np.int64)
+    for k in range(lunghezza_max + 1):
+        if k > 0:
+            tick_loss[k] = tick_loss[k - 1] + sl * contratti[k - 1]
+        stato['tick_loss_accumulati'][0] = tick_loss[k]
+        stato['current_streak'][0] = k
+        dimensiona(stato, parametri, n_contratti)
+        contratti[k] = n_contratti[0]
+    return tick_loss, contratti
+
+
+def matrice_transizione(win_rate, n_stati):
+    """
+    Matrice sparsa (trasposta) della catena sugli stati di streak: da ogni stato si va
+    allo stato 0 con probabilità win_rate e allo stato successivo altrimenti.
+    L'ultimo stato, che raccoglie le streak più lunghe, resta su sé stesso in caso di perdita.
+    """
+    da = np.arange(n_stati)
+    verso_loss = np.minimum(da + 1, n_stati - 1)
+    righe = np.concatenate([np.zeros(n_stati, dtype=np.int64), verso_loss])
+    colonne = np.concatenate([da, da])
+    valori = np.concatenate([np.full(n_stati, win_rate), np.full(n_stati, 1 - win_rate)])
+    return sparse.csr_matrix((valori, (righe, colonne)), shape=(n_stati, n_stati))
+
+
+def risolvi_markov(parametri=None, tolleranza=TOLLERANZA_STREAK):
+    """
+    Soluzione esatta (senza campionamento) della strategia di recupero (la regola di dimensionamento
+    di parametri, per default la martingala di montecarlo_recovery.py),
+    propagando la distribuzione sugli stati (tick_loss_accumulati, n_contratti) con prodotti
+    matrice sparsa-vettore, un trade alla volta.
+    Non modella la bancarotta: i risultati valgono per un capitale che non si azzera
+    (il confronto con le simulazioni ha senso quando la rovina è rara).
+    Restituisce un dizionario con:
+      - 'losing_streaks': numero atteso di streak per simulazione per lunghezza, con
+        contratti massimi e tick persi (deterministici per lunghezza);
+      - 'distribuzione_contratti': P(n_contratti = c) a ogni trade;
+      - 'pnl_valori', 'pnl_probabilita': valori possibili del risultato di un trade e
+        loro probabilità a ogni trade;
+      - 'capitale_atteso', 'expectancy', 'profit_factor', 'win_rate'.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if parametri['regimi'] is not None or parametri['modello_esiti'] is not None:
+        raise ValueError("La soluzione esatta richiede trade indipendenti con esiti nominali "
+                         "(regimi=None, modello_esiti=None)")
+    n_scambi = parametri['n_scambi']
+    p = parametri['win_rate']
+    q = 1 - p
+
+    # Oltre questa lunghezza la probabilità di una streak è sotto la tolleranza
+    if q > 0 and tolleranza > 0:
+        lunghezza_max = int(min(n_scambi, np.ceil(np.log(tolleranza) / np.log(q)) + 1))
+    else:
+        lunghezza_max = n_scambi
+    tick_loss, contratti = stati_streak(parametri, lunghezza_max)
+    n_stati = lunghezza_max + 1
+    transizione = matrice_transizione(p, n_stati)
+
+    max_contratti = int(contratti.max())
+    valore_tick = parametri['valore_tick']
+    commissione = 2 * parametri['commissione_per_contratto']
+    valori_contratti = np.arange(1, max_contratti + 1)
+    pnl_win = parametri['take_profit_ticks'] * valore_tick * valori_contratti - commissione * valori_contratti
+    pnl_loss = -parametri['stop_loss_ticks'] * valore_tick * valori_contratti - commissione * valori_contratti
+    # Matrice sparsa stato -> numero di contratti (colonna c - 1)
+    stato_contratti = sparse.csr_matrix((np.ones(n_stati), (np.arange(n_stati), contratti - 1)),
+                                        shape=(n_stati, max_contratti))
+
+    distribuzione = np.zeros(n_stati)
+    distribuzione[0] = 1.0
+    occupazione = np.zeros(n_stati)
+    distribuzione_contratti = np.zeros((n_scambi, max_contratti))
+    for t in range(n_scambi):
+        occupazione += distribuzione
+        distribuzione_contratti[t] = stato_contratti.T @ distribuzione
+        successiva = transizione @ distribuzione
+        if np.allclose(successiva, distribuzione, rtol=0.0, atol=tolleranza):
+            # Distribuzione stazionaria: i trade rimanenti sono tutti uguali
+            rimanenti = n_scambi - t - 1
+            occupazione += rimanenti * distribuzione
+            distribuzione_contratti[t + 1:] = distribuzione_contratti[t]
+            break
+        distribuzione = successiva
+
+    # Streak chiuse da un trade vincente, più quelle ancora aperte alla fine
+    streak_attese = p * occupazione
+    streak_attese[1:] += distribuzione[1:]
+    streak_attese[0] = 0.0
+    lunghezze = np.arange(1, n_stati)
+
+    pnl_probabilita = np.concatenate([q * distribuzione_contratti, p * distribuzione_contratti], axis=1)
+    pnl_valori = np.concatenate([pnl_loss, pnl_win])
+    pnl_atteso = pnl_probabilita @ pnl_valori
+    vincite_attese = np.sum(p * distribuzione_contratti @ pnl_win)
+    perdite_attese = np.sum(q * distribuzione_contratti @ pnl_loss)
+
+    return {
+        'losing_streaks': {
+            'length': lunghezze,
+            'attese_per_simulazione': streak_attese[1:],
+            # Nella streak di lunghezza k il massimo è tra i contratti usati nei primi k trade
+            'max_contratti': np.maximum.accumulate(contratti)[lunghezze - 1],
+            'tick_loss_totali': tick_loss[1:],
+        },
+        'distribuzione_contratti': distribuzione_contratti,
+        'pnl_valori': pnl_valori,
+        'pnl_probabilita': pnl_probabilita,
+        'capitale_atteso': parametri['capitale_iniziale'] + np.concatenate([[0.0], np.cumsum(pnl_atteso)]),
+        'expectancy': pnl_atteso.mean(),
+        'profit_factor': abs(vincite_attese / perdite_attese) if perdite_attese != 0 else np.nan,
+        'win_rate': p,
+    }
+
+
+def verifica_con_simulazione(n_simulazioni, parametri=None, seed=None):
+    """
+    Confronta la soluzione esatta con il motore vettoriale, usando un capitale iniziale
+    enorme per togliere la bancarotta. Restituisce (esatto, simulato) per le streak
+    attese per lunghezza e per l'expectancy.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    esatto = risolvi_markov(parametri)
+    senza_rovina = {**parametri, 'capitale_iniziale': 1e12}
+    risultati = simula_batch(n_simulazioni, senza_rovina, rng=np.random.default_rng(seed))
+
+    n_lunghezze = len(esatto['losing_streaks']['length'])
+    lunghezze = np.minimum(risultati['losing_streaks']['length'], n_lunghezze)
+    simulate = np.bincount(lunghezze, minlength=n_lunghezze + 1)[1:] / n_simulazioni
+    expectancy = (risultati['somma_wins'].sum() + risultati['somma_losses'].sum()) / risultati['trade_totali'].sum()
+    return {
+        'streak': (esatto['losing_streaks']['attese_per_simulazione'], simulate),
+        'expectancy': (esatto['expectancy'], expectancy),
+    }
+
+
+if __name__ == "__main__":
+    n_simulazioni = 1000
+    esatto = risolvi_markov()
+    streaks = esatto['losing_streaks']
+
+    print("\nLOSING STREAKS ATTESE (SOLUZIONE ESATTA, SENZA BANCAROTTA)")
+    print("=" * 90)
+    print(f"{'Lunghezza':<10} | {'Occorrenze':<12} | {'Contratti Max':<13} | {'Tick Loss':<10}")
+    print("-" * 90)
+    for length, attese, contratti, tick_loss in zip(streaks['length'], streaks['attese_per_simulazione'],
+                                                     streaks['max_contratti'], streaks['tick_loss_totali']):
+        if attese * n_simulazioni >= 0.5:
+            print(f"{length:<10} | {attese * n_simulazioni:<12.1f} | {contratti:<13} | {tick_loss:>10}")
+
+    print("\nSTATISTICHE SUI TRADE")
+    print("=" * 90)
+    print(f"Expectancy (profitto medio per trade): ${esatto['expectancy']:,.2f}")
+    print(f"Profit Factor: {esatto['profit_factor']:.2f}")
+    print(f"Capitale atteso finale: ${esatto['capitale_atteso'][-1]:,.2f}")
+
+    verifica = verifica_con_simulazione(n_simulazioni, seed=0)
+    print("\nVERIFICA CON IL MOTORE MONTE CARLO")
+    print("=" * 90)
+    print(f"Expectancy esatta: ${verifica['expectancy'][0]:,.4f} | simulata: ${verifica['expectancy'][1]:,.4f}")
+    esatte, simulate = verifica['streak']
+    for length in range(1, 6):
+        print(f"Streak di lunghezza {length}: esatte {esatte[length - 1] * n_simulazioni:.1f} | simulate {simulate[length - 1] * n_simulazioni:.1f}")
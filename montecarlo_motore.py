@@ -0,0 +1,415 @@
+import numpy as np
+
+from montecarlo_esiti import esiti_blocco
+from montecarlo_regimi import prepara_regimi, stato_iniziale_regimi, estrai_regimi, scarti_regimi
+
+# Parametri di default (gli stessi di montecarlo_recovery.py)
+PARAMETRI_DEFAULT = {
+    'n_scambi': 5000,
+    'commissione_per_contratto': 1.50,
+    'valore_tick': 1.25,
+    'stop_loss_ticks': 19,
+    'take_profit_ticks': 25,
+    'win_rate': 0.53,
+    'max_contratti': 4,
+    'capitale_iniziale': 500,
+    # Regola di dimensionamento (vedi DIMENSIONAMENTI) e suoi parametri
+    'dimensionamento': 'martingala',
+    'contratti_iniziali': 1,
+    'frazione_rischio': 0.02,
+    'modalita_safe': False,
+    'safe_dopo_perdite': 3,
+    'riduzione_safe': 0.5,
+    # Esiti a regimi nascosti (vedi montecarlo_regimi); None = trade indipendenti con win_rate
+    'regimi': None,
+    # Slippage, commissioni variabili e uscite a tempo (vedi montecarlo_esiti); None = esiti nominali
+    'modello_esiti': None,
+}
+
+# Numero di trade per cui si pre-estraggono i numeri casuali in un colpo solo
+BLOCCO_PASSI = 256
+
+
+# Regole di dimensionamento: dopo ogni trade scrivono in n_contratti i contratti del
+# trade successivo di tutti i percorsi, leggendo lo stato già aggiornato
+# (capitale, tick_loss_accumulati, current_streak). Sono chiamate una volta per trade
+# su tutti i percorsi insieme, quindi devono usare solo operazioni su array; il
+# risultato deve essere un intero >= 1 (in float64).
+
+def dimensiona_martingala(stato, parametri, n_contratti):
+    """Contratti per recuperare i tick persi: min(max(1, ceil(tick_loss / take_profit_ticks)), max_contratti)."""
+    np.divide(stato['tick_loss_accumulati'], parametri['take_profit_ticks'], out=n_contratti)
+    np.ceil(n_contratti, out=n_contratti)
+    np.clip(n_contratti, 1, parametri['max_contratti'], out=n_contratti)
+
+
+def dimensiona_fisso(stato, parametri, n_contratti):
+    """Sempre contratti_iniziali contratti."""
+    n_contratti[...] = parametri['contratti_iniziali']
+
+
+def dimensiona_frazione_fissa(stato, parametri, n_contratti):
+    """
+    Si rischia frazione_rischio del capitale attuale: contratti = floor(capitale *
+    frazione_rischio / rischio di un contratto), tra 1 e max_contratti.
+    """
+    rischio_contratto = parametri['stop_loss_ticks'] * parametri['valore_tick'] + 2 * parametri['commissione_per_contratto']
+    np.multiply(stato['capitale'], parametri['frazione_rischio'] / rischio_contratto, out=n_contratti)
+    np.floor(n_contratti, out=n_contratti)
+    np.clip(n_contratti, 1, parametri['max_contratti'], out=n_contratti)
+
+
+def dimensiona_evo(stato, parametri, n_contratti):
+    """
+    La regola di Contract_Calculator_Evo.py: i contratti recuperano la perdita della streak
+    commissioni comprese, più le commissioni del trade successivo,
+    max(contratti_iniziali, ceil(tick da recuperare / take_profit_ticks)) fino a max_contratti.
+    Con modalita_safe, dopo safe_dopo_perdite perdite consecutive i contratti si
+    riducono di riduzione_safe (almeno 1).
+    """
+    valore_tick = parametri['valore_tick']
+    commissione = 2 * parametri['commissione_per_contratto']
+    iniziali = parametri['contratti_iniziali']
+    tick_loss = stato['tick_loss_accumulati']
+    # Ogni contratto perso costa stop_loss_ticks tick più la commissione
+    perdita = tick_loss * (valore_tick + commissione / parametri['stop_loss_ticks'])
+    np.add(perdita, iniziali * commissione, out=n_contratti)
+    n_contratti /= valore_tick * parametri['take_profit_ticks']
+    np.ceil(n_contratti, out=n_contratti)
+    n_contratti *= tick_loss > 0
+    np.clip(n_contratti, iniziali, parametri['max_contratti'], out=n_contratti)
+    if parametri['modalita_safe']:
+        ridotti = np.floor(n_contratti * (1 - parametri['riduzione_safe']))
+        np.maximum(ridotti, 1, out=ridotti)
+        n_contratti -= (stato['current_streak'] >= parametri['safe_dopo_perdite']) * (n_contratti - ridotti)
+
+
+DIMENSIONAMENTI = {
+    'martingala': dimensiona_martingala,
+    'fisso': dimensiona_fisso,
+    'frazione_fissa': dimensiona_frazione_fissa,
+    'evo': dimensiona_evo,
+}
+
+
+def scegli_dimensionamento(parametri):
+    """
+    Regola di dimensionamento indicata da parametri['dimensionamento']: un nome di
+    DIMENSIONAMENTI oppure direttamente una funzione con la stessa firma
+    (i nomi tengono i parametri serializzabili, per la cache dello sweep e la CLI).
+    """
+    dimensionamento = parametri['dimensionamento']
+    if callable(dimensionamento):
+        return dimensionamento
+    if dimensionamento not in DIMENSIONAMENTI:
+        raise ValueError(f"Dimensionamento sconosciuto: {dimensionamento} (validi: {', '.join(DIMENSIONAMENTI)})")
+    return DIMENSIONAMENTI[dimensionamento]
+
+
+def stato_sott_acqua(n_simulazioni):
+    """
+    Campi dello stato per i tempi sott'acqua (capitale sotto il picco precedente),
+    aggiornati a ogni trade da aggiorna_sott_acqua senza conservare le curve.
+    """
+    return {
+        'sott_acqua': np.zeros(n_simulazioni, dtype=np.int64),
+        'sott_acqua_max': np.zeros(n_simulazioni, dtype=np.int64),
+        'trade_sott_acqua': np.zeros(n_simulazioni, dtype=np.int64),
+        'periodi_sott_acqua': np.zeros(n_simulazioni, dtype=np.int64),
+        # Trade del minimo del drawdown massimo e trade serviti a tornare al picco (-1: non ancora)
+        'passo_minimo': np.zeros(n_simulazioni, dtype=np.int64),
+        'tempo_recupero': np.full(n_simulazioni, -1, dtype=np.int64),
+    }
+
+
+def aggiorna_sott_acqua(stato, profondita, attivo):
+    """
+    Aggiorna i tempi sott'acqua dopo il trade stato['passo'] + 1, prima di aggiornare
+    il drawdown massimo: profondita è picco - capitale (con il picco già aggiornato).
+    Un periodo sott'acqua finisce quando il capitale torna al picco; quando finisce
+    quello del drawdown massimo se ne registra il tempo di recupero dal minimo.
+    """
+    passo = stato['passo'] + 1
+    durata = stato['sott_acqua']
+    tempo_recupero = stato['tempo_recupero']
+    sotto = profondita > 0
+    sotto &= attivo
+    # Nuovo drawdown massimo: il recupero riparte da questo trade
+    nuovo_minimo = profondita > stato['drawdown_massimo']
+    np.copyto(stato['passo_minimo'], passo, where=nuovo_minimo)
+    np.copyto(tempo_recupero, -1, where=nuovo_minimo)
+    recuperati = (durata > 0) & ~sotto & attivo & (tempo_recupero < 0)
+    np.copyto(tempo_recupero, passo - stato['passo_minimo'], where=recuperati)
+
+    durata += sotto
+    durata *= sotto
+    np.maximum(stato['sott_acqua_max'], durata, out=stato['sott_acqua_max'])
+    stato['trade_sott_acqua'] += sotto
+    stato['periodi_sott_acqua'] += durata == 1
+
+
+def risultati_sott_acqua(stato, trade_giocati):
+    """
+    Campi dei risultati per i tempi sott'acqua, in trade: periodo più lungo, durata
+    media dei periodi (NaN senza periodi), tempo di recupero dal minimo del drawdown
+    massimo (-1 se non recuperato) e trade della bancarotta (-1 senza bancarotta),
+    da trade_giocati, i trade eseguiti da ogni percorso.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        medio = stato['trade_sott_acqua'] / stato['periodi_sott_acqua']
+    return {
+        'tempo_sott_acqua_max': stato['sott_acqua_max'].copy(),
+        'tempo_sott_acqua_medio': medio,
+        'tempo_recupero': stato['tempo_recupero'].copy(),
+        'tempo_bancarotta': np.where(stato['capitale'] <= 0, trade_giocati, -1),
+    }
+
+
+def inizializza_stato(n_simulazioni, parametri):
+    """
+    Crea lo stato iniziale di n_simulazioni percorsi, tutti con capitale_iniziale,
+    i contratti iniziali della regola di dimensionamento e nessuna losing streak aperta.
+    Ogni campo è un array con un elemento per simulazione; tick e contratti sono
+    interi ma tenuti in float64 per evitare conversioni nel ciclo.
+    """
+    capitale = np.full(n_simulazioni, float(parametri['capitale_iniziale']))
+    stato = {
+        'passo': 0,
+        'capitale': capitale,
+        'attivo': np.ones(n_simulazioni, dtype=bool),
+        'tick_loss_accumulati': np.zeros(n_simulazioni),
+        'n_contratti': np.ones(n_simulazioni),
+        'current_streak': np.zeros(n_simulazioni, dtype=np.int64),
+        'current_max_contratti': np.ones(n_simulazioni),
+        'picco': capitale.copy(),
+        'drawdown_massimo': np.zeros(n_simulazioni),
+        'trade_totali': np.zeros(n_simulazioni, dtype=np.int64),
+        'win_count': np.zeros(n_simulazioni, dtype=np.int64),
+        'somma_wins': np.zeros(n_simulazioni),
+        'somma_losses': np.zeros(n_simulazioni),
+        # Losing streak chiuse, raccolte a pezzi e concatenate alla fine
+        'streak_chiuse': [],
+        **stato_sott_acqua(n_simulazioni),
+    }
+    if parametri.get('regimi') is not None:
+        stato['regime'] = stato_iniziale_regimi(n_simulazioni, prepara_regimi(parametri['regimi']))
+    scegli_dimensionamento(parametri)(stato, parametri, stato['n_contratti'])
+    return stato
+
+
+def estrai_streak(stato, indici):
+    """
+    Restituisce le losing streak aperte dei percorsi indicati come array int32
+    (simulazione, lunghezza, contratti massimi, tick persi arrotondati: con
+    modello_esiti possono essere frazionari).
+    """
+    return (
+        indici.astype(np.int32),
+        stato['current_streak'][indici].astype(np.int32),
+        stato['current_max_contratti'][indici].astype(np.int32),
+        np.rint(stato['tick_loss_accumulati'][indici]).astype(np.int32),
+    )
+
+
+def registra_trade(stato, is_win, risultato, tick_persi, attivo):
+    """
+    Contabilità di un trade di tutti i percorsi, la stessa per il motore e per ogni
+    strumento di montecarlo_portafoglio: is_win sono i trade vincenti dei percorsi
+    attivi e risultato il loro risultato in dollari (zero per i percorsi fermi).
+    Aggiorna conteggi e somme, chiude le losing streak dei trade vincenti e accumula i
+    tick persi di quelli perdenti; capitale, drawdown e contratti del trade successivo
+    restano a chi chiama.
+    """
+    is_loss = attivo & ~is_win
+    non_win = ~is_win
+    streak = stato['current_streak']
+    streak_max_contratti = stato['current_max_contratti']
+    tick_loss = stato['tick_loss_accumulati']
+
+    stato['trade_totali'] += attivo
+    stato['win_count'] += is_win
+    stato['somma_wins'] += risultato * is_win
+    stato['somma_losses'] += risultato * is_loss
+
+    # Trade vincenti: chiusura della streak
+    chiuse = np.flatnonzero(is_win & (streak > 0))
+    if len(chiuse) > 0:
+        stato['streak_chiuse'].append(estrai_streak(stato, chiuse))
+
+    # Trade perdenti: accumulo dei tick persi; i vincenti ripartono da zero
+    np.maximum(streak_max_contratti, stato['n_contratti'] * is_loss, out=streak_max_contratti)
+    streak_max_contratti *= non_win
+    np.maximum(streak_max_contratti, 1, out=streak_max_contratti)
+    tick_loss += tick_persi * stato['n_contratti'] * is_loss
+    tick_loss *= non_win
+    streak += is_loss
+    streak *= non_win
+
+
+def genera_uniformi(n_simulazioni, n_scambi, rng, antitetiche=False):
+    """
+    Matrice (n_simulazioni, n_scambi) di numeri casuali uniformi da passare a simula_batch.
+    Passando la stessa matrice a più strategie, tutte vedono le stesse sequenze di
+    vincite e perdite (common random numbers).
+    Con antitetiche=True la seconda metà delle righe è 1 - u della prima: la riga i e
+    la riga i + n_simulazioni // 2 formano una coppia antitetica.
+    """
+    if not antitetiche:
+        return rng.random((n_simulazioni, n_scambi))
+    meta = rng.random(((n_simulazioni + 1) // 2, n_scambi))
+    return np.concatenate([meta, 1.0 - meta])[:n_simulazioni]
+
+
+def avanza_stato(stato, parametri, n_passi, rng, storico=None, uniformi=None):
+    """
+    Fa avanzare tutte le simulazioni attive di n_passi trade insieme.
+    La regola è quella di run_simulazione in montecarlo_recovery.py:
+      - trade vincente: si registra la streak e si azzerano tick persi e streak;
+      - trade perdente: si accumulano i tick persi;
+    poi la regola di dimensionamento (parametri['dimensionamento']) sceglie i contratti
+    del trade successivo; con 'martingala'
+    n_contratti = min(max(1, ceil(tick_loss_accumulati / take_profit_ticks)), max_contratti).
+    I numeri casuali vengono estratti a blocchi di BLOCCO_PASSI trade, oppure letti da
+    uniformi (matrice simulazioni x trade, colonna = numero del trade) se indicata.
+    Con parametri['regimi'] anche i regimi del blocco vengono estratti insieme e ogni
+    numero casuale è spostato in modo da vincere con il win rate del suo regime
+    (vedi montecarlo_regimi); uniformi già estratte si usano così come sono.
+    Con parametri['modello_esiti'] tick e commissioni di ogni trade del blocco vengono
+    estratti insieme da montecarlo_esiti.esiti_blocco: il trade è vincente se chiude
+    in attivo di tick e i tick persi sono quelli effettivi (anche frazionari).
+    Drawdown massimo e tempi sott'acqua si aggiornano trade per trade (vedi
+    aggiorna_sott_acqua), senza bisogno delle curve del capitale.
+    Se storico è una matrice (k, n_scambi + 1) vi si scrive il capitale dopo ogni trade
+    delle prime k simulazioni (le colonne successive alla bancarotta restano invariate).
+    """
+    tp = parametri['take_profit_ticks']
+    sl = parametri['stop_loss_ticks']
+    valore_tick = parametri['valore_tick']
+    commissione = 2 * parametri['commissione_per_contratto']
+    win_rate = parametri['win_rate']
+    dimensiona = scegli_dimensionamento(parametri)
+    regimi = None
+    if parametri.get('regimi') is not None:
+        regimi = prepara_regimi(parametri['regimi'])
+        scarti = scarti_regimi(regimi, win_rate)
+    modello_esiti = parametri.get('modello_esiti')
+
+    capitale = stato['capitale']
+    attivo = stato['attivo']
+    n_contratti = stato['n_contratti']
+    picco = stato['picco']
+    drawdown = stato['drawdown_massimo']
+    n_simulazioni = len(capitale)
+
+    # Risultato in dollari di un trade per contratto (perdita, vincita), prima delle commissioni.
+    # Nel ciclo si usano solo operazioni aritmetiche e np.take: con maschere booleane casuali
+    # l'indicizzazione e np.where sono molto più lenti.
+    valori_trade = np.array([-sl * valore_tick, tp * valore_tick])
+
+    fatti = 0
+    while fatti < n_passi and attivo.any():
+        blocco = min(BLOCCO_PASSI, n_passi - fatti)
+        if uniformi is None:
+            casuali = rng.random((blocco, n_simulazioni))
+            if regimi is not None:
+                casuali += np.take(scarti, estrai_regimi(stato['regime'], blocco, regimi, rng))
+        else:
+            casuali = np.ascontiguousarray(uniformi[:, stato['passo']:stato['passo'] + blocco].T)
+        if modello_esiti is not None:
+            tick_blocco, commissioni_blocco = esiti_blocco(casuali, parametri, rng)
+        for t, riga in enumerate(casuali):
+            if modello_esiti is None:
+                is_win = riga < win_rate
+                is_win &= attivo
+                risultato = np.take(valori_trade, is_win.view(np.uint8)) * n_contratti
+                risultato -= commissione * n_contratti
+                tick_persi = sl
+            else:
+                tick_trade = tick_blocco[t]
+                is_win = tick_trade > 0
+                is_win &= attivo
+                risultato = tick_trade * valore_tick * n_contratti
+                risultato -= commissioni_blocco[t] * n_contratti
+                tick_persi = -tick_trade
+            risultato *= attivo
+            capitale += risultato
+            np.maximum(picco, capitale, out=picco)
+            profondita = picco - capitale
+            aggiorna_sott_acqua(stato, profondita, attivo)
+            np.maximum(drawdown, profondita, out=drawdown)
+            registra_trade(stato, is_win, risultato, tick_persi, attivo)
+
+            # Contratti del trade successivo secondo la regola di dimensionamento
+            dimensiona(stato, parametri, n_contratti)
+
+            stato['passo'] += 1
+            if storico is not None:
+                vivi = attivo[:len(storico)]
+                storico[vivi, stato['passo']] = capitale[:len(storico)][vivi]
+            attivo &= capitale > 0
+        fatti += blocco
+    return stato
+
+
+def risultati_da_stato(stato):
+    """
+    Aggiunge le losing streak ancora aperte (senza modificare lo stato) e restituisce i risultati con gli stessi
+    campi di run_simulazione, ma come array (un elemento per simulazione).
+    losing_streaks è un dizionario di array piatti: 'simulazione' indica il percorso
+    a cui appartiene ciascuna streak.
+    """
+    aperte = estrai_streak(stato, np.flatnonzero(stato['current_streak'] > 0))
+    colonne = [np.concatenate(c) for c in zip(*stato['streak_chiuse'], aperte)]
+    losing_streaks = dict(zip(['simulazione', 'length', 'max_contratti', 'tick_loss_totali'], colonne))
+
+    trade_totali = stato['trade_totali']
+    somma_wins = stato['somma_wins']
+    somma_losses = stato['somma_losses']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expectancy = np.where(trade_totali > 0, (somma_wins + somma_losses) / np.maximum(trade_totali, 1), 0.0)
+        profit_factor = np.where(somma_losses != 0, np.abs(somma_wins / somma_losses), np.nan)
+
+    return {
+        'capitale_finale': stato['capitale'].copy(),
+        'losing_streaks': losing_streaks,
+        'drawdown_massimo': stato['drawdown_massimo'].copy(),
+        'trade_totali': trade_totali.copy(),
+        'win_count': stato['win_count'].copy(),
+        'loss_count': trade_totali - stato['win_count'],
+        'somma_wins': somma_wins.copy(),
+        'somma_losses': somma_losses.copy(),
+        'expectancy': expectancy,
+        'profit_factor': profit_factor,
+        **risultati_sott_acqua(stato, trade_totali),
+    }
+
+
+def simula_batch(n_simulazioni, parametri=None, rng=None, salva_storico=False, uniformi=None):
+    """
+    Esegue n_simulazioni percorsi da parametri['n_scambi'] trade tutti insieme,
+    un trade alla volta, con lo stato in array NumPy.
+    Restituisce un dizionario con gli stessi campi di run_simulazione (array invece
+    di scalari). Con salva_storico=True aggiunge 'storico_saldo', una matrice
+    (n_simulazioni, n_scambi + 1) con NaN dopo la bancarotta; con salva_storico=k
+    (intero) lo storico contiene solo le prime k simulazioni.
+    uniformi è una matrice di numeri casuali già estratti (vedi genera_uniformi), con
+    almeno n_scambi colonne: il trade t della simulazione i è vincente se
+    uniformi[i, t] < win_rate.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if rng is None:
+        rng = np.random.default_rng()
+
+    stato = inizializza_stato(n_simulazioni, parametri)
+    storico = None
+    if salva_storico is not False:
+        righe = n_simulazioni if salva_storico is True else min(int(salva_storico), n_simulazioni)
+        storico = np.full((righe, parametri['n_scambi'] + 1), np.nan)
+        storico[:, 0] = parametri['capitale_iniziale']
+
+    avanza_stato(stato, parametri, parametri['n_scambi'], rng, storico, uniformi)
+
+    risultati = risultati_da_stato(stato)
+    if storico is not None:
+        risultati['storico_saldo'] = storico
+    return risultati
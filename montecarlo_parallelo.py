@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from montecarlo_motore import simula_batch
+
+# Numero di simulazioni per shard. Gli shard dipendono solo da n_simulazioni e da questo
+# valore, non dal numero di processi: per questo il risultato è identico con 1 o N core.
+DIMENSIONE_SHARD = 1000
+
+
+def pianifica_shard(n_simulazioni, dimensione_shard=DIMENSIONE_SHARD):
+    """Divide n_simulazioni in shard da dimensione_shard (l'ultimo può essere più piccolo)."""
+    n_pieni, resto = divmod(n_simulazioni, dimensione_shard)
+    return [dimensione_shard] * n_pieni + ([resto] if resto else [])
+
+
+def itera_shard(funzione, argomenti, n_workers=None, contesto=None):
+    """
+    Applica funzione a ogni elemento di argomenti su un pool di processi e
+    restituisce i risultati uno alla volta, nello stesso ordine degli argomenti.
+    Con n_workers=1 (o un solo shard) lavora nel processo corrente. contesto è il
+    contesto di multiprocessing del pool (None = quello di default della piattaforma).
+    """
+    argomenti = list(argomenti)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = min(n_workers, len(argomenti))
+    if n_workers <= 1:
+        for a in argomenti:
+            yield funzione(a)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=contesto) as pool:
+        yield from pool.map(funzione, argomenti)
+
+
+def mappa_shard(funzione, argomenti, n_workers=None):
+    """Come itera_shard, ma restituisce la lista completa dei risultati."""
+    return list(itera_shard(funzione, argomenti, n_workers))
+
+
+def unisci_risultati(parziali):
+    """
+    Unisce i risultati di più shard in un unico dizionario, come se fossero stati
+    calcolati da una sola chiamata a simula_batch. Gli indici 'simulazione' delle
+    losing streak vengono spostati dell'offset dello shard.
+    """
+    uniti = {}
+    offset = 0
+    streaks = []
+    for parziale in parziali:
+        streak = dict(parziale['losing_streaks'])
+        streak['simulazione'] = streak['simulazione'] + np.int32(offset)
+        streaks.append(streak)
+        offset += len(parziale['capitale_finale'])
+    for chiave in parziali[0]:
+        if chiave == 'losing_streaks':
+            uniti[chiave] = {k: np.concatenate([s[k] for s in streaks]) for k in streaks[0]}
+        else:
+            uniti[chiave] = np.concatenate([p[chiave] for p in parziali])
+    return uniti
+
+
+def esegui_shard(argomenti):
+    n, parametri, seme, salva_storico = argomenti
+    return simula_batch(n, parametri, rng=np.random.default_rng(seme), salva_storico=salva_storico)
+
+
+def esegui_parallelo(n_simulazioni, parametri=None, seed=None, n_workers=None,
+                     dimensione_shard=DIMENSIONE_SHARD, salva_storico=False):
+    """
+    Esegue n_simulazioni con simula_batch divise in shard su più processi.
+    Ogni shard ha il suo generatore, creato da SeedSequence(seed).spawn(): a parità di
+    seed e dimensione_shard il risultato è identico bit per bit qualunque sia n_workers.
+    Con seed=None si usa entropia del sistema.
+    salva_storico può essere un intero k: lo storico contiene solo le prime k simulazioni.
+    """
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    if isinstance(salva_storico, bool):
+        storici = [salva_storico] * len(shard)
+    else:
+        # Le prime k simulazioni stanno nei primi shard: agli altri tocca uno storico vuoto
+        inizi = np.concatenate([[0], np.cumsum(shard)[:-1]])
+        storici = [int(np.clip(salva_storico - inizio, 0, n)) for n, inizio in zip(shard, inizi)]
+    argomenti = [(n, parametri, seme, storico) for n, seme, storico in zip(shard, semi, storici)]
+    return unisci_risultati(mappa_shard(esegui_shard, argomenti, n_workers))
@@ -0,0 +1,303 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from montecarlo_motore import (PARAMETRI_DEFAULT, BLOCCO_PASSI, scegli_dimensionamento, stato_sott_acqua,
+                               aggiorna_sott_acqua, risultati_sott_acqua, estrai_streak, registra_trade)
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, mappa_shard, unisci_risultati
+
+# Portafoglio di più strumenti su un unico conto: a ogni passo ogni strumento chiude un
+# trade, i risultati si sommano sul capitale comune e bancarotta e drawdown dipendono
+# dall'esposizione complessiva. Ogni strumento ha i suoi parametri (quelli di
+# PARAMETRI_DEFAULT, regola di dimensionamento compresa), mentre capitale_iniziale e
+# n_scambi sono del portafoglio:
+#
+#     parametri = {
+#         'capitale_iniziale': 5000,
+#         'strumenti': [
+#             {'nome': 'MES', 'valore_tick': 1.25, 'stop_loss_ticks': 19, 'take_profit_ticks': 25},
+#             {'nome': 'MNQ', 'valore_tick': 0.50, 'stop_loss_ticks': 40, 'take_profit_ticks': 50,
+#              'win_rate': 0.51, 'dimensionamento': 'frazione_fissa'},
+#         ],
+#         'correlazione': [[1.0, 0.6], [0.6, 1.0]],  # oppure un numero: la stessa per ogni coppia
+#     }
+#
+# Gli esiti sono correlati con una copula gaussiana: per ogni passo si estrae un vettore
+# normale con la matrice di correlazione indicata e lo strumento k vince se la sua
+# componente è sotto il quantile normale del suo win_rate (cioè se Phi(z_k) < win_rate).
+
+PARAMETRI_PORTAFOGLIO_DEFAULT = {
+    'n_scambi': PARAMETRI_DEFAULT['n_scambi'],
+    'capitale_iniziale': PARAMETRI_DEFAULT['capitale_iniziale'],
+    'strumenti': [{}],
+    'correlazione': 0.0,
+}
+
+
+def prepara_strumenti(parametri):
+    """
+    Parametri completi di ogni strumento: PARAMETRI_DEFAULT, poi capitale_iniziale del
+    portafoglio (letto dalle regole di dimensionamento), poi quelli dello strumento.
+    """
+    strumenti = []
+    for i, strumento in enumerate(parametri['strumenti']):
+        completo = {**PARAMETRI_DEFAULT, 'capitale_iniziale': parametri['capitale_iniziale'], **strumento}
+        completo.setdefault('nome', f"strumento {i + 1}")
+        if completo['regimi'] is not None or completo['modello_esiti'] is not None:
+            raise ValueError("Il portafoglio supporta solo esiti nominali (regimi e modello_esiti = None)")
+        scegli_dimensionamento(completo)
+        strumenti.append(completo)
+    if not strumenti:
+        raise ValueError("Il portafoglio deve contenere almeno uno strumento")
+    return strumenti
+
+
+def fattore_correlazione(correlazione, n_strumenti):
+    """
+    Fattore di Cholesky L (L @ L.T = matrice di correlazione). correlazione è una
+    matrice n_strumenti x n_strumenti oppure un numero, la correlazione di ogni coppia.
+    """
+    if np.ndim(correlazione) == 0:
+        matrice = np.full((n_strumenti, n_strumenti), float(correlazione))
+        np.fill_diagonal(matrice, 1.0)
+    else:
+        matrice = np.asarray(correlazione, dtype=np.float64)
+    if matrice.shape != (n_strumenti, n_strumenti):
+        raise ValueError(f"La matrice di correlazione deve essere {n_strumenti}x{n_strumenti}")
+    if not np.allclose(matrice, matrice.T) or not np.allclose(np.diag(matrice), 1):
+        raise ValueError("La matrice di correlazione deve essere simmetrica con 1 sulla diagonale")
+    try:
+        return np.linalg.cholesky(matrice)
+    except np.linalg.LinAlgError:
+        raise ValueError("La matrice di correlazione deve essere definita positiva") from None
+
+
+def soglie_copula(strumenti):
+    """Quantile normale del win_rate di ogni strumento: lo strumento vince se z < soglia."""
+    normale = NormalDist()
+    return np.array([-np.inf if s['win_rate'] <= 0 else np.inf if s['win_rate'] >= 1 else normale.inv_cdf(s['win_rate'])
+                     for s in strumenti])
+
+
+def inizializza_portafoglio(n_simulazioni, parametri, strumenti):
+    """
+    Stato iniziale di n_simulazioni percorsi del portafoglio: capitale, picco e
+    drawdown comuni e in 'strumenti' lo stato di ogni strumento, con gli stessi campi
+    di montecarlo_motore.inizializza_stato. Tutti gli stati degli strumenti condividono
+    gli array del capitale e del drawdown, così le regole di dimensionamento vedono il
+    capitale del conto.
+    """
+    capitale = np.full(n_simulazioni, float(parametri['capitale_iniziale']))
+    stato = {
+        'passo': 0,
+        'capitale': capitale,
+        'attivo': np.ones(n_simulazioni, dtype=bool),
+        'picco': capitale.copy(),
+        'drawdown_massimo': np.zeros(n_simulazioni),
+        'strumenti': [],
+        **stato_sott_acqua(n_simulazioni),
+    }
+    for strumento in strumenti:
+        stato_strumento = {
+            'capitale': capitale,
+            'drawdown_massimo': stato['drawdown_massimo'],
+            'tick_loss_accumulati': np.zeros(n_simulazioni),
+            'n_contratti': np.ones(n_simulazioni),
+            'current_streak': np.zeros(n_simulazioni, dtype=np.int64),
+            'current_max_contratti': np.ones(n_simulazioni),
+            'trade_totali': np.zeros(n_simulazioni, dtype=np.int64),
+            'win_count': np.zeros(n_simulazioni, dtype=np.int64),
+            'somma_wins': np.zeros(n_simulazioni),
+            'somma_losses': np.zeros(n_simulazioni),
+            'streak_chiuse': [],
+        }
+        scegli_dimensionamento(strumento)(stato_strumento, strumento, stato_strumento['n_contratti'])
+        stato['strumenti'].append(stato_strumento)
+    return stato
+
+
+def normali_correlate(n_passi, n_simulazioni, fattore, rng):
+    """Normali della copula di n_passi trade, array (n_passi, n_strumenti, n_simulazioni)."""
+    normali = rng.standard_normal((n_passi, n_simulazioni, len(fattore))) @ fattore.T
+    return np.ascontiguousarray(normali.transpose(0, 2, 1))
+
+
+def avanza_portafoglio(stato, parametri, strumenti, n_passi, rng, storico=None):
+    """
+    Fa avanzare tutti i percorsi attivi di n_passi passi, un trade per strumento a
+    passo. Ogni strumento segue la regola di montecarlo_motore.avanza_stato (streak e
+    tick persi con registra_trade, poi dimensionamento); il capitale cambia della
+    somma dei risultati del passo e solo dopo si aggiornano drawdown, contratti e
+    bancarotte.
+    Le normali della copula si estraggono a blocchi di BLOCCO_PASSI passi.
+    """
+    fattore = fattore_correlazione(parametri['correlazione'], len(strumenti))
+    soglie = soglie_copula(strumenti)
+    dimensiona = [scegli_dimensionamento(s) for s in strumenti]
+    # Risultato in dollari di un trade per contratto (perdita, vincita) e commissione, per strumento
+    valori_trade = [np.array([-s['stop_loss_ticks'] * s['valore_tick'], s['take_profit_ticks'] * s['valore_tick']])
+                    for s in strumenti]
+    commissioni = [2 * s['commissione_per_contratto'] for s in strumenti]
+
+    capitale = stato['capitale']
+    attivo = stato['attivo']
+    picco = stato['picco']
+    drawdown = stato['drawdown_massimo']
+    n_simulazioni = len(capitale)
+    variazione = np.empty(n_simulazioni)
+
+    fatti = 0
+    while fatti < n_passi and attivo.any():
+        blocco = min(BLOCCO_PASSI, n_passi - fatti)
+        normali = normali_correlate(blocco, n_simulazioni, fattore, rng)
+        for righe in normali:
+            variazione[...] = 0.0
+            for k, (s, riga) in enumerate(zip(stato['strumenti'], righe)):
+                n_contratti = s['n_contratti']
+                is_win = riga < soglie[k]
+                is_win &= attivo
+                risultato = np.take(valori_trade[k], is_win.view(np.uint8)) * n_contratti
+                risultato -= commissioni[k] * n_contratti
+                risultato *= attivo
+                variazione += risultato
+                registra_trade(s, is_win, risultato, strumenti[k]['stop_loss_ticks'], attivo)
+
+            capitale += variazione
+            np.maximum(picco, capitale, out=picco)
+            profondita = picco - capitale
+            aggiorna_sott_acqua(stato, profondita, attivo)
+            np.maximum(drawdown, profondita, out=drawdown)
+            for s, strumento, regola in zip(stato['strumenti'], strumenti, dimensiona):
+                regola(s, strumento, s['n_contratti'])
+
+            stato['passo'] += 1
+            if storico is not None:
+                vivi = attivo[:len(storico)]
+                storico[vivi, stato['passo']] = capitale[:len(storico)][vivi]
+            attivo &= capitale > 0
+        fatti += blocco
+    return stato
+
+
+def risultati_portafoglio(stato):
+    """
+    Risultati con gli stessi campi di montecarlo_motore.risultati_da_stato, sommati su
+    tutti gli strumenti (i tempi sott'acqua e di bancarotta sono in passi; le streak
+    di ogni strumento restano separate, con il campo 'strumento'), più
+    'profitto_strumenti' e 'win_count_strumenti', matrici (n_simulazioni, n_strumenti)
+    con il profitto netto e le vincite di ogni strumento.
+    """
+    losing_streaks = []
+    for k, s in enumerate(stato['strumenti']):
+        aperte = estrai_streak(s, np.flatnonzero(s['current_streak'] > 0))
+        colonne = [np.concatenate(c) for c in zip(*s['streak_chiuse'], aperte)]
+        streak = dict(zip(['simulazione', 'length', 'max_contratti', 'tick_loss_totali'], colonne))
+        streak['strumento'] = np.full(len(streak['length']), k, dtype=np.int32)
+        losing_streaks.append(streak)
+
+    trade_totali = sum(s['trade_totali'] for s in stato['strumenti'])
+    win_count = sum(s['win_count'] for s in stato['strumenti'])
+    somma_wins = sum(s['somma_wins'] for s in stato['strumenti'])
+    somma_losses = sum(s['somma_losses'] for s in stato['strumenti'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expectancy = np.where(trade_totali > 0, (somma_wins + somma_losses) / np.maximum(trade_totali, 1), 0.0)
+        profit_factor = np.where(somma_losses != 0, np.abs(somma_wins / somma_losses), np.nan)
+
+    return {
+        'capitale_finale': stato['capitale'].copy(),
+        'losing_streaks': {k: np.concatenate([s[k] for s in losing_streaks]) for k in losing_streaks[0]},
+        'drawdown_massimo': stato['drawdown_massimo'].copy(),
+        'trade_totali': trade_totali,
+        'win_count': win_count,
+        'loss_count': trade_totali - win_count,
+        'somma_wins': somma_wins,
+        'somma_losses': somma_losses,
+        'expectancy': expectancy,
+        'profit_factor': profit_factor,
+        'profitto_strumenti': np.column_stack([s['somma_wins'] + s['somma_losses'] for s in stato['strumenti']]),
+        'win_count_strumenti': np.column_stack([s['win_count'] for s in stato['strumenti']]),
+        # Ogni strumento fa un trade per passo: i passi giocati sono i trade del primo
+        **risultati_sott_acqua(stato, stato['strumenti'][0]['trade_totali']),
+    }
+
+
+def simula_portafoglio(n_simulazioni, parametri=None, rng=None, salva_storico=False):
+    """
+    Come montecarlo_motore.simula_batch, per un portafoglio: n_simulazioni percorsi
+    da parametri['n_scambi'] passi, con lo storico del capitale comune se richiesto.
+    """
+    parametri = {**PARAMETRI_PORTAFOGLIO_DEFAULT, **(parametri or {})}
+    if rng is None:
+        rng = np.random.default_rng()
+    strumenti = prepara_strumenti(parametri)
+
+    stato = inizializza_portafoglio(n_simulazioni, parametri, strumenti)
+    storico = None
+    if salva_storico is not False:
+        righe = n_simulazioni if salva_storico is True else min(int(salva_storico), n_simulazioni)
+        storico = np.full((righe, parametri['n_scambi'] + 1), np.nan)
+        storico[:, 0] = parametri['capitale_iniziale']
+
+    avanza_portafoglio(stato, parametri, strumenti, parametri['n_scambi'], rng, storico)
+
+    risultati = risultati_portafoglio(stato)
+    if storico is not None:
+        risultati['storico_saldo'] = storico
+    return risultati
+
+
+def esegui_shard_portafoglio(argomenti):
+    n, parametri, seme, salva_storico = argomenti
+    return simula_portafoglio(n, parametri, rng=np.random.default_rng(seme), salva_storico=salva_storico)
+
+
+def esegui_portafoglio(n_simulazioni, parametri=None, seed=None, n_workers=None,
+                       dimensione_shard=DIMENSIONE_SHARD, salva_storico=False):
+    """
+    Come montecarlo_parallelo.esegui_parallelo, per un portafoglio: shard su più
+    processi con semi da SeedSequence(seed).spawn(), risultato identico con qualunque
+    n_workers.
+    """
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+    if isinstance(salva_storico, bool):
+        storici = [salva_storico] * len(shard)
+    else:
+        inizi = np.concatenate([[0], np.cumsum(shard)[:-1]])
+        storici = [int(np.clip(salva_storico - inizio, 0, n)) for n, inizio in zip(shard, inizi)]
+    argomenti = [(n, parametri, seme, storico) for n, seme, storico in zip(shard, semi, storici)]
+    return unisci_risultati(mappa_shard(esegui_shard_portafoglio, argomenti, n_workers))
+
+
+def stampa_strumenti(risultati, parametri):
+    """Contributo di ogni strumento: profitto netto medio e win rate osservato."""
+    strumenti = prepara_strumenti({**PARAMETRI_PORTAFOGLIO_DEFAULT, **parametri})
+    trade = risultati['trade_totali'].sum() / len(strumenti)
+    print("\nCONTRIBUTO DEGLI STRUMENTI")
+    print("=" * 90)
+    print(f"{'Strumento':<16} | {'Profitto medio':>15} | {'Profitto totale':>16} | {'Win rate':>9}")
+    print("-" * 90)
+    for k, strumento in enumerate(strumenti):
+        profitto = risultati['profitto_strumenti'][:, k]
+        win_rate = risultati['win_count_strumenti'][:, k].sum() / trade if trade > 0 else 0
+        print(f"{strumento['nome']:<16} | {profitto.mean():>15,.2f} | {profitto.sum():>16,.2f} | {win_rate:>8.1%}")
+
+
+if __name__ == "__main__":
+    import time
+
+    strumenti = [
+        {'nome': 'MES', 'valore_tick': 1.25, 'stop_loss_ticks': 19, 'take_profit_ticks': 25, 'dimensionamento': 'fisso'},
+        {'nome': 'MNQ', 'valore_tick': 0.50, 'stop_loss_ticks': 40, 'take_profit_ticks': 50, 'win_rate': 0.51,
+         'dimensionamento': 'fisso'},
+        {'nome': 'MGC', 'valore_tick': 1.00, 'stop_loss_ticks': 20, 'take_profit_ticks': 30, 'win_rate': 0.45,
+         'dimensionamento': 'fisso'},
+    ]
+    for correlazione in (0.0, 0.5, 0.9):
+        parametri = {'capitale_iniziale': 1500, 'n_scambi': 2000, 'strumenti': strumenti, 'correlazione': correlazione}
+        inizio = time.perf_counter()
+        risultati = esegui_portafoglio(20000, parametri, seed=0)
+        durata = time.perf_counter() - inizio
+        print(f"correlazione {correlazione:.1f} | bancarotta {np.mean(risultati['capitale_finale'] <= 0):.2%} | "
+              f"drawdown medio {risultati['drawdown_massimo'].mean():,.0f} | {durata:.2f} s")
+    stampa_strumenti(risultati, parametri)
@@ -0,0 +1,116 @@
+import numpy as np
+from scipy.stats import qmc
+
+from montecarlo_motore import PARAMETRI_DEFAULT, simula_batch
+from montecarlo_parallelo import itera_shard
+
+# Quasi-Monte Carlo: gli esiti dei trade vengono da una sequenza di Sobol scramblata
+# invece che da numeri pseudo-casuali. Ogni percorso è un punto di Sobol con una
+# dimensione per trade (il trade t vince se la coordinata t è sotto win_rate); lo
+# scrambling casuale rende ogni replica una stima non distorta e la dispersione tra
+# repliche indipendenti dà l'errore standard.
+
+# Dimensione massima delle sequenze di Sobol di scipy: n_scambi non può superarla
+MAX_DIMENSIONI_SOBOL = 21201
+
+GRANDEZZE_QMC = ('capitale_medio', 'expectancy', 'prob_bancarotta', 'drawdown_medio')
+
+
+def uniformi_sobol(n_simulazioni, n_scambi, rng):
+    """
+    Matrice (n_simulazioni, n_scambi) di punti di Sobol scramblati da passare a
+    simula_batch (uniformi=...). n_simulazioni deve essere una potenza di 2: solo
+    così la sequenza conserva le sue proprietà di bilanciamento.
+    """
+    if n_simulazioni < 1 or n_simulazioni & (n_simulazioni - 1):
+        raise ValueError(f"Con Sobol n_simulazioni deve essere una potenza di 2 (non {n_simulazioni})")
+    if n_scambi > MAX_DIMENSIONI_SOBOL:
+        raise ValueError(f"Con Sobol n_scambi può essere al massimo {MAX_DIMENSIONI_SOBOL}")
+    return qmc.Sobol(d=n_scambi, scramble=True, seed=rng).random_base2(int(np.log2(n_simulazioni)))
+
+
+def stime_replica(risultati):
+    """Le GRANDEZZE_QMC stimate da una replica (risultati di simula_batch)."""
+    trade = risultati['trade_totali'].sum()
+    return {
+        'capitale_medio': risultati['capitale_finale'].mean(),
+        'expectancy': (risultati['somma_wins'].sum() + risultati['somma_losses'].sum()) / trade if trade else 0.0,
+        'prob_bancarotta': np.mean(risultati['capitale_finale'] <= 0),
+        'drawdown_medio': risultati['drawdown_massimo'].mean(),
+    }
+
+
+def _replica(argomenti):
+    n, parametri, seme, sobol = argomenti
+    rng = np.random.default_rng(seme)
+    if sobol:
+        uniformi = uniformi_sobol(n, parametri['n_scambi'], rng)
+    else:
+        uniformi = rng.random((n, parametri['n_scambi']))
+    return stime_replica(simula_batch(n, parametri, rng=rng, uniformi=uniformi))
+
+
+def _riassumi_repliche(repliche):
+    # Media delle repliche ed errore standard della media
+    return {k: (np.mean([r[k] for r in repliche]), np.std([r[k] for r in repliche], ddof=1) / np.sqrt(len(repliche)))
+            for k in GRANDEZZE_QMC}
+
+
+def stima_qmc(n_simulazioni, n_repliche=16, parametri=None, seed=None, n_workers=None):
+    """
+    Stima le GRANDEZZE_QMC con n_repliche repliche indipendenti di n_simulazioni
+    percorsi di Sobol scramblato e, con lo stesso budget (stesse repliche e percorsi),
+    con numeri pseudo-casuali. Per entrambi i metodi restituisce, per ogni grandezza,
+    (stima, errore standard) dalla dispersione tra le repliche, e in 'guadagno' il
+    rapporto tra le varianze (MC / QMC): quante volte più percorsi servirebbero al
+    Monte Carlo semplice per la stessa precisione.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    if parametri['regimi'] is not None:
+        raise ValueError("Con Sobol gli esiti vengono dalle uniformi: i regimi non sono supportati (regimi=None)")
+    if n_repliche < 2:
+        raise ValueError("Servono almeno 2 repliche per l'errore standard")
+    semi = np.random.SeedSequence(seed).spawn(2 * n_repliche)
+    argomenti = [(n_simulazioni, parametri, seme, i < n_repliche) for i, seme in enumerate(semi)]
+    repliche = list(itera_shard(_replica, argomenti, n_workers))
+    qmc_stime = _riassumi_repliche(repliche[:n_repliche])
+    mc_stime = _riassumi_repliche(repliche[n_repliche:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        guadagno = {k: (mc_stime[k][1] / qmc_stime[k][1]) ** 2 for k in GRANDEZZE_QMC}
+    return {'qmc': qmc_stime, 'mc': mc_stime, 'guadagno': guadagno,
+            'n_simulazioni': n_simulazioni, 'n_repliche': n_repliche}
+
+
+def stampa_qmc(rapporto, esatte=None):
+    """Stampa le stime QMC e MC con i loro errori standard (e i valori esatti, se noti)."""
+    print("\nQUASI-MONTE CARLO (SOBOL SCRAMBLATO) E MONTE CARLO SEMPLICE")
+    print("=" * 90)
+    print(f"Budget per metodo: {rapporto['n_repliche']} repliche x {rapporto['n_simulazioni']} simulazioni")
+    intestazione = f"{'Stima':<16} | {'QMC':>11} | {'Errore std':>10} | {'MC':>11} | {'Errore std':>10} | {'Guadagno':>8}"
+    print(intestazione + (f" | {'Esatto':>11}" if esatte else ""))
+    print("-" * 90)
+    for k in GRANDEZZE_QMC:
+        (stima_qmc_k, errore_qmc), (stima_mc, errore_mc) = rapporto['qmc'][k], rapporto['mc'][k]
+        guadagno = rapporto['guadagno'][k]
+        guadagno = f"{guadagno:>7.1f}x" if np.isfinite(guadagno) else f"{'-':>8}"
+        riga = (f"{k:<16} | {stima_qmc_k:>11.4f} | {errore_qmc:>10.4f} | {stima_mc:>11.4f} | {errore_mc:>10.4f} | "
+                f"{guadagno}")
+        if esatte:
+            riga += f" | {esatte[k]:>11.4f}" if k in esatte else f" | {'':>11}"
+        print(riga)
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_esatto import risolvi_reticolo, statistiche_esatte
+
+    # I parametri di montecarlo_recovery_1lose_per_1win.py: 1 contratto, soluzione esatta nota
+    parametri = {'n_scambi': 500, 'stop_loss_ticks': 15, 'take_profit_ticks': 20, 'win_rate': 0.60,
+                 'capitale_iniziale': 600, 'max_contratti': 1, 'dimensionamento': 'fisso'}
+    inizio = time.perf_counter()
+    rapporto = stima_qmc(1024, n_repliche=16, parametri=parametri, seed=0)
+    durata = time.perf_counter() - inizio
+    stampa_qmc(rapporto, statistiche_esatte(risolvi_reticolo(parametri), parametri['capitale_iniziale'],
+                                            rapporto['n_simulazioni'] * rapporto['n_repliche']))
+    print(f"\nTempo: {durata:.2f} s")
@@ -1,6 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from collections import defaultdict
+from montecarlo_parallelo import esegui_parallelo
+from montecarlo_jit import esegui_parallelo_jit
+from montecarlo_markov import risolvi_markov
+from montecarlo_streaming import simula_streaming, statistiche_sott_acqua
+from montecarlo_convergenza import simula_adattiva, stampa_convergenza
+from montecarlo_streak import tabella_streak
+from montecarlo_checkpoint import esegui_con_checkpoint
+from montecarlo_portafoglio import esegui_portafoglio, stampa_strumenti
+from montecarlo_grafici import densita_risultati, densita_da_istogramma, disegna_densita, disegna_curve
 
 # Parametri di simulazione
 n_simulazioni = 1000
@@ -12,241 +20,265 @@ take_profit_ticks = 25
 win_rate = 0.53
 max_contratti = 4
 capitale_iniziale = 500
+regimi = None  # esiti a regimi nascosti, vedi montecarlo_regimi (None = trade indipendenti)
+modello_esiti = None  # slippage, commissioni variabili e uscite a tempo, vedi montecarlo_esiti (None = esiti nominali)
+seed = None  # seme principale: a parità di seme i risultati sono identici
+n_workers = None  # processi da usare (None = tutti i core)
+motore_jit = False  # True: kernel compilato con Numba (montecarlo_jit), stessi percorsi; senza Numba motore NumPy
+modalita_markov = False  # True: streak attese ed expectancy esatte (montecarlo_markov) accanto a quelle simulate
+modalita_streaming = False  # True: solo statistiche aggregate, memoria costante in n_simulazioni
+modalita_adattiva = False  # True: n_simulazioni scelto finché gli intervalli di confidenza sono stretti abbastanza
+obiettivi_convergenza = {'prob_bancarotta': 0.005, 'capitale_medio': 50.0, 'drawdown_medio': 20.0}
+max_simulazioni_adattive = 100_000
+grafico_densita = True  # True: densità di tutte le curve sotto le 20 campione (richiede lo storico completo)
+punti_curve = 500  # punti per curva campione (sottocampionamento LTTB), None = tutti
+# File .npz dello stato della simulazione: se esiste si riprende da lì, e con n_scambi o
+# n_simulazioni più grandi si calcolano solo i trade e i percorsi nuovi
+file_checkpoint = None
+passi_checkpoint = 500  # trade tra un salvataggio e l'altro
+# Portafoglio: lista di strumenti, ognuno con i suoi parametri (quelli sopra sono i default),
+# simulati insieme su capitale_iniziale con esiti correlati (vedi montecarlo_portafoglio).
+# Esempio: [{'nome': 'MES'}, {'nome': 'MNQ', 'valore_tick': 0.5, 'stop_loss_ticks': 40, 'take_profit_ticks': 50}]
+strumenti = None
+correlazione = 0.0  # correlazione tra gli esiti degli strumenti (un numero o una matrice)
 
-def simula_trade(n_contratti):
-    """
-    Simula un singolo trade con commissioni e stop loss/take profit fissi.
-    Restituisce il profitto in dollari e se il trade è vincente.
-    Le commissioni sono 1.5 in entrata e 1.5 in uscita per contratto.
-    """
-    is_win = np.random.rand() < win_rate
-    if is_win:
-        ticks = take_profit_ticks
-        profitto = ticks * valore_tick * n_contratti
-    else:
-        ticks = -stop_loss_ticks
-        profitto = ticks * valore_tick * n_contratti
-    commissione = 2 * commissione_per_contratto * n_contratti
-    return profitto - commissione, is_win
+parametri = {
+    'n_scambi': n_scambi,
+    'commissione_per_contratto': commissione_per_contratto,
+    'valore_tick': valore_tick,
+    'stop_loss_ticks': stop_loss_ticks,
+    'take_profit_ticks': take_profit_ticks,
+    'win_rate': win_rate,
+    'max_contratti': max_contratti,
+    'dimensionamento': 'martingala',  # vedi montecarlo_motore.DIMENSIONAMENTI
+    'capitale_iniziale': capitale_iniziale,
+    'regimi': regimi,
+    'modello_esiti': modello_esiti,
+}
 
-def max_drawdown(equity_curve):
+def riepilogo_da_risultati(risultati, parametri, n_curve=20, densita=False):
     """
-    Calcola il drawdown massimo dato un array dell'andamento del capitale.
+    Statistiche per la stampa e i grafici a partire dai risultati per simulazione
+    (esegui_parallelo o un file salvato da montecarlo_cli.py). Con densita=True
+    tutto lo storico finisce nell'immagine di densità delle curve.
     """
-    running_max = np.maximum.accumulate(equity_curve)
-    drawdowns = running_max - equity_curve
-    return np.max(drawdowns)
+    capitale_iniziale = parametri['capitale_iniziale']
+    totale_trade = int(np.sum(risultati['trade_totali']))
+    return {
+        'n_simulazioni': len(risultati['capitale_finale']),
+        # Elaborazione delle losing streaks: tabella per lunghezza calcolata in blocco
+        'streak_stats': tabella_streak(risultati['losing_streaks']),
+        # Statistiche sul drawdown
+        'drawdown_massimo_medio': np.mean(risultati['drawdown_massimo']),
+        'drawdown_massimo_totale': np.max(risultati['drawdown_massimo']),
+        # Tempi sott'acqua, di recupero e di bancarotta
+        'sott_acqua': statistiche_sott_acqua(risultati),
+        # Numero di simulazioni perdenti (capitale finale < capitale iniziale)
+        'n_simulazioni_perdenti': int(np.sum(risultati['capitale_finale'] < capitale_iniziale)),
+        # Statistiche sui trade aggregati (somma su tutte le simulazioni)
+        'totale_trade': totale_trade,
+        'totale_win': int(np.sum(risultati['win_count'])),
+        'totale_loss': int(np.sum(risultati['loss_count'])),
+        'somma_win_totale': np.sum(risultati['somma_wins']),
+        'somma_loss_totale': np.sum(risultati['somma_losses']),
+        'curve_campione': risultati['storico_saldo'][:n_curve] if 'storico_saldo' in risultati else [],
+        'densita_curve': densita_risultati(risultati) if densita else None,
+        'istogramma_capitale': np.histogram(risultati['capitale_finale'], bins=50),
+    }
 
-def run_simulazione():
-    """
-    Esegue una simulazione completa:
-      - Se il trade è vincente, il trade successivo si esegue con 1 contratto.
-      - Se il trade è perdente, si accumulano i tick persi e si aumenta il numero
-        di contratti secondo: n_contratti * take_profit_ticks >= tick_loss_accumulati.
-    Registra inoltre le statistiche sui trade (numero, win, loss, guadagni e perdite).
-    Restituisce il capitale finale, lo storico del capitale, le losing streak, il drawdown massimo
-    e le statistiche sui trade.
-    """
-    capitale = capitale_iniziale
-    storico_saldo = [capitale]
-    
-    # Statistiche trade
-    trade_totali = 0
-    win_count = 0
-    loss_count = 0
-    somma_wins = 0.0
-    somma_losses = 0.0
-    
-    # Accumulo dei tick persi e gestione dei contratti
-    tick_loss_accumulati = 0
-    n_contratti = 1
-    
-    losing_streaks = []
-    current_streak = 0
-    current_max_contratti = 1
-
-    for _ in range(n_scambi):
-        trade_totali += 1
-        trade_result, is_win = simula_trade(n_contratti)
-        capitale += trade_result
-        storico_saldo.append(capitale)
-        
-        if is_win:
-            win_count += 1
-            somma_wins += trade_result
-            # Se c'era una losing streak, la registra prima di resettare
-            if current_streak > 0:
-                losing_streaks.append({
-                    'length': current_streak,
-                    'max_contratti': current_max_contratti,
-                    'tick_loss_totali': tick_loss_accumulati
-                })
-            # Reset: trade vincente porta sempre al reset a 1 contratto
-            current_streak = 0
-            current_max_contratti = 1
-            tick_loss_accumulati = 0
-            n_contratti = 1
-        else:
-            loss_count += 1
-            somma_losses += trade_result  # trade_result è negativo per le perdite
-            current_streak += 1
-            # Accumula i tick persi: per ogni contratto si perde stop_loss_ticks
-            tick_loss_accumulati += stop_loss_ticks * n_contratti
-            current_max_contratti = max(current_max_contratti, n_contratti)
-            # Calcola i contratti necessari per recuperare i tick persi
-            n_contratti = min(max(1, int(np.ceil(tick_loss_accumulati / take_profit_ticks))), max_contratti)
-        
-        if capitale <= 0:
-            break
-
-    # Se la simulazione termina con una losing streak attiva, la registra
-    if current_streak > 0:
-        losing_streaks.append({
-            'length': current_streak,
-            'max_contratti': current_max_contratti,
-            'tick_loss_totali': tick_loss_accumulati
-        })
-    
-    dd = max_drawdown(np.array(storico_saldo))
-    
-    # Calcola expectancy (guadagno medio per trade) e profit factor
-    expectancy = (somma_wins + somma_losses) / trade_totali if trade_totali > 0 else 0
-    profit_factor = abs(somma_wins / somma_losses) if somma_losses != 0 else np.nan
 
+def riepilogo_da_accumulatore(accumulatore, densita=False):
+    """Le stesse statistiche di riepilogo_da_risultati, da un AccumulatoreStreaming."""
+    stat = accumulatore.statistiche()
     return {
-        'capitale_finale': capitale,
-        'storico_saldo': storico_saldo,
-        'losing_streaks': losing_streaks,
-        'drawdown_massimo': dd,
-        'trade_totali': trade_totali,
-        'win_count': win_count,
-        'loss_count': loss_count,
-        'somma_wins': somma_wins,
-        'somma_losses': somma_losses,
-        'expectancy': expectancy,
-        'profit_factor': profit_factor
+        'n_simulazioni': accumulatore.totali['n_simulazioni'],
+        'streak_stats': accumulatore.tabella_streak(),
+        'drawdown_massimo_medio': stat['drawdown_medio'],
+        'drawdown_massimo_totale': stat['drawdown_max'],
+        'sott_acqua': accumulatore.statistiche_sott_acqua(),
+        'n_simulazioni_perdenti': stat['sotto_capitale_iniziale'],
+        'totale_trade': accumulatore.totali['trade_totali'],
+        'totale_win': accumulatore.totali['win_count'],
+        'totale_loss': accumulatore.totali['loss_count'],
+        'somma_win_totale': accumulatore.totali['somma_wins'],
+        'somma_loss_totale': accumulatore.totali['somma_losses'],
+        'curve_campione': accumulatore.campione.curve,
+        'densita_curve': densita_da_istogramma(accumulatore.quantili_passi) if densita else None,
+        'istogramma_capitale': (accumulatore.quantili_capitale.conteggi[0], accumulatore.quantili_capitale.bordi()),
     }
 
-# Esecuzione delle simulazioni
-risultati = [run_simulazione() for _ in range(n_simulazioni)]
-
-# Elaborazione delle losing streaks
-streak_stats = defaultdict(lambda: {
-    'count': 0,
-    'max_contratti': [],
-    'tick_loss_totali': []
-})
-for res in risultati:
-    for streak in res['losing_streaks']:
-        length = streak['length']
-        streak_stats[length]['count'] += 1
-        streak_stats[length]['max_contratti'].append(streak['max_contratti'])
-        streak_stats[length]['tick_loss_totali'].append(streak['tick_loss_totali'])
-
-for length in streak_stats:
-    stats = streak_stats[length]
-    stats['contratti_avg'] = np.mean(stats['max_contratti']) if stats['count'] > 0 else 0
-    stats['contratti_max'] = np.max(stats['max_contratti']) if stats['count'] > 0 else 0
-    stats['contratti_min'] = np.min(stats['max_contratti']) if stats['count'] > 0 else 0
-    stats['tick_loss_avg'] = np.mean(stats['tick_loss_totali']) if stats['count'] > 0 else 0
-
-# Statistiche sul drawdown
-drawdowns = [res['drawdown_massimo'] for res in risultati]
-drawdown_massimo_medio = np.mean(drawdowns)
-drawdown_massimo_totale = np.max(drawdowns)
-
-# Numero di simulazioni perdenti (capitale finale < capitale iniziale)
-n_simulazioni_perdenti = sum(1 for res in risultati if res['capitale_finale'] < capitale_iniziale)
-percentuale_perdenti = n_simulazioni_perdenti / n_simulazioni * 100
-
-# Statistiche sui trade aggregati (somma su tutte le simulazioni)
-totale_trade = sum(res['trade_totali'] for res in risultati)
-totale_win = sum(res['win_count'] for res in risultati)
-totale_loss = sum(res['loss_count'] for res in risultati)
-somma_win_totale = sum(res['somma_wins'] for res in risultati)
-somma_loss_totale = sum(res['somma_losses'] for res in risultati)
-expectancy_media = (somma_win_totale + somma_loss_totale) / totale_trade if totale_trade > 0 else 0
-profit_factor_aggregato = abs(somma_win_totale / somma_loss_totale) if somma_loss_totale != 0 else np.nan
-win_rate_osservato = totale_win / totale_trade * 100 if totale_trade > 0 else 0
-
-# Stampa delle statistiche delle losing streaks
-print("\nSTATISTICHE DETTAGLIATE DELLE LOSING STREAKS")
-print("=" * 90)
-print(f"{'Lunghezza':<10} | {'Occorrenze':<10} | {'Contratti Avg':<12} | {'Contratti Max':<12} | {'Contratti Min':<12} | {'Tick Loss Media':<15}")
-print("-" * 90)
-sorted_lengths = sorted(streak_stats.keys())
-for length in sorted_lengths:
-    if streak_stats[length]['count'] > 0:
-        stats = streak_stats[length]
-        print(f"{length:<10} | {stats['count']:<10} | {stats['contratti_avg']:<12.1f} | {stats['contratti_max']:<12} | {stats['contratti_min']:<12} | {stats['tick_loss_avg']:>10.1f}")
-
-# Stampa delle statistiche sul drawdown
-print("\nSTATISTICHE DRAWDOWN")
-print("=" * 90)
-print(f"Drawdown massimo medio: ${drawdown_massimo_medio:,.2f}")
-print(f"Drawdown massimo totale: ${drawdown_massimo_totale:,.2f}")
-
-# Stampa delle simulazioni perdenti
-print("\nSIMULAZIONI PERDENTI")
-print("=" * 90)
-print(f"Numero simulazioni perdenti: {n_simulazioni_perdenti} su {n_simulazioni} ({percentuale_perdenti:.1f}%)")
-
-# Stampa delle statistiche sui trade
-print("\nSTATISTICHE SUI TRADE")
-print("=" * 90)
-print(f"Trade totali: {totale_trade}")
-print(f"Trade vincenti: {totale_win} ({win_rate_osservato:.1f}%)")
-print(f"Trade perdenti: {totale_loss}")
-print(f"Guadagno medio trade vincente: ${somma_win_totale / totale_win if totale_win else 0:,.2f}")
-print(f"Perdita media trade perdente: ${abs(somma_loss_totale) / totale_loss if totale_loss else 0:,.2f}")
-print(f"Expectancy media (profitto medio per trade): ${expectancy_media:,.2f}")
-print(f"Profit Factor: {profit_factor_aggregato:.2f}")
-
-# Visualizzazione grafica
-plt.figure(figsize=(18, 12))
-
-# 1. Andamento dei capitali (20 simulazioni campione)
-plt.subplot(2, 2, 1)
-for res in risultati[:20]:
-    plt.plot(res['storico_saldo'], alpha=0.4)
-plt.title('Andamento del Capitale (20 simulazioni campione)')
-plt.xlabel('Trade')
-plt.ylabel('Capitale ($)')
-plt.grid(True)
-
-# 2. Distribuzione dei saldi finali
-plt.subplot(2, 2, 2)
-plt.hist([r['capitale_finale'] for r in risultati], bins=50, color='skyblue', edgecolor='black')
-plt.title('Distribuzione dei Capitali Finali')
-plt.xlabel('Capitale Finale ($)')
-plt.ylabel('Frequenza')
-plt.grid(True)
-
-# 3. Relazione lunghezza streak - contratti medi
-plt.subplot(2, 2, 3)
-lengths = []
-contratti_medi = []
-for length in sorted_lengths:
-    if streak_stats[length]['count'] > 10:  # Filtra dati significativi
-        lengths.append(length)
-        contratti_medi.append(streak_stats[length]['contratti_avg'])
-plt.plot(lengths, contratti_medi, 'bo-')
-plt.title('Relazione Lunghezza Streak - Contratti Medi Necessari')
-plt.xlabel('Lunghezza Losing Streak')
-plt.ylabel('Contratti Medi Necessari')
-plt.grid(True)
-plt.yscale('log')
-
-# 4. Distribuzione delle losing streaks
-plt.subplot(2, 2, 4)
-plt.bar([str(k) for k in sorted_lengths if streak_stats[k]['count'] > 0],
-        [streak_stats[k]['count'] for k in sorted_lengths if streak_stats[k]['count'] > 0],
-        color='salmon')
-plt.title('Distribuzione delle Losing Streaks')
-plt.xlabel('Lunghezza Streak')
-plt.ylabel('Occorrenze Totali')
-plt.xticks(rotation=45)
-plt.grid(True)
-
-plt.tight_layout()
-plt.show()
+
+def stampa_statistiche(riepilogo):
+    streak_stats = riepilogo['streak_stats']
+    n_simulazioni = riepilogo['n_simulazioni']
+    n_simulazioni_perdenti = riepilogo['n_simulazioni_perdenti']
+    totale_trade = riepilogo['totale_trade']
+    totale_win = riepilogo['totale_win']
+    totale_loss = riepilogo['totale_loss']
+    somma_win_totale = riepilogo['somma_win_totale']
+    somma_loss_totale = riepilogo['somma_loss_totale']
+
+    percentuale_perdenti = n_simulazioni_perdenti / n_simulazioni * 100
+    expectancy_media = (somma_win_totale + somma_loss_totale) / totale_trade if totale_trade > 0 else 0
+    profit_factor_aggregato = abs(somma_win_totale / somma_loss_totale) if somma_loss_totale != 0 else np.nan
+    win_rate_osservato = totale_win / totale_trade * 100 if totale_trade > 0 else 0
+
+    # Stampa delle statistiche delle losing streaks
+    print("\nSTATISTICHE DETTAGLIATE DELLE LOSING STREAKS")
+    print("=" * 90)
+    print(f"{'Lunghezza':<10} | {'Occorrenze':<10} | {'Contratti Avg':<12} | {'Contratti Max':<12} | {'Contratti Min':<12} | {'Tick Loss Media':<15}")
+    print("-" * 90)
+    for i, length in enumerate(streak_stats['length']):
+        print(f"{length:<10} | {streak_stats['count'][i]:<10} | {streak_stats['contratti_avg'][i]:<12.1f} | {streak_stats['contratti_max'][i]:<12} | {streak_stats['contratti_min'][i]:<12} | {streak_stats['tick_loss_avg'][i]:>10.1f}")
+
+    # Stampa delle statistiche sul drawdown
+    print("\nSTATISTICHE DRAWDOWN")
+    print("=" * 90)
+    print(f"Drawdown massimo medio: ${riepilogo['drawdown_massimo_medio']:,.2f}")
+    print(f"Drawdown massimo totale: ${riepilogo['drawdown_massimo_totale']:,.2f}")
+    sott_acqua = riepilogo['sott_acqua']
+    print(f"Periodo sott'acqua più lungo: {sott_acqua['tempo_sott_acqua_max_medio']:,.1f} trade in media, "
+          f"{sott_acqua['tempo_sott_acqua_max']:,.0f} al massimo")
+    print(f"Durata media dei periodi sott'acqua: {sott_acqua['tempo_sott_acqua_medio']:,.1f} trade")
+    print(f"Tempo di recupero dal drawdown massimo: {sott_acqua['tempo_recupero_medio']:,.1f} trade in media "
+          f"({sott_acqua['quota_recuperati']:.1%} delle simulazioni con un drawdown lo ha recuperato)")
+    print(f"Tempo medio alla bancarotta: {sott_acqua['tempo_medio_bancarotta']:,.1f} trade")
+
+    # Stampa delle simulazioni perdenti
+    print("\nSIMULAZIONI PERDENTI")
+    print("=" * 90)
+    print(f"Numero simulazioni perdenti: {n_simulazioni_perdenti} su {n_simulazioni} ({percentuale_perdenti:.1f}%)")
+
+    # Stampa delle statistiche sui trade
+    print("\nSTATISTICHE SUI TRADE")
+    print("=" * 90)
+    print(f"Trade totali: {totale_trade}")
+    print(f"Trade vincenti: {totale_win} ({win_rate_osservato:.1f}%)")
+    print(f"Trade perdenti: {totale_loss}")
+    print(f"Guadagno medio trade vincente: ${somma_win_totale / totale_win if totale_win else 0:,.2f}")
+    print(f"Perdita media trade perdente: ${abs(somma_loss_totale) / totale_loss if totale_loss else 0:,.2f}")
+    print(f"Expectancy media (profitto medio per trade): ${expectancy_media:,.2f}")
+    print(f"Profit Factor: {profit_factor_aggregato:.2f}")
+
+
+def stampa_confronto_markov(riepilogo, esatto):
+    """
+    Stampa le losing streak attese e l'expectancy della soluzione esatta (risolvi_markov)
+    accanto a quelle simulate del riepilogo. La soluzione esatta non ha bancarotta: il
+    confronto vale finché la rovina è rara.
+    """
+    n_simulazioni = riepilogo['n_simulazioni']
+    streak_stats = riepilogo['streak_stats']
+    simulate = dict(zip(streak_stats['length'].tolist(), streak_stats['count'].tolist()))
+    streaks = esatto['losing_streaks']
+
+    print("\nLOSING STREAKS: SOLUZIONE ESATTA (SENZA BANCAROTTA) E SIMULAZIONI")
+    print("=" * 90)
+    print(f"{'Lunghezza':<10} | {'Esatte':<12} | {'Simulate':<10} | {'Contratti Max':<13} | {'Tick Loss':<10}")
+    print("-" * 90)
+    for length, attese, contratti, tick_loss in zip(streaks['length'], streaks['attese_per_simulazione'],
+                                                     streaks['max_contratti'], streaks['tick_loss_totali']):
+        if attese * n_simulazioni >= 0.5 or length in simulate:
+            print(f"{length:<10} | {attese * n_simulazioni:<12.1f} | {simulate.get(length, 0):<10} | "
+                  f"{contratti:<13} | {tick_loss:>10}")
+
+    totale_trade = riepilogo['totale_trade']
+    somma_win_totale = riepilogo['somma_win_totale']
+    somma_loss_totale = riepilogo['somma_loss_totale']
+    expectancy_simulata = (somma_win_totale + somma_loss_totale) / totale_trade if totale_trade > 0 else 0
+    profit_factor_simulato = abs(somma_win_totale / somma_loss_totale) if somma_loss_totale != 0 else np.nan
+    print(f"\nExpectancy: esatta ${esatto['expectancy']:,.4f} | simulata ${expectancy_simulata:,.4f}")
+    print(f"Profit Factor: esatto {esatto['profit_factor']:.4f} | simulato {profit_factor_simulato:.4f}")
+
+
+def disegna_grafici(riepilogo, punti_curve=None):
+    """Disegna i quattro grafici del riepilogo e restituisce la figura (curve sottocampionate a punti_curve punti)."""
+    streak_stats = riepilogo['streak_stats']
+    conteggi_capitale, bordi_capitale = riepilogo['istogramma_capitale']
+
+    # Visualizzazione grafica
+    figura = plt.figure(figsize=(18, 12))
+
+    # 1. Andamento dei capitali (20 simulazioni campione)
+    plt.subplot(2, 2, 1)
+    if riepilogo['densita_curve'] is not None:
+        disegna_densita(riepilogo['densita_curve'], cmap='Greys')
+    disegna_curve(riepilogo['curve_campione'], n_punti=punti_curve, alpha=0.4)
+    plt.title('Andamento del Capitale (20 simulazioni campione)')
+    plt.xlabel('Trade')
+    plt.ylabel('Capitale ($)')
+    plt.grid(True)
+
+    # 2. Distribuzione dei saldi finali
+    plt.subplot(2, 2, 2)
+    plt.hist(bordi_capitale[:-1], bins=bordi_capitale, weights=conteggi_capitale, color='skyblue', edgecolor='black')
+    plt.title('Distribuzione dei Capitali Finali')
+    plt.xlabel('Capitale Finale ($)')
+    plt.ylabel('Frequenza')
+    plt.grid(True)
+
+    # 3. Relazione lunghezza streak - contratti medi
+    plt.subplot(2, 2, 3)
+    significative = streak_stats['count'] > 10  # Filtra dati significativi
+    plt.plot(streak_stats['length'][significative], streak_stats['contratti_avg'][significative], 'bo-')
+    plt.title('Relazione Lunghezza Streak - Contratti Medi Necessari')
+    plt.xlabel('Lunghezza Losing Streak')
+    plt.ylabel('Contratti Medi Necessari')
+    plt.grid(True)
+    plt.yscale('log')
+
+    # 4. Distribuzione delle losing streaks
+    plt.subplot(2, 2, 4)
+    plt.bar([str(k) for k in streak_stats['length']], streak_stats['count'], color='salmon')
+    plt.title('Distribuzione delle Losing Streaks')
+    plt.xlabel('Lunghezza Streak')
+    plt.ylabel('Occorrenze Totali')
+    plt.xticks(rotation=45)
+    plt.grid(True)
+
+    plt.tight_layout()
+    return figura
+
+
+if __name__ == "__main__":
+    if modalita_streaming:
+        # Ogni shard viene riassunto in statistiche aggregate e scartato: nessuna curva completa in memoria
+        riepilogo = riepilogo_da_accumulatore(simula_streaming(n_simulazioni, parametri, seed=seed, n_workers=n_workers),
+                                              densita=grafico_densita)
+    else:
+        # Esecuzione delle simulazioni: shard su più processi, ognuno con il motore vettoriale.
+        # Ogni campo di risultati è un array con un elemento per simulazione.
+        if strumenti is not None:
+            parametri_portafoglio = {'n_scambi': n_scambi, 'capitale_iniziale': capitale_iniziale,
+                                     'strumenti': [{**parametri, **s} for s in strumenti],
+                                     'correlazione': correlazione}
+            risultati = esegui_portafoglio(n_simulazioni, parametri_portafoglio, seed=seed, n_workers=n_workers,
+                                           salva_storico=True if grafico_densita else 20)
+            stampa_strumenti(risultati, parametri_portafoglio)
+        elif modalita_adattiva:
+            risultati, convergenza = simula_adattiva(parametri, obiettivi_convergenza, seed=seed, n_workers=n_workers,
+                                                     max_simulazioni=max_simulazioni_adattive, salva_storico=20)
+            stampa_convergenza(convergenza)
+        elif file_checkpoint is not None:
+            # Stesso risultato di esegui_parallelo, con lo stato salvato ogni passi_checkpoint trade
+            risultati = esegui_con_checkpoint(file_checkpoint, n_simulazioni, parametri, seed=seed, n_workers=n_workers,
+                                              passi_checkpoint=passi_checkpoint,
+                                              salva_storico=True if grafico_densita else 20)
+        else:
+            # Lo storico serve solo per il primo grafico: le 20 simulazioni campione e, se richiesta, la densità
+            esegui = esegui_parallelo_jit if motore_jit else esegui_parallelo
+            risultati = esegui(n_simulazioni, parametri, seed=seed, n_workers=n_workers,
+                               salva_storico=True if grafico_densita else 20)
+        riepilogo = riepilogo_da_risultati(risultati, parametri, densita=grafico_densita)
+
+    stampa_statistiche(riepilogo)
+    if modalita_markov:
+        # La catena descrive un solo strumento con esiti nominali e streak indipendenti dal capitale
+        try:
+            if strumenti is not None:
+                raise ValueError("il portafoglio non è descritto dalla catena di un solo strumento")
+            stampa_confronto_markov(riepilogo, risolvi_markov(parametri))
+        except ValueError as errore:
+            print(f"\nSoluzione esatta non applicabile: {errore}")
+    disegna_grafici(riepilogo, punti_curve)
+    plt.show()
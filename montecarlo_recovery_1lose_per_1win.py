@@ -1,7 +1,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from collections import defaultdict
-from scipy.stats import norm
+from montecarlo_parallelo import esegui_parallelo
+from montecarlo_jit import esegui_parallelo_jit
+from montecarlo_streaming import simula_streaming, ventaglio_da_storico, statistiche_sott_acqua, QUANTILI_VENTAGLIO
+from montecarlo_convergenza import simula_adattiva, stampa_convergenza
+from montecarlo_streak import streak_piu_lunga
+from montecarlo_archivio import simula_su_disco, apri_archivio, evoluzione_media
+from montecarlo_esatto import risolvi_reticolo, statistiche_esatte
+from montecarlo_grafici import densita_risultati, densita_da_istogramma, disegna_densita, disegna_curve
+from montecarlo_qmc import stima_qmc, stampa_qmc
 
 # Parametri di simulazione
 n_simulazioni = 10000
@@ -12,140 +19,257 @@ stop_loss_ticks = 15
 take_profit_ticks = 20
 win_rate = 0.60
 capitale_iniziale = 600
+regimi = None  # esiti a regimi nascosti, vedi montecarlo_regimi (None = trade indipendenti)
+modello_esiti = None  # slippage, commissioni variabili e uscite a tempo, vedi montecarlo_esiti (None = esiti nominali)
+modalita_esatta = False  # True: distribuzione esatta sul reticolo invece delle simulazioni (le altre modalità si ignorano)
+seed = None  # seme principale: a parità di seme i risultati sono identici
+n_workers = None  # processi da usare (None = tutti i core)
+motore_jit = False  # True: kernel compilato con Numba (montecarlo_jit), stessi percorsi; senza Numba motore NumPy
+modalita_streaming = False  # True: solo statistiche aggregate, memoria costante in n_simulazioni
+modalita_adattiva = False  # True: n_simulazioni scelto finché gli intervalli di confidenza sono stretti abbastanza
+obiettivi_convergenza = {'prob_bancarotta': 0.005, 'capitale_medio': 50.0, 'drawdown_medio': 20.0}
+max_simulazioni_adattive = 100_000
+cartella_curve = None  # cartella: tutte le curve su disco (float32 mappato in memoria) invece che in RAM
+curve_da_disegnare = 500  # con cartella_curve, curve lette dal disco per il grafico
+grafico_densita = True  # True: tutte le curve come immagine di densità, tempo di disegno indipendente da n_simulazioni
+curve_evidenziate = 20  # con grafico_densita, curve disegnate sopra la densità
+punti_curve = 500  # punti per curva disegnata (sottocampionamento LTTB), None = tutti
+modalita_qmc = False  # True: solo stime con Sobol scramblato e Monte Carlo semplice, stesso budget, senza grafici
+repliche_qmc = 16  # repliche indipendenti per gli errori standard (n_simulazioni / repliche_qmc percorsi ciascuna)
 
-def simula_trade(n_contratti):
-    """Simula un trade con commissioni e stop fissi"""
-    is_win = np.random.rand() < win_rate
-    ticks = take_profit_ticks if is_win else -stop_loss_ticks
-    profitto = ticks * valore_tick * n_contratti
-    commissione = 2 * commissione_per_contratto * n_contratti
-    return profitto - commissione, is_win
-
-def max_drawdown(equity_curve):
-    """Calcola il drawdown massimo"""
-    running_max = np.maximum.accumulate(equity_curve)
-    return np.max(running_max - equity_curve)
-
-def run_simulazione():
-    """Esegue una simulazione completa"""
-    capitale = capitale_iniziale
-    storico = [capitale]
-    stats = {
-        'trade_totali': 0,
-        'win_count': 0,
-        'loss_count': 0,
-        'somma_wins': 0.0,
-        'somma_losses': 0.0,
-        'losing_streaks': [],
-        'current_streak': 0,
-        'tick_loss_accumulati': 0
+parametri = {
+    'n_scambi': n_scambi,
+    'commissione_per_contratto': commissione_per_contratto,
+    'valore_tick': valore_tick,
+    'stop_loss_ticks': stop_loss_ticks,
+    'take_profit_ticks': take_profit_ticks,
+    'win_rate': win_rate,
+    'max_contratti': 1,
+    'dimensionamento': 'fisso',  # Sempre 1 contratto
+    'contratti_iniziali': 1,
+    'capitale_iniziale': capitale_iniziale,
+    'regimi': regimi,
+    'modello_esiti': modello_esiti,
+}
+
+
+def soluzione_esatta(parametri):
+    """
+    Soluzione esatta sul reticolo (montecarlo_esatto), con i quantili del ventaglio,
+    None se non è applicabile: dimensionamento senza contratti fissi, esiti a regimi o
+    con un modello_esiti (slippage, commissioni variabili e uscite a tempo non stanno
+    sul reticolo).
+    """
+    try:
+        return risolvi_reticolo(parametri, QUANTILI_VENTAGLIO)
+    except ValueError:
+        return None
+
+
+def riepilogo_esatto(esatta, parametri, n_simulazioni):
+    """
+    Riepilogo senza simulazioni dalla soluzione esatta: distribuzione finale, evoluzione
+    media e tempi di bancarotta esatti (i conteggi sono quelli attesi su n_simulazioni).
+    """
+    return {
+        'stat_globali': statistiche_esatte(esatta, parametri['capitale_iniziale'], n_simulazioni),
+        'evoluzione_media_capitale': esatta['evoluzione_media'],
+        'ventaglio': esatta['quantili_passi'],
+        'storici_allineati': [],
+        'densita_curve': None,
+        'istogramma_capitale': None,
+        'esatta': esatta,
     }
 
-    for _ in range(n_scambi):
-        stats['trade_totali'] += 1
-        risultato, is_win = simula_trade(1)  # Sempre 1 contratto
-        
-        capitale += risultato
-        storico.append(capitale)
-        
-        if is_win:
-            stats['win_count'] += 1
-            stats['somma_wins'] += risultato
-            if stats['current_streak'] > 0:
-                stats['losing_streaks'].append({
-                    'length': stats['current_streak'],
-                    'tick_loss': stats['tick_loss_accumulati']
-                })
-                stats['current_streak'] = 0
-                stats['tick_loss_accumulati'] = 0
-        else:
-            stats['loss_count'] += 1
-            stats['somma_losses'] += risultato
-            stats['current_streak'] += 1
-            stats['tick_loss_accumulati'] += stop_loss_ticks
-        
-        if capitale <= 0:
-            break
-
-    if stats['current_streak'] > 0:
-        stats['losing_streaks'].append({
-            'length': stats['current_streak'],
-            'tick_loss': stats['tick_loss_accumulati']
-        })
 
+def riepilogo_da_risultati(risultati, parametri, n_curve=None, densita=False, esatta=None):
+    """
+    Statistiche e curve per la stampa e i grafici a partire dai risultati per
+    simulazione (esegui_parallelo o un file salvato da montecarlo_cli.py).
+    Con densita=True tutto lo storico finisce nell'immagine di densità delle curve.
+    esatta è la soluzione di soluzione_esatta, se già calcolata.
+    """
+    capitale_iniziale = parametri['capitale_iniziale']
+    capitali_finali = risultati['capitale_finale']
+    drawdowns = risultati['drawdown_massimo']
+    n_simulazioni = len(capitali_finali)
+    streak_massime = streak_piu_lunga(risultati['losing_streaks'], n_simulazioni)
+
+    # Lo storico del motore è già allineato: NaN dopo la bancarotta.
+    # Se i risultati contengono solo alcune curve, l'evoluzione media arriva già calcolata su tutte.
+    storici_allineati = risultati['storico_saldo'][:n_curve]
+    evoluzione_media_capitale = risultati.get('evoluzione_media')
+    if evoluzione_media_capitale is None:
+        evoluzione_media_capitale = np.nanmean(risultati['storico_saldo'], axis=0)
+    # Percentili per passo con istogrammi a bin fissi, senza ordinare lo storico
+    ventaglio = risultati.get('ventaglio')
+    if ventaglio is None:
+        ventaglio = ventaglio_da_storico(risultati['storico_saldo'])
+
+    stat_globali = {
+        'capitale_medio': np.mean(capitali_finali),
+        'capitale_mediano': np.median(capitali_finali),
+        'varianza': np.var(capitali_finali),
+        'dev_std': np.std(capitali_finali),
+        'q1': np.percentile(capitali_finali, 25),
+        'q3': np.percentile(capitali_finali, 75),
+        'max': np.max(capitali_finali),
+        'min': np.min(capitali_finali),
+        'drawdown_medio': np.mean(drawdowns),
+        'prob_bancarotta': np.sum(capitali_finali <= 0) / n_simulazioni,
+        'sotto_capitale_iniziale': np.sum(capitali_finali < capitale_iniziale),
+        'streak_perdente_media': np.mean(streak_massime),
+        'streak_perdente_max': int(streak_massime.max(initial=0)),
+        **statistiche_sott_acqua(risultati),
+    }
     return {
-        'capitale_finale': capitale,
-        'storico_saldo': storico,
-        'drawdown_massimo': max_drawdown(np.array(storico)),
-        'stats': stats
+        'stat_globali': stat_globali,
+        'evoluzione_media_capitale': evoluzione_media_capitale,
+        'ventaglio': ventaglio,
+        'storici_allineati': storici_allineati,
+        'densita_curve': densita_risultati(risultati) if densita else None,
+        'istogramma_capitale': np.histogram(capitali_finali, bins=50),
+        'esatta': soluzione_esatta(parametri) if esatta is None else esatta,
     }
 
-# Esecuzione simulazioni
-risultati = [run_simulazione() for _ in range(n_simulazioni)]
-
-# Estrazione dati
-capitali_finali = [r['capitale_finale'] for r in risultati]
-drawdowns = [r['drawdown_massimo'] for r in risultati]
-tutti_streaks = [streak for res in risultati for streak in res['stats']['losing_streaks']]
-
-# Calcolo evoluzione media del capitale
-lunghezza_massima = max(len(r['storico_saldo']) for r in risultati)
-storici_allineati = np.zeros((n_simulazioni, lunghezza_massima))
-storici_allineati.fill(np.nan)
-for i, r in enumerate(risultati):
-    storici_allineati[i, :len(r['storico_saldo'])] = r['storico_saldo']
-
-evoluzione_media_capitale = np.nanmean(storici_allineati, axis=0)
-
-# Calcolo statistiche
-stat_globali = {
-    'capitale_medio': np.mean(capitali_finali),
-    'capitale_mediano': np.median(capitali_finali),
-    'varianza': np.var(capitali_finali),
-    'dev_std': np.std(capitali_finali),
-    'q1': np.percentile(capitali_finali, 25),
-    'q3': np.percentile(capitali_finali, 75),
-    'max': np.max(capitali_finali),
-    'min': np.min(capitali_finali),
-    'drawdown_medio': np.mean(drawdowns),
-    'prob_bancarotta': sum(1 for c in capitali_finali if c <= 0) / n_simulazioni,
-    'sotto_capitale_iniziale': sum(1 for c in capitali_finali if c < capitale_iniziale)
-}
 
-# Stampa delle statistiche
-print("Statistiche Globali:")
-for k, v in stat_globali.items():
-    print(f"{k}: {v}")
-
-# Visualizzazione
-plt.figure(figsize=(18, 10))
-
-# Grafico 1: Distribuzione capitali
-plt.subplot(2, 2, 1)
-plt.hist(capitali_finali, bins=50, density=True, alpha=0.7)
-x = np.linspace(min(capitali_finali), max(capitali_finali), 100)
-plt.plot(x, norm.pdf(x, stat_globali['capitale_medio'], stat_globali['dev_std']), 'r--')
-plt.title('Distribuzione Capitali Finali')
-plt.xlabel('Capitale ($)')
-plt.ylabel('Densità')
-
-# Grafico 2: Evoluzione media del capitale
-plt.subplot(2, 2, 2)
-plt.plot(evoluzione_media_capitale, label='Evoluzione Media Capitale', color='b')
-plt.title('Evoluzione Media del Capitale')
-plt.xlabel('Numero di Scambi')
-plt.ylabel('Capitale Medio ($)')
-plt.legend()
-
-# Grafico 3: Andamento della simulazione per ogni scambio
-plt.subplot(2, 1, 2)
-for storico in storici_allineati:
-    plt.plot(storico, color='gray', alpha=0.1)
-plt.plot(evoluzione_media_capitale, color='blue', linewidth=2, label='Media')
-plt.title('Andamento della Simulazione per Ogni Scambio')
-plt.xlabel('Numero di Scambi')
-plt.ylabel('Capitale ($)')
-plt.legend()
-
-plt.tight_layout()
-plt.show()
+def riepilogo_da_accumulatore(accumulatore, parametri, densita=False, esatta=None):
+    """Lo stesso riepilogo di riepilogo_da_risultati, da un AccumulatoreStreaming."""
+    stat_globali = accumulatore.statistiche()
+    stat_globali['streak_perdente_max'] = int(accumulatore.tabella_streak()['length'].max(initial=0))
+    return {
+        'stat_globali': stat_globali,
+        'evoluzione_media_capitale': np.where(accumulatore.passi.n > 0, accumulatore.passi.media, np.nan),
+        'ventaglio': accumulatore.ventaglio(),
+        'storici_allineati': accumulatore.campione.curve,
+        'densita_curve': densita_da_istogramma(accumulatore.quantili_passi) if densita else None,
+        'istogramma_capitale': (accumulatore.quantili_capitale.conteggi[0], accumulatore.quantili_capitale.bordi()),
+        'esatta': soluzione_esatta(parametri) if esatta is None else esatta,
+    }
+
+
+def stampa_statistiche(riepilogo):
+    print("Statistiche Globali:")
+    for k, v in riepilogo['stat_globali'].items():
+        print(f"{k}: {v}")
+    if 'tempo_recupero_medio' not in riepilogo['stat_globali']:
+        # Riepilogo esatto: il reticolo dà la distribuzione del capitale, non i percorsi
+        print("Tempi sott'acqua e di recupero: solo con le simulazioni (modalita_esatta = False)")
+
+
+def disegna_grafici(riepilogo, punti_curve=None):
+    """Disegna i grafici del riepilogo e restituisce la figura (curve sottocampionate a punti_curve punti)."""
+    evoluzione_media_capitale = riepilogo['evoluzione_media_capitale']
+    esatta = riepilogo['esatta']
+
+    # Visualizzazione
+    figura = plt.figure(figsize=(18, 10))
+
+    # Grafico 1: Distribuzione capitali
+    plt.subplot(2, 2, 1)
+    if riepilogo['istogramma_capitale'] is not None:
+        conteggi_capitale, bordi_capitale = riepilogo['istogramma_capitale']
+        plt.hist(bordi_capitale[:-1], bins=bordi_capitale, weights=conteggi_capitale, density=True, alpha=0.7)
+    if esatta is not None:
+        # Probabilità dei punti del reticolo divisa per il loro passo: confrontabile con la densità.
+        # La bancarotta è una massa concentrata sotto lo zero: va nella legenda
+        visibili = esatta['probabilita'] > 1e-9
+        plt.plot(esatta['capitali'][visibili], esatta['probabilita'][visibili] / esatta['passo_reticolo'], 'r--',
+                 label=f"Esatta (bancarotta {esatta['prob_bancarotta']:.2%})")
+        plt.legend()
+    plt.title('Distribuzione Capitali Finali')
+    plt.xlabel('Capitale ($)')
+    plt.ylabel('Densità')
+
+    # Grafico 2: Evoluzione media del capitale, con le bande dei percentili 5-95 e 25-75 e la mediana
+    plt.subplot(2, 2, 2)
+    p5, p25, p50, p75, p95 = riepilogo['ventaglio']
+    passi = np.arange(len(p50))
+    plt.fill_between(passi, p5, p95, color='b', alpha=0.15, label='Percentili 5-95')
+    plt.fill_between(passi, p25, p75, color='b', alpha=0.3, label='Percentili 25-75')
+    plt.plot(p50, color='b', linestyle=':', label='Mediana')
+    plt.plot(evoluzione_media_capitale, label='Evoluzione Media Capitale', color='b')
+    plt.title('Evoluzione del Capitale: Media e Percentili')
+    plt.xlabel('Numero di Scambi')
+    plt.ylabel('Capitale ($)')
+    plt.legend()
+
+    # Grafico 3: Andamento della simulazione per ogni scambio
+    plt.subplot(2, 1, 2)
+    if riepilogo['densita_curve'] is not None:
+        # Tutte le curve come immagine, più poche curve evidenziate
+        plt.colorbar(disegna_densita(riepilogo['densita_curve']), label='Simulazioni')
+        disegna_curve(riepilogo['storici_allineati'], n_punti=punti_curve, color='orange', linewidth=0.8, alpha=0.7)
+    elif len(riepilogo['storici_allineati']) > 0:
+        disegna_curve(riepilogo['storici_allineati'], n_punti=punti_curve, color='gray', alpha=0.1)
+    if riepilogo['densita_curve'] is not None or len(riepilogo['storici_allineati']) > 0:
+        plt.plot(evoluzione_media_capitale, color='blue', linewidth=2, label='Media')
+        plt.title('Andamento della Simulazione per Ogni Scambio')
+        plt.xlabel('Numero di Scambi')
+        plt.ylabel('Capitale ($)')
+        plt.legend()
+    else:
+        # Senza curve simulate: probabilità esatta di essere falliti entro ogni trade
+        plt.plot(np.cumsum(esatta['tempi_bancarotta']), color='red')
+        plt.title('Probabilità di Bancarotta Entro Ogni Scambio')
+        plt.xlabel('Numero di Scambi')
+        plt.ylabel('Probabilità')
+
+    plt.tight_layout()
+    return figura
+
+
+if __name__ == "__main__":
+    # Una sola volta per esecuzione: serve alla modalità esatta, al confronto QMC e ai grafici
+    esatta = soluzione_esatta(parametri)
+    # Percorsi per replica QMC: la potenza di 2 più vicina a n_simulazioni / repliche_qmc
+    percorsi_replica = 2 ** max(0, round(np.log2(n_simulazioni / repliche_qmc)))
+    usa_qmc = modalita_qmc and parametri['regimi'] is None
+    if modalita_qmc and not usa_qmc:
+        print("Quasi-Monte Carlo non applicabile con i regimi: si simula")
+    usa_esatta = not usa_qmc and modalita_esatta and esatta is not None
+    if modalita_esatta and not usa_qmc and not usa_esatta:
+        print("Soluzione esatta non applicabile a questi parametri: si simula")
+    if usa_qmc:
+        # Solo il confronto tra QMC e Monte Carlo semplice: niente riepilogo né grafici
+        stampa_qmc(stima_qmc(percorsi_replica, repliche_qmc, parametri, seed=seed, n_workers=n_workers),
+                   statistiche_esatte(esatta, capitale_iniziale, percorsi_replica * repliche_qmc)
+                   if esatta is not None else None)
+        riepilogo = None
+    elif usa_esatta:
+        # Con 1 contratto fisso la distribuzione si calcola esattamente: niente simulazioni
+        riepilogo = riepilogo_esatto(esatta, parametri, n_simulazioni)
+    elif modalita_streaming:
+        # Statistiche accumulate shard per shard, senza la matrice completa degli storici
+        riepilogo = riepilogo_da_accumulatore(simula_streaming(n_simulazioni, parametri, seed=seed, n_workers=n_workers,
+                                                               n_campioni=curve_evidenziate),
+                                              parametri, densita=grafico_densita, esatta=esatta)
+    else:
+        # Esecuzione simulazioni (shard su più processi con il motore vettoriale)
+        if modalita_adattiva:
+            # Solo le curve da disegnare: evoluzione media, ventaglio e densità arrivano già calcolati su tutte
+            risultati, convergenza = simula_adattiva(parametri, obiettivi_convergenza, seed=seed, n_workers=n_workers,
+                                                     max_simulazioni=max_simulazioni_adattive,
+                                                     salva_storico=curve_evidenziate if grafico_densita
+                                                     else curve_da_disegnare)
+            stampa_convergenza(convergenza)
+        elif cartella_curve is not None:
+            # Le curve restano sul disco: si leggono solo l'evoluzione media (a blocchi) e le curve da disegnare
+            risultati = simula_su_disco(cartella_curve, n_simulazioni, parametri, seed=seed, n_workers=n_workers)
+            curve = apri_archivio(cartella_curve)['curve']
+            risultati['storico_saldo'] = curve
+            risultati['evoluzione_media'] = evoluzione_media(curve)
+        else:
+            esegui = esegui_parallelo_jit if motore_jit else esegui_parallelo
+            risultati = esegui(n_simulazioni, parametri, seed=seed, n_workers=n_workers, salva_storico=True)
+        if grafico_densita:
+            n_curve = curve_evidenziate
+        else:
+            n_curve = curve_da_disegnare if cartella_curve is not None else None
+        riepilogo = riepilogo_da_risultati(risultati, parametri, n_curve=n_curve, densita=grafico_densita,
+                                           esatta=esatta)
+
+    if riepilogo is not None:
+        stampa_statistiche(riepilogo)
+        disegna_grafici(riepilogo, punti_curve)
+        plt.show()
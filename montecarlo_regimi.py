@@ -0,0 +1,120 @@
+import numpy as np
+
+# Modello a regimi nascosti (catena di Markov) per gli esiti dei trade, attivato da
+# parametri['regimi'] nel motore:
+#
+#     'regimi': {
+#         'win_rate': [0.60, 0.40],                    # win rate di ogni regime
+#         'transizioni': [[0.95, 0.05], [0.10, 0.90]],  # P(regime j al trade dopo | regime i)
+#         'iniziale': [0.5, 0.5],                      # facoltativo, default: distribuzione stazionaria
+#     }
+#
+# Il regime di ogni percorso cambia trade per trade secondo le transizioni e il trade è
+# vincente con il win rate del regime: le vincite e le perdite si raggruppano.
+
+
+def distribuzione_stazionaria(transizioni):
+    """Distribuzione dei regimi che le transizioni lasciano invariata (pi @ P = pi)."""
+    transizioni = np.asarray(transizioni, dtype=np.float64)
+    n_regimi = len(transizioni)
+    sistema = np.vstack([transizioni.T - np.eye(n_regimi), np.ones(n_regimi)])
+    termini = np.zeros(n_regimi + 1)
+    termini[-1] = 1.0
+    return np.linalg.lstsq(sistema, termini, rcond=None)[0]
+
+
+def prepara_regimi(regimi):
+    """
+    Controlla la descrizione dei regimi e restituisce un dizionario con 'win_rate'
+    (array) e 'cumulate', le probabilità di transizione cumulate per riga con in
+    fondo una riga in più per la distribuzione iniziale: lo stato di partenza dei
+    percorsi è il regime fittizio len(win_rate).
+    """
+    win_rate = np.asarray(regimi['win_rate'], dtype=np.float64)
+    transizioni = np.asarray(regimi['transizioni'], dtype=np.float64)
+    n_regimi = len(win_rate)
+    if transizioni.shape != (n_regimi, n_regimi):
+        raise ValueError(f"La matrice delle transizioni deve essere {n_regimi}x{n_regimi}")
+    if np.any(transizioni < 0) or not np.allclose(transizioni.sum(axis=1), 1):
+        raise ValueError("Ogni riga delle transizioni deve contenere probabilità con somma 1")
+    if np.any((win_rate < 0) | (win_rate > 1)):
+        raise ValueError("I win rate dei regimi devono essere tra 0 e 1")
+    iniziale = regimi.get('iniziale')
+    iniziale = distribuzione_stazionaria(transizioni) if iniziale is None else np.asarray(iniziale, dtype=np.float64)
+    if len(iniziale) != n_regimi:
+        raise ValueError(f"La distribuzione iniziale deve avere {n_regimi} elementi")
+    return {'win_rate': win_rate, 'cumulate': np.cumsum(np.vstack([transizioni, iniziale]), axis=1)}
+
+
+def stato_iniziale_regimi(n_simulazioni, preparati):
+    """Regime corrente di n_simulazioni percorsi all'inizio: lo stato di partenza fittizio."""
+    return np.full(n_simulazioni, len(preparati['win_rate']), dtype=np.intp)
+
+
+def estrai_regimi(regime, n_passi, preparati, rng):
+    """
+    Regimi dei prossimi n_passi trade di tutti i percorsi, matrice (n_passi, n_percorsi).
+    regime (un elemento per percorso, regime dell'ultimo trade) viene aggiornato.
+    Ogni passo costa poche operazioni su array, come un passo del motore.
+    """
+    # Una colonna di soglie per ogni regime tranne l'ultimo: np.take su vettori è più
+    # veloce dell'indicizzazione di una matrice con una riga per percorso
+    soglie = [np.ascontiguousarray(colonna) for colonna in preparati['cumulate'][:, :-1].T]
+    casuali = rng.random((n_passi, len(regime)))
+    regimi = np.empty((n_passi, len(regime)), dtype=np.intp)
+    for t, riga in enumerate(casuali):
+        # Il nuovo regime è il numero di soglie cumulate della riga del regime attuale superate
+        nuovo = regimi[t]
+        nuovo[...] = riga >= np.take(soglie[0], regime)
+        for colonna in soglie[1:]:
+            nuovo += riga >= np.take(colonna, regime)
+        regime[...] = nuovo
+    return regimi
+
+
+def scarti_regimi(preparati, win_rate):
+    """
+    Scarto da aggiungere al numero casuale u di un trade in ogni regime: il motore
+    confronta con il win_rate dei parametri, e u + win_rate - p < win_rate equivale
+    a u < p, il win rate del regime.
+    """
+    return win_rate - preparati['win_rate']
+
+
+def genera_uniformi_regimi(n_simulazioni, n_scambi, regimi, win_rate, rng):
+    """
+    Come montecarlo_motore.genera_uniformi, ma con gli esiti a regimi: matrice
+    (n_simulazioni, n_scambi) da passare a simula_batch (uniformi=...) con lo stesso
+    win_rate nei parametri. I valori vanno solo confrontati con win_rate (possono
+    uscire da [0, 1)).
+    """
+    preparati = prepara_regimi(regimi)
+    uniformi = rng.random((n_simulazioni, n_scambi))
+    regime = stato_iniziale_regimi(n_simulazioni, preparati)
+    uniformi += scarti_regimi(preparati, win_rate)[estrai_regimi(regime, n_scambi, preparati, rng).T]
+    return uniformi
+
+
+def win_rate_medio(regimi):
+    """Win rate di lungo periodo: media dei win rate dei regimi pesata con la distribuzione stazionaria."""
+    return float(distribuzione_stazionaria(regimi['transizioni']) @ np.asarray(regimi['win_rate'], dtype=np.float64))
+
+
+if __name__ == "__main__":
+    import time
+
+    from montecarlo_parallelo import esegui_parallelo
+    from montecarlo_streak import streak_piu_lunga
+
+    regimi = {'win_rate': [0.62, 0.38], 'transizioni': [[0.97, 0.03], [0.06, 0.94]]}
+    win_rate = win_rate_medio(regimi)
+    n_simulazioni = 20000
+    print(f"Win rate medio dei regimi: {win_rate:.4f}, lo stesso usato per gli esiti iid di confronto")
+    for nome, parametri in (('iid', {}), ('regimi', {'regimi': regimi})):
+        inizio = time.perf_counter()
+        risultati = esegui_parallelo(n_simulazioni, {'win_rate': win_rate, **parametri}, seed=0)
+        durata = time.perf_counter() - inizio
+        streak = streak_piu_lunga(risultati['losing_streaks'], n_simulazioni)
+        print(f"{nome:<7} | bancarotta {np.mean(risultati['capitale_finale'] <= 0):.2%} | "
+              f"streak massima media {streak.mean():.1f} | drawdown medio {risultati['drawdown_massimo'].mean():,.0f} | "
+              f"{durata:.2f} s")
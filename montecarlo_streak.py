@@ -0,0 +1,81 @@
+import numpy as np
+
+
+def rle_streak(vincite, stop_loss_ticks, contratti=None, giocati=None):
+    """
+    Trova tutte le losing streak di una matrice di esiti (simulazioni x trade) con
+    run-length encoding, senza cicli sui trade.
+      - vincite: matrice booleana, True per i trade vincenti;
+      - stop_loss_ticks: tick persi per contratto in ogni trade perdente;
+      - contratti: matrice dei contratti usati in ogni trade (default 1);
+      - giocati: matrice booleana dei trade effettivamente eseguiti (False dopo la
+        bancarotta); di default tutti.
+    Restituisce array piatti, una riga per streak: 'simulazione', 'inizio', 'length',
+    'max_contratti' e 'tick_loss_totali' (stop_loss_ticks * contratti sommati sulla streak).
+    """
+    vincite = np.asarray(vincite, dtype=bool)
+    n_simulazioni, n_scambi = vincite.shape
+    perdite = ~vincite if giocati is None else ~vincite & giocati
+    if contratti is None:
+        contratti = np.ones(vincite.shape, dtype=np.int64)
+
+    # Una colonna False in fondo separa le righe: nessuna streak attraversa due simulazioni
+    larghezza = n_scambi + 1
+    bordo = np.zeros((n_simulazioni, 1), dtype=bool)
+    piatto = np.concatenate([perdite, bordo], axis=1).ravel()
+    salti = np.diff(piatto.view(np.int8), prepend=np.int8(0))
+    inizi = np.flatnonzero(salti == 1)
+    fini = np.flatnonzero(salti == -1)
+
+    contratti_piatti = np.concatenate([contratti, np.zeros((n_simulazioni, 1), dtype=contratti.dtype)], axis=1).ravel()
+    if len(inizi) > 0:
+        max_contratti = np.maximum.reduceat(contratti_piatti, np.column_stack([inizi, fini]).ravel())[::2]
+    else:
+        max_contratti = np.zeros(0, dtype=contratti_piatti.dtype)
+    tick_cumulati = np.concatenate([[0], np.cumsum(contratti_piatti * piatto)])
+
+    return {
+        'simulazione': inizi // larghezza,
+        'inizio': inizi % larghezza,
+        'length': fini - inizi,
+        'max_contratti': max_contratti,
+        'tick_loss_totali': stop_loss_ticks * (tick_cumulati[fini] - tick_cumulati[inizi]),
+    }
+
+
+def streak_piu_lunga(streaks, n_simulazioni):
+    """Lunghezza della losing streak più lunga di ogni simulazione (0 se nessuna)."""
+    piu_lunga = np.zeros(n_simulazioni, dtype=np.int64)
+    np.maximum.at(piu_lunga, streaks['simulazione'], streaks['length'])
+    return piu_lunga
+
+
+def tabella_streak(streaks):
+    """
+    Statistiche per lunghezza delle losing streak (array piatti come quelli del motore
+    o di rle_streak). Restituisce array allineati, solo per le lunghezze presenti:
+    'length', 'count', 'contratti_avg', 'contratti_max', 'contratti_min', 'tick_loss_avg'.
+    """
+    lunghezze = np.asarray(streaks['length'])
+    contratti = np.asarray(streaks['max_contratti'])
+    conteggi = np.bincount(lunghezze)
+    presenti = np.flatnonzero(conteggi)
+
+    # Ordinando per lunghezza ogni gruppo è un intervallo contiguo: min e max con reduceat
+    ordine = np.argsort(lunghezze, kind='stable')
+    inizi_gruppi = np.concatenate([[0], np.cumsum(conteggi[presenti])[:-1]]).astype(np.int64)
+    contratti_ordinati = contratti[ordine]
+    if len(presenti) > 0:
+        contratti_max = np.maximum.reduceat(contratti_ordinati, inizi_gruppi)
+        contratti_min = np.minimum.reduceat(contratti_ordinati, inizi_gruppi)
+    else:
+        contratti_max = contratti_min = np.zeros(0, dtype=contratti.dtype)
+
+    return {
+        'length': presenti,
+        'count': conteggi[presenti],
+        'contratti_avg': np.bincount(lunghezze, contratti)[presenti] / conteggi[presenti],
+        'contratti_max': contratti_max,
+        'contratti_min': contratti_min,
+        'tick_loss_avg': np.bincount(lunghezze, streaks['tick_loss_totali'])[presenti] / conteggi[presenti],
+    }
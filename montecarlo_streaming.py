@@ -0,0 +1,409 @@
+import warnings
+
+import numpy as np
+
+from montecarlo_motore import PARAMETRI_DEFAULT, simula_batch
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard
+
+# Numero di bin degli istogrammi usati per i quantili
+N_BIN = 256
+
+# Percentili delle bande del grafico a ventaglio del capitale
+QUANTILI_VENTAGLIO = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class Momenti:
+    """
+    Media, varianza, minimo e massimo per colonna, aggiornati un batch alla volta
+    (formula di Chan per unire due gruppi). I NaN (percorsi già falliti) sono ignorati.
+    """
+
+    def __init__(self, n_colonne):
+        self.n = np.zeros(n_colonne, dtype=np.int64)
+        self.media = np.zeros(n_colonne)
+        self.m2 = np.zeros(n_colonne)
+        self.minimo = np.full(n_colonne, np.inf)
+        self.massimo = np.full(n_colonne, -np.inf)
+
+    def _unisci(self, n_b, media_b, m2_b, minimo_b, massimo_b):
+        n = self.n + n_b
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = media_b - self.media
+            quota_b = np.where(n > 0, n_b / np.maximum(n, 1), 0.0)
+            self.media = np.where(n_b > 0, self.media + delta * quota_b, self.media)
+            self.m2 = np.where(n_b > 0, self.m2 + m2_b + delta ** 2 * self.n * quota_b, self.m2)
+        self.n = n
+        np.fmin(self.minimo, minimo_b, out=self.minimo)
+        np.fmax(self.massimo, massimo_b, out=self.massimo)
+
+    def aggiungi(self, matrice):
+        """matrice ha una riga per percorso e una colonna per grandezza (o passo)."""
+        matrice = np.atleast_2d(matrice)
+        validi = ~np.isnan(matrice)
+        n_b = validi.sum(axis=0)
+        somma = np.where(validi, matrice, 0.0).sum(axis=0)
+        media_b = somma / np.maximum(n_b, 1)
+        m2_b = np.where(validi, (matrice - media_b) ** 2, 0.0).sum(axis=0)
+        minimo_b = np.where(validi, matrice, np.inf).min(axis=0)
+        massimo_b = np.where(validi, matrice, -np.inf).max(axis=0)
+        self._unisci(n_b, media_b, m2_b, minimo_b, massimo_b)
+
+    def unisci(self, altro):
+        self._unisci(altro.n, altro.media, altro.m2, altro.minimo, altro.massimo)
+
+    def varianza(self):
+        """Varianza della popolazione (come np.var), NaN dove non ci sono dati."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.n > 0, self.m2 / self.n, np.nan)
+
+
+class Istogramma:
+    """
+    Istogrammi a bin fissi, uno per colonna, tra minimi e massimi dati.
+    I valori fuori intervallo finiscono nel primo o nell'ultimo bin e vengono contati
+    in 'fuori': se sono molti i quantili nelle code restano schiacciati sui bordi
+    dell'intervallo (vedi quota_fuori e avvisa_fuori_intervallo).
+    Occupa n_colonne * n_bin contatori, qualunque sia il numero di percorsi.
+    """
+
+    def __init__(self, minimi, massimi, n_bin=N_BIN):
+        self.minimi = np.asarray(minimi, dtype=float)
+        self.larghezza = (np.asarray(massimi, dtype=float) - self.minimi) / n_bin
+        self.n_bin = n_bin
+        self.conteggi = np.zeros((len(self.minimi), n_bin), dtype=np.int64)
+        self.fuori = np.zeros(len(self.minimi), dtype=np.int64)
+
+    def aggiungi(self, matrice):
+        matrice = np.atleast_2d(matrice)
+        validi = ~np.isnan(matrice)
+        indici = np.floor((np.where(validi, matrice, 0.0) - self.minimi) / self.larghezza)
+        self.fuori += np.sum(validi & ((indici < 0) | (indici >= self.n_bin)), axis=0)
+        indici = np.clip(indici, 0, self.n_bin - 1).astype(np.int64)
+        indici += np.arange(len(self.minimi)) * self.n_bin
+        self.conteggi += np.bincount(indici[validi], minlength=self.conteggi.size).reshape(self.conteggi.shape)
+
+    def unisci(self, altro):
+        self.conteggi += altro.conteggi
+        self.fuori += altro.fuori
+
+    def quota_fuori(self):
+        """Frazione dei valori di ogni colonna caduti fuori dall'intervallo."""
+        totale = self.conteggi.sum(axis=1)
+        return np.where(totale > 0, self.fuori / np.maximum(totale, 1), 0.0)
+
+    def bordi(self, colonna=0):
+        """Bordi dei bin di una colonna (per disegnare l'istogramma)."""
+        return self.minimi[colonna] + self.larghezza[colonna] * np.arange(self.n_bin + 1)
+
+    def quantili(self, q):
+        """
+        Quantile q (tra 0 e 1) di ogni colonna, interpolando linearmente dentro il bin.
+        La precisione è di circa un bin.
+        """
+        cumulati = np.cumsum(self.conteggi, axis=1)
+        totale = cumulati[:, -1]
+        obiettivo = q * totale
+        indice = np.argmax(cumulati >= obiettivo[:, None], axis=1)
+        righe = np.arange(len(indice))
+        prima = np.where(indice > 0, cumulati[righe, np.maximum(indice - 1, 0)], 0)
+        nel_bin = self.conteggi[righe, indice]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frazione = np.where(nel_bin > 0, (obiettivo - prima) / nel_bin, 0.0)
+        valori = self.minimi + self.larghezza * (indice + frazione)
+        return np.where(totale > 0, valori, np.nan)
+
+
+class CampioneCurve:
+    """
+    Campione casuale uniforme di n_campioni curve (reservoir sampling).
+    Serve per il grafico delle simulazioni campione senza tenere tutte le curve.
+    """
+
+    def __init__(self, n_campioni, n_passi):
+        self.curve = np.full((n_campioni, n_passi), np.nan)
+        self.viste = 0
+
+    def aggiungi(self, matrice, rng):
+        k = len(self.curve)
+        indici = self.viste + np.arange(len(matrice))
+        # Per la curva i-esima (i >= k) si estrae r in [0, i]: se r < k sostituisce la curva r
+        posti = np.where(indici < k, indici, rng.integers(0, indici + 1))
+        for riga, posto in zip(matrice[posti < k], posti[posti < k]):
+            self.curve[posto] = riga
+        self.viste += len(matrice)
+
+    def unisci(self, altro, rng):
+        """Unisce due campioni mantenendo l'uniformità su tutte le curve viste."""
+        k = len(self.curve)
+        n_a, n_b = self.viste, altro.viste
+        m = min(k, n_a + n_b)
+        da_a = rng.hypergeometric(n_a, n_b, m) if n_a and n_b else (m if n_a else 0)
+        scelte_a = rng.choice(min(k, n_a), da_a, replace=False) if da_a else []
+        scelte_b = rng.choice(min(k, n_b), m - da_a, replace=False) if m - da_a else []
+        nuove = np.full_like(self.curve, np.nan)
+        nuove[:m] = np.concatenate([self.curve[scelte_a], altro.curve[scelte_b]])
+        self.curve = nuove
+        self.viste = n_a + n_b
+
+
+def _allarga(minimo, massimo, frazione=0.5):
+    # Colonne senza dati (tutti i percorsi già falliti): intervallo attorno a zero
+    minimo = np.where(np.isfinite(minimo), minimo, 0.0)
+    massimo = np.where(np.isfinite(massimo), massimo, 0.0)
+    margine = (massimo - minimo) * frazione + 1.0
+    return minimo - margine, massimo + margine
+
+
+def limiti_da_batch(risultati):
+    """
+    Calcola gli intervalli degli istogrammi da un primo batch di risultati:
+    min e max osservati, allargati di metà dell'ampiezza per lato. Con un primo batch
+    piccolo i batch successivi possono uscirne nelle code: gli istogrammi li contano
+    (Istogramma.quota_fuori) e avvisa_fuori_intervallo lo segnala.
+    """
+    storico = risultati['storico_saldo']
+    return {
+        'passi': _allarga(np.fmin.reduce(storico, axis=0), np.fmax.reduce(storico, axis=0)),
+        'capitale_finale': _allarga(np.min(risultati['capitale_finale'], keepdims=True),
+                                    np.max(risultati['capitale_finale'], keepdims=True)),
+        'drawdown_massimo': _allarga(np.min(risultati['drawdown_massimo'], keepdims=True),
+                                     np.max(risultati['drawdown_massimo'], keepdims=True)),
+    }
+
+
+def avvisa_fuori_intervallo(istogrammi):
+    """
+    Avvisa (RuntimeWarning) se qualche valore è caduto fuori dagli intervalli fissati
+    dal primo shard: i quantili vicini ai bordi (code del ventaglio, drawdown
+    profondi) sono allora distorti verso l'interno. istogrammi è un dizionario
+    nome -> Istogramma.
+    """
+    for nome, istogramma in istogrammi.items():
+        quota = istogramma.quota_fuori().max(initial=0.0)
+        if quota > 0:
+            warnings.warn(f"Istogramma '{nome}': {quota:.3%} dei valori fuori dall'intervallo fissato dal primo "
+                          f"shard, i quantili nelle code sono spostati verso l'interno (shard più grandi riducono "
+                          f"il problema)", RuntimeWarning, stacklevel=3)
+
+
+def ventaglio_da_storico(storico, quantili=QUANTILI_VENTAGLIO, n_bin=N_BIN, dimensione_blocco=DIMENSIONE_SHARD):
+    """
+    Quantili del capitale dei percorsi attivi a ogni passo, come matrice
+    (len(quantili), n_passi), da una matrice di curve (anche un np.memmap) letta a
+    blocchi di righe: un passaggio per minimi e massimi, uno per gli istogrammi per
+    passo. Non si ordina mai la matrice e la memoria extra è n_passi * n_bin contatori.
+    """
+    minimi = np.full(storico.shape[1], np.inf)
+    massimi = np.full(storico.shape[1], -np.inf)
+    for inizio in range(0, len(storico), dimensione_blocco):
+        blocco = np.asarray(storico[inizio:inizio + dimensione_blocco], dtype=np.float64)
+        np.fmin(minimi, np.fmin.reduce(blocco, axis=0), out=minimi)
+        np.fmax(massimi, np.fmax.reduce(blocco, axis=0), out=massimi)
+    istogramma = Istogramma(*_allarga(minimi, massimi, frazione=0.0), n_bin)
+    for inizio in range(0, len(storico), dimensione_blocco):
+        istogramma.aggiungi(np.asarray(storico[inizio:inizio + dimensione_blocco], dtype=np.float64))
+    return np.array([istogramma.quantili(q) for q in quantili])
+
+
+def _colonne_sott_acqua(risultati):
+    # Una colonna per tempo, in trade; NaN (ignorati da Momenti) dove il percorso non
+    # ha recuperato il drawdown massimo o non è fallito. L'ultima colonna conta solo i
+    # percorsi con un drawdown (mai sott'acqua: niente da recuperare)
+    recupero = risultati['tempo_recupero']
+    bancarotta = risultati['tempo_bancarotta']
+    sott_acqua_max = risultati['tempo_sott_acqua_max']
+    return np.column_stack([sott_acqua_max, risultati['tempo_sott_acqua_medio'],
+                            np.where(recupero >= 0, recupero, np.nan), np.where(bancarotta >= 0, bancarotta, np.nan),
+                            np.where(sott_acqua_max > 0, sott_acqua_max, np.nan)])
+
+
+def _riassumi_sott_acqua(momenti):
+    media = np.where(momenti.n > 0, momenti.media, np.nan)
+    return {
+        'tempo_sott_acqua_max_medio': media[0],
+        'tempo_sott_acqua_max': momenti.massimo[0],
+        'tempo_sott_acqua_medio': media[1],
+        'tempo_recupero_medio': media[2],
+        'quota_recuperati': momenti.n[2] / momenti.n[4] if momenti.n[4] else 0.0,
+        'tempo_medio_bancarotta': media[3],
+    }
+
+
+def statistiche_sott_acqua(risultati):
+    """
+    Tempi sott'acqua di tutte le simulazioni, in trade: periodo sott'acqua più lungo
+    (medio e massimo), durata media dei periodi, tempo medio di recupero dal minimo
+    del drawdown massimo (sui percorsi che lo hanno recuperato; quota_recuperati è la
+    loro frazione tra i percorsi con un drawdown) e tempo medio alla bancarotta (sui
+    percorsi falliti).
+    """
+    momenti = Momenti(5)
+    momenti.aggiungi(_colonne_sott_acqua(risultati))
+    return _riassumi_sott_acqua(momenti)
+
+
+class AccumulatoreStreaming:
+    """
+    Statistiche aggregate delle simulazioni, aggiornate un batch alla volta
+    senza conservare le curve del capitale:
+      - media, varianza e quantili del capitale per ogni passo;
+      - statistiche di capitale finale, drawdown massimo e tempi sott'acqua;
+      - totali dei trade e tabella delle losing streak per lunghezza;
+      - un campione fisso di curve per i grafici.
+    La memoria dipende da n_scambi, n_bin e n_campioni, non dal numero di simulazioni.
+    Gli intervalli degli istogrammi (limiti) restano quelli del primo batch: i valori
+    che ne escono finiscono nei bin estremi e rendono approssimati i quantili nelle code.
+    """
+
+    def __init__(self, capitale_iniziale, limiti, n_campioni=20, n_bin=N_BIN):
+        self.capitale_iniziale = capitale_iniziale
+        self.limiti = limiti
+        n_passi = len(limiti['passi'][0])
+        self.passi = Momenti(n_passi)
+        self.quantili_passi = Istogramma(*limiti['passi'], n_bin)
+        self.capitale_finale = Momenti(1)
+        self.quantili_capitale = Istogramma(*limiti['capitale_finale'], n_bin)
+        self.drawdown = Momenti(1)
+        self.quantili_drawdown = Istogramma(*limiti['drawdown_massimo'], n_bin)
+        self.sott_acqua = Momenti(5)
+        self.campione = CampioneCurve(n_campioni, n_passi)
+        self.totali = {'n_simulazioni': 0, 'bancarotte': 0, 'sotto_capitale_iniziale': 0,
+                       'trade_totali': 0, 'win_count': 0, 'loss_count': 0,
+                       'somma_wins': 0.0, 'somma_losses': 0.0}
+        # Tabella delle losing streak indicizzata per lunghezza
+        self.streak = {'count': np.zeros(1, dtype=np.int64), 'somma_contratti': np.zeros(1),
+                       'contratti_max': np.zeros(1, dtype=np.int64),
+                       'contratti_min': np.full(1, np.iinfo(np.int64).max),
+                       'somma_tick_loss': np.zeros(1)}
+
+    def _allarga_streak(self, lunghezza):
+        attuale = len(self.streak['count'])
+        if lunghezza <= attuale:
+            return
+        for chiave, valori in self.streak.items():
+            riempimento = np.iinfo(np.int64).max if chiave == 'contratti_min' else 0
+            self.streak[chiave] = np.concatenate([valori, np.full(lunghezza - attuale, riempimento, dtype=valori.dtype)])
+
+    def aggiungi(self, risultati, rng):
+        """Aggiunge un batch di risultati di simula_batch (con salva_storico=True)."""
+        storico = risultati['storico_saldo']
+        capitali = risultati['capitale_finale']
+        self.passi.aggiungi(storico)
+        self.quantili_passi.aggiungi(storico)
+        self.capitale_finale.aggiungi(capitali[:, None])
+        self.quantili_capitale.aggiungi(capitali[:, None])
+        self.drawdown.aggiungi(risultati['drawdown_massimo'][:, None])
+        self.quantili_drawdown.aggiungi(risultati['drawdown_massimo'][:, None])
+        self.sott_acqua.aggiungi(_colonne_sott_acqua(risultati))
+        self.campione.aggiungi(storico, rng)
+
+        self.totali['n_simulazioni'] += len(capitali)
+        self.totali['bancarotte'] += int(np.sum(capitali <= 0))
+        self.totali['sotto_capitale_iniziale'] += int(np.sum(capitali < self.capitale_iniziale))
+        for chiave in ('trade_totali', 'win_count', 'loss_count', 'somma_wins', 'somma_losses'):
+            self.totali[chiave] += np.sum(risultati[chiave]).item()
+
+        streaks = risultati['losing_streaks']
+        lunghezze = streaks['length']
+        if len(lunghezze) == 0:
+            return
+        self._allarga_streak(int(lunghezze.max()) + 1)
+        n = len(self.streak['count'])
+        self.streak['count'] += np.bincount(lunghezze, minlength=n)
+        self.streak['somma_contratti'] += np.bincount(lunghezze, streaks['max_contratti'], minlength=n)
+        self.streak['somma_tick_loss'] += np.bincount(lunghezze, streaks['tick_loss_totali'], minlength=n)
+        np.maximum.at(self.streak['contratti_max'], lunghezze, streaks['max_contratti'])
+        np.minimum.at(self.streak['contratti_min'], lunghezze, streaks['max_contratti'])
+
+    def unisci(self, altro, rng):
+        """Unisce un altro accumulatore costruito con gli stessi limiti."""
+        self.passi.unisci(altro.passi)
+        self.quantili_passi.unisci(altro.quantili_passi)
+        self.capitale_finale.unisci(altro.capitale_finale)
+        self.quantili_capitale.unisci(altro.quantili_capitale)
+        self.drawdown.unisci(altro.drawdown)
+        self.quantili_drawdown.unisci(altro.quantili_drawdown)
+        self.sott_acqua.unisci(altro.sott_acqua)
+        self.campione.unisci(altro.campione, rng)
+        for chiave in self.totali:
+            self.totali[chiave] += altro.totali[chiave]
+        self._allarga_streak(len(altro.streak['count']))
+        n = len(altro.streak['count'])
+        for chiave in ('count', 'somma_contratti', 'somma_tick_loss'):
+            self.streak[chiave][:n] += altro.streak[chiave]
+        np.maximum(self.streak['contratti_max'][:n], altro.streak['contratti_max'], out=self.streak['contratti_max'][:n])
+        np.minimum(self.streak['contratti_min'][:n], altro.streak['contratti_min'], out=self.streak['contratti_min'][:n])
+
+    def ventaglio(self, quantili=QUANTILI_VENTAGLIO):
+        """Quantili del capitale dei percorsi attivi a ogni passo, matrice (len(quantili), n_passi)."""
+        return np.array([self.quantili_passi.quantili(q) for q in quantili])
+
+    def statistiche(self):
+        """Statistiche globali, con le stesse chiavi di stat_globali negli script."""
+        n = self.totali['n_simulazioni']
+        return {
+            'capitale_medio': self.capitale_finale.media[0],
+            'capitale_mediano': self.quantili_capitale.quantili(0.5)[0],
+            'varianza': self.capitale_finale.varianza()[0],
+            'dev_std': np.sqrt(self.capitale_finale.varianza()[0]),
+            'q1': self.quantili_capitale.quantili(0.25)[0],
+            'q3': self.quantili_capitale.quantili(0.75)[0],
+            'max': self.capitale_finale.massimo[0],
+            'min': self.capitale_finale.minimo[0],
+            'drawdown_medio': self.drawdown.media[0],
+            'drawdown_max': self.drawdown.massimo[0],
+            'prob_bancarotta': self.totali['bancarotte'] / n if n else 0.0,
+            'sotto_capitale_iniziale': self.totali['sotto_capitale_iniziale'],
+            **self.statistiche_sott_acqua(),
+        }
+
+    def statistiche_sott_acqua(self):
+        """Le stesse statistiche di statistiche_sott_acqua, sulle simulazioni accumulate."""
+        return _riassumi_sott_acqua(self.sott_acqua)
+
+    def tabella_streak(self):
+        """Statistiche delle losing streak per lunghezza, nello stesso formato di montecarlo_streak.tabella_streak."""
+        presenti = np.flatnonzero(self.streak['count'])
+        conteggi = self.streak['count'][presenti]
+        return {
+            'length': presenti,
+            'count': conteggi,
+            'contratti_avg': self.streak['somma_contratti'][presenti] / conteggi,
+            'contratti_max': self.streak['contratti_max'][presenti],
+            'contratti_min': self.streak['contratti_min'][presenti],
+            'tick_loss_avg': self.streak['somma_tick_loss'][presenti] / conteggi,
+        }
+
+
+def _accumula_shard(argomenti):
+    n, parametri, seme, limiti, n_campioni, n_bin = argomenti
+    rng = np.random.default_rng(seme)
+    risultati = simula_batch(n, parametri, rng=rng, salva_storico=True)
+    if limiti is None:
+        limiti = limiti_da_batch(risultati)
+    accumulatore = AccumulatoreStreaming(parametri['capitale_iniziale'], limiti, n_campioni, n_bin)
+    accumulatore.aggiungi(risultati, rng)
+    return accumulatore
+
+
+def simula_streaming(n_simulazioni, parametri=None, seed=None, n_workers=None,
+                     dimensione_shard=DIMENSIONE_SHARD, n_campioni=20, n_bin=N_BIN):
+    """
+    Esegue le simulazioni a shard come esegui_parallelo (stessi semi, stessi percorsi),
+    ma ogni shard viene riassunto in un AccumulatoreStreaming e poi scartato.
+    Il primo shard, eseguito nel processo corrente, fissa gli intervalli degli
+    istogrammi: se gli shard successivi ne escono lo segnala avvisa_fuori_intervallo.
+    """
+    parametri = {**PARAMETRI_DEFAULT, **(parametri or {})}
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard) + 1)
+    rng_unione = np.random.default_rng(semi[-1])
+
+    totale = _accumula_shard((shard[0], parametri, semi[0], None, n_campioni, n_bin))
+    argomenti = [(n, parametri, seme, totale.limiti, n_campioni, n_bin)
+                 for n, seme in zip(shard[1:], semi[1:-1])]
+    for accumulatore in itera_shard(_accumula_shard, argomenti, n_workers):
+        totale.unisci(accumulatore, rng_unione)
+    avvisa_fuori_intervallo({'capitale per passo': totale.quantili_passi, 'capitale finale': totale.quantili_capitale,
+                             'drawdown massimo': totale.quantili_drawdown})
+    return totale
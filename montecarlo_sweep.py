@@ -0,0 +1,158 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+
+import montecarlo_esiti
+import montecarlo_motore
+import montecarlo_regimi
+from montecarlo_motore import PARAMETRI_DEFAULT, simula_batch
+from montecarlo_parallelo import DIMENSIONE_SHARD, pianifica_shard, itera_shard
+
+CARTELLA_CACHE = '.cache_sweep'
+
+# Moduli da cui dipendono i risultati di simula_batch: il motore e quelli che importa
+MODULI_MOTORE = (montecarlo_motore, montecarlo_regimi, montecarlo_esiti)
+
+# Colonne della tabella dei risultati, nell'ordine di stampa
+COLONNE_RISULTATI = ['prob_bancarotta', 'capitale_medio', 'capitale_mediano',
+                     'drawdown_medio', 'drawdown_max', 'sotto_capitale_iniziale']
+
+
+def griglia_parametri(**valori):
+    """
+    Tutte le combinazioni dei valori dati, come lista di dizionari di parametri.
+    Esempio: griglia_parametri(win_rate=[0.5, 0.55], max_contratti=[2, 4]) -> 4 configurazioni.
+    """
+    nomi = list(valori)
+    return [dict(zip(nomi, combinazione)) for combinazione in itertools.product(*valori.values())]
+
+
+def versione_codice():
+    """Hash dei sorgenti di MODULI_MOTORE: se uno di loro cambia, la cache non viene riusata."""
+    hash_codice = hashlib.sha256()
+    for modulo in MODULI_MOTORE:
+        with open(modulo.__file__, 'rb') as f:
+            hash_codice.update(f.read())
+    return hash_codice.hexdigest()[:16]
+
+
+def chiave_cache(parametri, n_simulazioni, seed, dimensione_shard):
+    """
+    Hash di parametri completi, numero di simulazioni, seme e versione del codice.
+    I parametri devono essere serializzabili: una regola di dimensionamento passata
+    come funzione non ha un sorgente che entri nella chiave e viene rifiutata.
+    """
+    funzioni = [nome for nome, valore in parametri.items() if callable(valore)]
+    if funzioni:
+        raise ValueError(f"Lo sweep richiede parametri serializzabili: {', '.join(funzioni)} è una funzione "
+                         f"(per il dimensionamento usare il nome di una regola: "
+                         f"{', '.join(montecarlo_motore.DIMENSIONAMENTI)})")
+    descrizione = {
+        'parametri': parametri,
+        'n_simulazioni': n_simulazioni,
+        'seed': seed,
+        'dimensione_shard': dimensione_shard,
+        'versione': versione_codice(),
+    }
+    return hashlib.sha256(json.dumps(descrizione, sort_keys=True).encode()).hexdigest()
+
+
+def riassumi(capitali_finali, drawdowns, capitale_iniziale):
+    """Riga della tabella dei risultati per una configurazione."""
+    return {
+        'prob_bancarotta': float(np.mean(capitali_finali <= 0)),
+        'capitale_medio': float(np.mean(capitali_finali)),
+        'capitale_mediano': float(np.median(capitali_finali)),
+        'drawdown_medio': float(np.mean(drawdowns)),
+        'drawdown_max': float(np.max(drawdowns)),
+        'sotto_capitale_iniziale': float(np.mean(capitali_finali < capitale_iniziale)),
+    }
+
+
+def _esegui_shard(argomenti):
+    indice, n, parametri, seme = argomenti
+    risultati = simula_batch(n, parametri, rng=np.random.default_rng(seme))
+    return indice, risultati['capitale_finale'], risultati['drawdown_massimo']
+
+
+def esegui_sweep(configurazioni, n_simulazioni, seed=0, n_workers=None,
+                 dimensione_shard=DIMENSIONE_SHARD, cartella_cache=CARTELLA_CACHE):
+    """
+    Esegue n_simulazioni per ogni configurazione (dizionari di parametri, i mancanti
+    presi da PARAMETRI_DEFAULT) e restituisce una riga per configurazione con
+    parametri e risultati.
+    I risultati sono salvati in cartella_cache, uno per file JSON, con chiave
+    chiave_cache(): sweep ripetuti o sovrapposti ricalcolano solo le configurazioni nuove.
+    Gli shard di tutte le configurazioni da calcolare vanno insieme nello stesso pool.
+    Ogni configurazione usa gli stessi semi di esegui_parallelo, quindi le stesse
+    sequenze casuali: i confronti tra configurazioni hanno meno rumore.
+    """
+    configurazioni = [{**PARAMETRI_DEFAULT, **c} for c in configurazioni]
+    os.makedirs(cartella_cache, exist_ok=True)
+    shard = pianifica_shard(n_simulazioni, dimensione_shard)
+    semi = np.random.SeedSequence(seed).spawn(len(shard))
+
+    righe = [None] * len(configurazioni)
+    percorsi = []
+    da_calcolare = []
+    for i, parametri in enumerate(configurazioni):
+        percorso = os.path.join(cartella_cache, chiave_cache(parametri, n_simulazioni, seed, dimensione_shard) + '.json')
+        percorsi.append(percorso)
+        if os.path.exists(percorso):
+            with open(percorso, 'r') as f:
+                righe[i] = json.load(f)
+        else:
+            da_calcolare.append(i)
+
+    argomenti = [(i, n, configurazioni[i], seme) for i in da_calcolare for n, seme in zip(shard, semi)]
+    parziali = {i: ([], []) for i in da_calcolare}
+    for i, capitali, drawdowns in itera_shard(_esegui_shard, argomenti, n_workers):
+        parziali[i][0].append(capitali)
+        parziali[i][1].append(drawdowns)
+        if len(parziali[i][0]) < len(shard):
+            continue
+        parametri = configurazioni[i]
+        capitali, drawdowns = parziali.pop(i)
+        righe[i] = {**parametri, **riassumi(np.concatenate(capitali), np.concatenate(drawdowns),
+                                           parametri['capitale_iniziale'])}
+        with open(percorsi[i], 'w') as f:
+            json.dump(righe[i], f, indent=4)
+    return righe
+
+
+def _cella(valore):
+    # Numeri con 4 cifre significative; stringhe, None e dizionari (regimi, modello_esiti) come testo
+    if isinstance(valore, (int, float)) and not isinstance(valore, bool):
+        return f"{valore:>15.4g}"
+    return f"{valore if isinstance(valore, str) else json.dumps(valore, sort_keys=True):>15}"
+
+
+def stampa_tabella(righe, parametri_variati=None):
+    """Stampa la tabella dello sweep: parametri variati e risultati, una riga per configurazione."""
+    if parametri_variati is None:
+        # Confronto sul JSON: i valori possono essere dizionari o liste, non hashabili
+        parametri_variati = [k for k in PARAMETRI_DEFAULT
+                             if len({json.dumps(r[k], sort_keys=True) for r in righe}) > 1]
+    colonne = parametri_variati + COLONNE_RISULTATI
+    print(" | ".join(f"{c:>15}" for c in colonne))
+    print("-" * (18 * len(colonne)))
+    for riga in righe:
+        print(" | ".join(_cella(riga[c]) for c in colonne))
+
+
+def salva_csv(righe, percorso):
+    """Salva la tabella dello sweep in CSV (una riga per configurazione)."""
+    with open(percorso, 'w', newline='') as f:
+        scrittore = csv.DictWriter(f, fieldnames=list(righe[0]))
+        scrittore.writeheader()
+        scrittore.writerows(righe)
+
+
+if __name__ == "__main__":
+    configurazioni = griglia_parametri(win_rate=[0.50, 0.53, 0.56], max_contratti=[1, 2, 4], n_scambi=[1000])
+    righe = esegui_sweep(configurazioni, n_simulazioni=2000, seed=0)
+    stampa_tabella(righe)
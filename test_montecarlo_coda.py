@@ -0,0 +1,68 @@
+import os
+import time
+
+import numpy as np
+
+import montecarlo_cli
+from montecarlo_cli import SIMULAZIONE_DEFAULT
+from montecarlo_coda import (prepara_lavoro, lavora, lavora_in_parallelo, unisci_lavoro, stato_lavoro, battito,
+                             _identita, _percorso_presa)
+
+SIMULAZIONE = {**SIMULAZIONE_DEFAULT, 'n_simulazioni': 2500, 'seed': 3, 'n_workers': 1, 'dimensione_shard': 500}
+PARAMETRI = {**montecarlo_cli.SCRIPT['recovery'].parametri, 'n_scambi': 300}
+
+
+def confronta(uniti, attesi):
+    assert uniti.keys() == attesi.keys()
+    for campo, valori in attesi.items():
+        if isinstance(valori, dict):
+            confronta(uniti[campo], valori)
+        else:
+            assert np.array_equal(uniti[campo], valori, equal_nan=True), campo
+
+
+def invecchia(percorso, secondi):
+    ora = time.time() - secondi
+    os.utime(percorso, (ora, ora))
+
+
+def test_coda_come_montecarlo_cli(tmp_path):
+    cartella = str(tmp_path / 'lavoro')
+    prepara_lavoro(cartella, SIMULAZIONE, PARAMETRI)
+    eseguite = lavora_in_parallelo(cartella, 3, scadenza=60)
+    assert sum(eseguite) == 4  # la prima unità la esegue prepara_lavoro
+    risultati, _, _ = unisci_lavoro(cartella)
+    confronta(risultati, montecarlo_cli.simula(SIMULAZIONE, PARAMETRI))
+
+
+def test_presa_scaduta_ripresa(tmp_path):
+    cartella = str(tmp_path / 'lavoro')
+    prepara_lavoro(cartella, SIMULAZIONE, PARAMETRI)
+    # Unità 1 presa da un worker morto da tempo, unità 2 da uno ancora vivo
+    for i, eta in ((1, 600), (2, 0)):
+        with open(_percorso_presa(cartella, i), 'w') as f:
+            f.write(f'altro-nodo {i}')
+        invecchia(_percorso_presa(cartella, i), eta)
+
+    assert lavora(cartella, scadenza=60) == 3
+    assert stato_lavoro(cartella) == {'unita': 5, 'completate': 4, 'in_corso': 1}
+    scadute = [nome for nome in os.listdir(os.path.dirname(_percorso_presa(cartella, 1))) if '.scaduta.' in nome]
+    assert len(scadute) == 1 and scadute[0].startswith(os.path.basename(_percorso_presa(cartella, 1)) + '.scaduta.')
+
+    # Quando anche l'ultima presa scade, l'unità si riprende e il lavoro si completa
+    invecchia(_percorso_presa(cartella, 2), 600)
+    assert lavora(cartella, scadenza=60) == 1
+    risultati, _, _ = unisci_lavoro(cartella)
+    confronta(risultati, montecarlo_cli.simula(SIMULAZIONE, PARAMETRI))
+
+
+def test_battito_solo_sulla_propria_presa(tmp_path):
+    presa = str(tmp_path / 'presa')
+    for identita, rinnovata in (('altro-nodo 1', False), (_identita(), True)):
+        with open(presa, 'w') as f:
+            f.write(identita)
+        invecchia(presa, 600)
+        prima = os.path.getmtime(presa)
+        with battito(presa, 0.01):
+            time.sleep(0.1)
+        assert (os.path.getmtime(presa) > prima) == rinnovata
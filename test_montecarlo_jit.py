@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from montecarlo_jit import NUMBA_DISPONIBILE, verifica_parita, simula_batch_jit, esegui_parallelo_jit, misura_velocita
+from montecarlo_motore import PARAMETRI_DEFAULT, DIMENSIONAMENTI, simula_batch
+from montecarlo_parallelo import esegui_parallelo
+
+
+def confronta_risultati(jit, numpy):
+    # Stessi percorsi: cambia solo l'ordine delle losing streak
+    for campo, valori in numpy.items():
+        if campo != 'losing_streaks':
+            assert np.array_equal(jit[campo], valori, equal_nan=True), campo
+    streak = [sorted(zip(*(r['losing_streaks'][k].tolist()
+                           for k in ('simulazione', 'length', 'max_contratti', 'tick_loss_totali'))))
+              for r in (jit, numpy)]
+    assert streak[0] == streak[1]
+
+
+def test_parita_con_il_riferimento():
+    esiti = verifica_parita(200, {'n_scambi': 800}, seed=0)
+    assert esiti == {'numpy': True, **({'numba': True} if NUMBA_DISPONIBILE else {})}
+
+
+@pytest.mark.parametrize('parametri', [{'dimensionamento': nome} for nome in DIMENSIONAMENTI] + [
+    {'dimensionamento': 'evo', 'modalita_safe': True, 'max_contratti': 6},
+    {'dimensionamento': 'evo', 'modalita_safe': True, 'safe_dopo_perdite': 1, 'riduzione_safe': 0.3},
+    {'dimensionamento': 'frazione_fissa', 'capitale_iniziale': 5000, 'max_contratti': 10, 'frazione_rischio': 0.05},
+], ids=lambda parametri: '-'.join(str(v) for v in parametri.values()))
+def test_simula_batch_jit_come_simula_batch(parametri):
+    parametri = {**PARAMETRI_DEFAULT, 'n_scambi': 700, **parametri}
+    uniformi = np.random.default_rng(2).random((400, parametri['n_scambi']))
+    confronta_risultati(simula_batch_jit(400, parametri, uniformi=uniformi, salva_storico=True),
+                        simula_batch(400, parametri, uniformi=uniformi, salva_storico=True))
+
+
+@pytest.mark.parametrize('parametri, n_workers', [
+    ({'n_scambi': 600}, 1),
+    ({'n_scambi': 500, 'stop_loss_ticks': 15, 'take_profit_ticks': 20, 'win_rate': 0.60,
+      'capitale_iniziale': 600, 'max_contratti': 1, 'dimensionamento': 'fisso'}, 1),
+    # Più processi: pool avviato con spawn dopo che il kernel ha già girato qui
+    ({'n_scambi': 400, 'dimensionamento': 'evo', 'modalita_safe': True}, 2),
+])
+def test_esegui_parallelo_jit_come_esegui_parallelo(parametri, n_workers):
+    # Stessi shard e semi: stessi percorsi
+    jit = esegui_parallelo_jit(3000, parametri, seed=1, n_workers=n_workers, dimensione_shard=1000, salva_storico=True)
+    numpy = esegui_parallelo(3000, parametri, seed=1, n_workers=1, dimensione_shard=1000, salva_storico=True)
+    confronta_risultati(jit, numpy)
+
+
+def test_misura_velocita():
+    # Con pytest -s stampa la velocità dei due motori (l'obiettivo è 100 milioni di trade al secondo)
+    velocita = {nome: misura_velocita(20_000, {'n_scambi': 500}, n_workers=1, motore_jit=motore_jit)
+                for nome, motore_jit in (('numpy', False), ('jit', True))}
+    print({nome: f"{v / 1e6:,.1f} milioni di trade/s" for nome, v in velocita.items()})
+    assert all(v > 0 for v in velocita.values())
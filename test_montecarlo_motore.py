@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+import pytest
+
+from montecarlo_motore import PARAMETRI_DEFAULT, BLOCCO_PASSI, DIMENSIONAMENTI, simula_batch, registra_trade
+from montecarlo_portafoglio import simula_portafoglio, fattore_correlazione, normali_correlate, soglie_copula
+
+
+def contratti_riferimento(p, capitale, tick_loss, streak):
+    """Le regole di DIMENSIONAMENTI scritte per un solo percorso, dalle loro descrizioni."""
+    regola = p['dimensionamento']
+    if regola == 'martingala':
+        return min(max(1, math.ceil(tick_loss / p['take_profit_ticks'])), p['max_contratti'])
+    if regola == 'fisso':
+        return p['contratti_iniziali']
+    if regola == 'frazione_fissa':
+        rischio = p['stop_loss_ticks'] * p['valore_tick'] + 2 * p['commissione_per_contratto']
+        return min(max(1, math.floor(capitale * p['frazione_rischio'] / rischio)), p['max_contratti'])
+    # evo: recupero della perdita con le commissioni, più le commissioni del trade successivo
+    commissione = 2 * p['commissione_per_contratto']
+    contratti = 0
+    if tick_loss > 0:
+        perdita = tick_loss * p['valore_tick'] + tick_loss / p['stop_loss_ticks'] * commissione
+        contratti = math.ceil((perdita + p['contratti_iniziali'] * commissione) / (p['valore_tick'] * p['take_profit_ticks']))
+    contratti = min(max(contratti, p['contratti_iniziali']), p['max_contratti'])
+    if p['modalita_safe'] and streak >= p['safe_dopo_perdite']:
+        contratti = max(1, math.floor(contratti * (1 - p['riduzione_safe'])))
+    return contratti
+
+
+def percorso_riferimento(vincite, p):
+    """Il ciclo di run_simulazione (montecarlo_recovery.py), un trade alla volta, con la regola di p."""
+    capitale = picco = p['capitale_iniziale']
+    drawdown = 0.0
+    tick_loss = streak = 0
+    n_contratti = contratti_riferimento(p, capitale, 0, 0)
+    streak_max_contratti = 1
+    losing_streaks = []
+    trade_totali = win_count = 0
+    for is_win in vincite:
+        trade_totali += 1
+        ticks = p['take_profit_ticks'] if is_win else -p['stop_loss_ticks']
+        capitale += ticks * p['valore_tick'] * n_contratti - 2 * p['commissione_per_contratto'] * n_contratti
+        picco = max(picco, capitale)
+        drawdown = max(drawdown, picco - capitale)
+        if is_win:
+            win_count += 1
+            if streak > 0:
+                losing_streaks.append((streak, streak_max_contratti, tick_loss))
+            streak = tick_loss = 0
+            streak_max_contratti = 1
+        else:
+            streak += 1
+            streak_max_contratti = max(streak_max_contratti, n_contratti)
+            tick_loss += p['stop_loss_ticks'] * n_contratti
+        n_contratti = contratti_riferimento(p, capitale, tick_loss, streak)
+        if capitale <= 0:
+            break
+    if streak > 0:
+        losing_streaks.append((streak, streak_max_contratti, tick_loss))
+    return capitale, drawdown, trade_totali, win_count, losing_streaks
+
+
+def confronta(risultati, vincite, p):
+    riferimento = [percorso_riferimento(v, p) for v in vincite]
+    for k, campo in enumerate(('capitale_finale', 'drawdown_massimo')):
+        assert np.allclose(risultati[campo], [r[k] for r in riferimento], rtol=0, atol=1e-6), campo
+    for k, campo in enumerate(('trade_totali', 'win_count'), start=2):
+        assert np.array_equal(risultati[campo], [r[k] for r in riferimento]), campo
+    streaks = risultati['losing_streaks']
+    calcolate = sorted(zip(streaks['simulazione'].tolist(), streaks['length'].tolist(),
+                           streaks['max_contratti'].tolist(), streaks['tick_loss_totali'].tolist()))
+    attese = sorted((i, *s) for i, r in enumerate(riferimento) for s in r[4])
+    assert calcolate == attese
+
+
+CASI = [{'dimensionamento': nome} for nome in DIMENSIONAMENTI] + [
+    {'dimensionamento': 'evo', 'modalita_safe': True, 'max_contratti': 6},
+    {'dimensionamento': 'fisso', 'contratti_iniziali': 2, 'capitale_iniziale': 300},
+    {'dimensionamento': 'frazione_fissa', 'capitale_iniziale': 5000, 'max_contratti': 10},
+]
+
+
+@pytest.mark.parametrize('caso', CASI, ids=lambda caso: '-'.join(str(v) for v in caso.values()))
+def test_simula_batch_come_il_ciclo_di_riferimento(caso):
+    p = {**PARAMETRI_DEFAULT, 'n_scambi': 700, **caso}
+    uniformi = np.random.default_rng(3).random((300, p['n_scambi']))
+    risultati = simula_batch(300, p, uniformi=uniformi)
+    confronta(risultati, uniformi < p['win_rate'], p)
+
+
+@pytest.mark.parametrize('dimensionamento', ['martingala', 'evo'])
+def test_portafoglio_di_uno_strumento_come_il_ciclo_di_riferimento(dimensionamento):
+    # Con un solo strumento il portafoglio è il motore con esiti dalla copula
+    p = {**PARAMETRI_DEFAULT, 'n_scambi': 600, 'dimensionamento': dimensionamento}
+    parametri = {'n_scambi': p['n_scambi'], 'capitale_iniziale': p['capitale_iniziale'],
+                 'strumenti': [{'dimensionamento': dimensionamento}], 'correlazione': 0.0}
+    risultati = simula_portafoglio(200, parametri, rng=np.random.default_rng(5))
+
+    rng = np.random.default_rng(5)
+    fattore = fattore_correlazione(0.0, 1)
+    blocchi = [normali_correlate(min(BLOCCO_PASSI, p['n_scambi'] - inizio), 200, fattore, rng)[:, 0]
+               for inizio in range(0, p['n_scambi'], BLOCCO_PASSI)]
+    vincite = np.concatenate(blocchi).T < soglie_copula([p])[0]
+    confronta(risultati, vincite, p)
+
+
+def test_registra_trade():
+    # Percorsi: streak aperta chiusa da una vincita, perdita che allunga la streak, percorso fermo
+    stato = {
+        'current_streak': np.array([2, 1, 3]),
+        'current_max_contratti': np.array([2.0, 1.0, 3.0]),
+        'tick_loss_accumulati': np.array([57.0, 19.0, 114.0]),
+        'n_contratti': np.array([3.0, 2.0, 4.0]),
+        'trade_totali': np.array([5, 5, 5]),
+        'win_count': np.array([1, 1, 1]),
+        'somma_wins': np.zeros(3),
+        'somma_losses': np.zeros(3),
+        'streak_chiuse': [],
+    }
+    attivo = np.array([True, True, False])
+    is_win = np.array([True, False, False])
+    risultato = np.array([90.0, -50.0, 0.0])
+    registra_trade(stato, is_win, risultato, 19, attivo)
+
+    assert stato['trade_totali'].tolist() == [6, 6, 5]
+    assert stato['win_count'].tolist() == [2, 1, 1]
+    assert stato['somma_wins'].tolist() == [90.0, 0.0, 0.0]
+    assert stato['somma_losses'].tolist() == [0.0, -50.0, 0.0]
+    assert [c.tolist() for c in stato['streak_chiuse'][0]] == [[0], [2], [2], [57]]
+    assert stato['current_streak'].tolist() == [0, 2, 3]
+    assert stato['current_max_contratti'].tolist() == [1.0, 2.0, 3.0]
+    assert stato['tick_loss_accumulati'].tolist() == [0.0, 57.0, 114.0]